@@ -0,0 +1,132 @@
+"""
+Mesure des octets économisés par les GET conditionnels (ETag / If-None-Match).
+
+Simule des clients qui interrogent régulièrement `GET /invoices/list` et
+`GET /invoices/{id}` pendant que quelques factures changent, une fois sans
+revalidation (le client recharge tout) et une fois en renvoyant l'ETag reçu.
+La base est remplacée par un jeu de factures en mémoire, seules les routes
+et leur sérialisation sont exercées.
+
+    cd backend && python -m benchmarks.conditional_get
+
+Paramètres : COND_GET_INVOICES (taille de la liste), COND_GET_POLLS (nombre
+d'interrogations par client), COND_GET_CHANGE_EVERY (une facture modifiée
+toutes les N interrogations).
+"""
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+INVOICES = int(os.getenv("COND_GET_INVOICES", "200"))
+POLLS = int(os.getenv("COND_GET_POLLS", "100"))
+CHANGE_EVERY = int(os.getenv("COND_GET_CHANGE_EVERY", "10"))
+
+USER = {"id": "bench-user", "username": "bench", "email": "bench@example.com"}
+
+
+class FakeInvoices:
+    """Table `invoices` en mémoire avec un change_seq comme en base"""
+
+    def __init__(self, count: int):
+        self.seq = 0
+        self.rows = {}
+        now = datetime.now()
+        for i in range(count):
+            invoice_id = str(uuid.uuid4())
+            self.rows[invoice_id] = {
+                "id": invoice_id,
+                "user_id": USER["id"],
+                "invoice_number": f"F-{i:05d}",
+                "amount": 1000.0 + i,
+                "status": "validated",
+                "client": f"Client {i}",
+                "created_date": now,
+                "due_date": now + timedelta(days=30),
+                "financing_date": None,
+                "score": 0.5,
+                "change_seq": self._next(),
+            }
+
+    def _next(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def touch(self, invoice_id: str):
+        self.rows[invoice_id]["amount"] += 1
+        self.rows[invoice_id]["change_seq"] = self._next()
+
+    async def get_user_invoices(self, user_id):
+        return [dict(row) for row in self.rows.values()]
+
+    async def get_user_invoices_version(self, user_id):
+        return self.seq
+
+    async def get_invoice_by_id(self, invoice_id):
+        row = self.rows.get(invoice_id)
+        return dict(row) if row else None
+
+
+def _poll(client, url: str, revalidate: bool, on_poll) -> dict:
+    etag = None
+    stats = {"requests": 0, "not_modified": 0, "bytes": 0, "seconds": 0.0}
+    for i in range(POLLS):
+        on_poll(i)
+        headers = {"If-None-Match": etag} if revalidate and etag else {}
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        stats["seconds"] += time.perf_counter() - start
+        stats["requests"] += 1
+        stats["bytes"] += len(response.content)
+        if response.status_code == 304:
+            stats["not_modified"] += 1
+        else:
+            assert response.status_code == 200, response.text
+            etag = response.headers.get("ETag")
+    return stats
+
+
+def main():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from dependencies import get_current_user
+    from routers import invoice as invoice_router
+
+    fake = FakeInvoices(INVOICES)
+    for name in ("get_user_invoices", "get_user_invoices_version", "get_invoice_by_id"):
+        setattr(invoice_router, name, getattr(fake, name))
+
+    app = FastAPI()
+    app.include_router(invoice_router.router, prefix="/invoices")
+    app.dependency_overrides[get_current_user] = lambda: USER
+    client = TestClient(app)
+
+    ids = list(fake.rows)
+    single_id = ids[0]
+
+    def change_any(i):
+        if i and i % CHANGE_EVERY == 0:
+            fake.touch(ids[i % len(ids)])
+
+    def change_single(i):
+        if i and i % CHANGE_EVERY == 0:
+            fake.touch(single_id)
+
+    scenarios = [
+        ("GET /invoices/list", "/invoices/list", change_any),
+        ("GET /invoices/{id}", f"/invoices/{single_id}", change_single),
+    ]
+    print(f"{INVOICES} invoices, {POLLS} polls, one change every {CHANGE_EVERY} polls\n")
+    for label, url, on_poll in scenarios:
+        full = _poll(client, url, revalidate=False, on_poll=on_poll)
+        conditional = _poll(client, url, revalidate=True, on_poll=on_poll)
+        saved = full["bytes"] - conditional["bytes"]
+        print(label)
+        print(f"  without ETag: {full['bytes']:>10} bytes  {full['seconds'] * 1000:8.1f} ms")
+        print(f"  with ETag:    {conditional['bytes']:>10} bytes  {conditional['seconds'] * 1000:8.1f} ms"
+              f"  ({conditional['not_modified']}/{conditional['requests']} not modified)")
+        print(f"  saved:        {saved:>10} bytes  ({saved / max(full['bytes'], 1):.0%})\n")
+
+
+if __name__ == "__main__":
+    main()
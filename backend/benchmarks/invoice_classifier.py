@@ -0,0 +1,108 @@
+"""
+Benchmark du classifieur local de factures (services.invoice_classifier).
+
+Le corpus est celui du benchmark OCR (voir benchmarks.ocr_profiles) : des PDF
+accompagnés d'un fichier JSON de même nom. Les documents qui ne sont pas des
+factures (devis, bons de commande, bulletins de paie, ...) portent
+`"is_invoice": false` dans leur JSON ; les autres sont des factures. Le texte
+OCR de chaque PDF est mis en cache dans un fichier .txt à côté du PDF.
+
+Pour les décisions locales, on mesure la précision et le rappel (classe
+"facture"), la part de documents laissés au LLM et le temps de classification :
+
+    cd backend && python -m benchmarks.invoice_classifier path/to/corpus
+
+Avec --llm, les documents ambigus sont envoyés au LLM comme en production et
+les mêmes mesures sont données pour la chaîne complète.
+"""
+import asyncio
+import os
+import sys
+import time
+
+from benchmarks.ocr_profiles import load_corpus
+from services.invoice_classifier import INVOICE_CLASSIFIER_ACCEPT, INVOICE_CLASSIFIER_REJECT, classify
+
+
+def ocr_text(pdf_path: str) -> str:
+    cache = os.path.splitext(pdf_path)[0] + ".txt"
+    if os.path.exists(cache):
+        with open(cache) as f:
+            return f.read()
+
+    import pytesseract
+    from pdf2image import convert_from_bytes
+    from services.ocr_profiles import get_profile, preprocess_image
+
+    profile = get_profile(None)
+    with open(pdf_path, "rb") as f:
+        images = convert_from_bytes(f.read(), dpi=profile.dpi, grayscale=profile.grayscale)
+    text = "\n".join(
+        pytesseract.image_to_string(preprocess_image(image, profile), lang=profile.lang, config=profile.tesseract_config)
+        for image in images
+    )
+    with open(cache, "w") as f:
+        f.write(text)
+    return text
+
+
+def precision_recall(pairs: list) -> dict:
+    """pairs : (attendu, prédit) pour les documents décidés"""
+    true_positives = sum(1 for expected, predicted in pairs if expected and predicted)
+    predicted_positives = sum(1 for _, predicted in pairs if predicted)
+    positives = sum(1 for expected, _ in pairs if expected)
+    return {
+        "documents": len(pairs),
+        "precision": round(true_positives / predicted_positives, 3) if predicted_positives else None,
+        "recall": round(true_positives / positives, 3) if positives else None,
+        "errors": sum(1 for expected, predicted in pairs if expected != predicted),
+    }
+
+
+def main() -> int:
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    use_llm = "--llm" in sys.argv
+    if len(args) != 1:
+        print(__doc__)
+        return 2
+    corpus = load_corpus(args[0])
+    if not corpus:
+        print("No annotated PDF found in corpus")
+        return 2
+
+    documents = [(ocr_text(pdf_path), expected.get("is_invoice", True), pdf_path) for pdf_path, expected in corpus]
+
+    started = time.perf_counter()
+    results = [classify(text) for text, _, _ in documents]
+    elapsed_us = (time.perf_counter() - started) * 1e6 / len(documents)
+
+    decided = [(expected, result.is_invoice) for (_, expected, _), result in zip(documents, results) if not result.ambiguous]
+    local = precision_recall(decided)
+    print(f"Thresholds: accept >= {INVOICE_CLASSIFIER_ACCEPT}, reject <= {INVOICE_CLASSIFIER_REJECT}")
+    print(f"Documents: {len(documents)} ({sum(1 for _, expected, _ in documents if not expected)} non-invoices)")
+    print(f"Local decisions: {local['documents']}  precision {local['precision']}  recall {local['recall']}  "
+          f"errors {local['errors']}")
+    print(f"Sent to the LLM (ambiguous): {len(documents) - len(decided)} "
+          f"({(len(documents) - len(decided)) / len(documents):.1%})")
+    print(f"Classification time: {elapsed_us:.1f} us/document")
+    for (_, expected, pdf_path), result in zip(documents, results):
+        if not result.ambiguous and result.is_invoice != expected:
+            print(f"  misclassified {os.path.basename(pdf_path)}: score {result.score} {result.signals}")
+
+    if use_llm:
+        from services.ocr_service import _llm_is_invoice
+
+        async def decide(text, result):
+            return result.is_invoice if not result.ambiguous else await _llm_is_invoice(text)
+
+        async def run_all():
+            return await asyncio.gather(*(decide(text, result) for (text, _, _), result in zip(documents, results)))
+
+        predictions = asyncio.run(run_all())
+        overall = precision_recall([(expected, predicted) for (_, expected, _), predicted in zip(documents, predictions)])
+        print(f"With LLM fallback: precision {overall['precision']}  recall {overall['recall']}  errors {overall['errors']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
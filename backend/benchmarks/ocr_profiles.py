@@ -0,0 +1,117 @@
+"""
+Benchmark des profils OCR sur un corpus de factures.
+
+Le corpus est un dossier contenant des PDF et, pour chacun, un fichier JSON de
+même nom avec les valeurs attendues des champs (invoice_number, client, amount,
+due_date, client_siren...). Pour chaque profil, on mesure :
+- le temps CPU par page (processus courant + sous-processus Tesseract/poppler) ;
+- la précision : part des valeurs attendues retrouvées dans le texte OCR.
+
+Le profil recommandé est le moins coûteux dont la précision est au moins égale
+à celle du profil historique (`legacy`) :
+
+    cd backend && python -m benchmarks.ocr_profiles path/to/corpus
+"""
+import json
+import os
+import re
+import resource
+import sys
+import unicodedata
+
+from services.ocr_profiles import PROFILES, preprocess_image
+
+
+def _normalize(value: str) -> str:
+    value = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]", "", value.lower())
+
+
+def _expected_values(expected: dict) -> list:
+    values = []
+    for field, value in expected.items():
+        # is_invoice : annotation du benchmark benchmarks.invoice_classifier, pas un champ
+        if field == "is_invoice" or value in (None, ""):
+            continue
+        if field == "amount":
+            # "1250.0" doit matcher "1 250,00"
+            values.append(_normalize(f"{float(value):.2f}"))
+        elif field == "due_date":
+            year, month, day = str(value)[:10].split("-")
+            values.append([_normalize(f"{day}/{month}/{year}"), _normalize(f"{year}-{month}-{day}")])
+        else:
+            values.append(_normalize(value))
+    return values
+
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_profile(profile, corpus: list) -> dict:
+    import pytesseract
+    from pdf2image import convert_from_bytes
+
+    pages = 0
+    found = 0
+    expected_total = 0
+    started = _cpu_seconds()
+    for pdf_path, expected in corpus:
+        with open(pdf_path, "rb") as f:
+            images = convert_from_bytes(f.read(), dpi=profile.dpi, grayscale=profile.grayscale)
+        text = "".join(
+            pytesseract.image_to_string(preprocess_image(image, profile), lang=profile.lang, config=profile.tesseract_config)
+            for image in images
+        )
+        pages += len(images)
+        normalized_text = _normalize(text)
+        for value in _expected_values(expected):
+            candidates = value if isinstance(value, list) else [value]
+            expected_total += 1
+            found += any(candidate and candidate in normalized_text for candidate in candidates)
+    cpu = _cpu_seconds() - started
+    return {
+        "profile": profile.name,
+        "pages": pages,
+        "cpu_ms_per_page": round(cpu * 1000 / pages, 1) if pages else None,
+        "field_accuracy": round(found / expected_total, 3) if expected_total else None,
+    }
+
+
+def load_corpus(directory: str) -> list:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        expected_path = os.path.join(directory, os.path.splitext(name)[0] + ".json")
+        if not os.path.exists(expected_path):
+            continue
+        with open(expected_path) as f:
+            corpus.append((os.path.join(directory, name), json.load(f)))
+    return corpus
+
+
+def main() -> int:
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return 2
+    corpus = load_corpus(sys.argv[1])
+    if not corpus:
+        print("No annotated PDF found in corpus")
+        return 2
+
+    results = [run_profile(profile, corpus) for profile in PROFILES.values()]
+    for result in results:
+        print(f"{result['profile']:<10} {result['cpu_ms_per_page']:>10} ms/page  accuracy {result['field_accuracy']}")
+
+    baseline = next(r for r in results if r["profile"] == "legacy")
+    eligible = [r for r in results if (r["field_accuracy"] or 0) >= (baseline["field_accuracy"] or 0)]
+    best = min(eligible, key=lambda r: r["cpu_ms_per_page"])
+    print(f"Recommended default OCR_PROFILE: {best['profile']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
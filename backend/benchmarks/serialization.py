@@ -0,0 +1,100 @@
+"""
+Microbenchmark de la sérialisation des réponses factures.
+
+Compare, sur des listes de 1 000 et 10 000 lignes telles que renvoyées par Supabase
+(dates en chaînes) :
+- le chemin générique de FastAPI (validation `response_model`, `jsonable_encoder`,
+  `json.dumps`) ;
+- le même chemin avec `ORJSONResponse` ;
+- le codec en une passe de `serialization.py` (`TypeAdapter` précompilé).
+
+    cd backend && python -m benchmarks.serialization
+
+Tailles configurables via SERIALIZATION_BENCH_SIZES (ex. "1000,10000").
+"""
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+SIZES = [int(size) for size in os.getenv("SERIALIZATION_BENCH_SIZES", "1000,10000").split(",")]
+REPEAT = int(os.getenv("SERIALIZATION_BENCH_REPEAT", "5"))
+
+
+def make_rows(count: int) -> list:
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(count):
+        due = now + timedelta(days=i % 90)
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "user_id": "bench-user",
+            "invoice_number": f"F-{i:06d}",
+            "client": f"Client {i % 500}",
+            "amount": 100.0 + i,
+            "currency": "EUR",
+            # Les deux formes renvoyées par Supabase
+            "created_date": now.isoformat() if i % 2 else now.strftime("%Y-%m-%d %H:%M:%S+00"),
+            "due_date": due.isoformat(),
+            "financing_date": None,
+            "status": "validated",
+            "score": 0.42,
+            "possible_financing": 80.0 + i,
+            "line_items": [],
+            "change_seq": i,
+        })
+    return rows
+
+
+def best_of(fn, repeat: int = REPEAT) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import ORJSONResponse
+    from models.invoice import InvoiceListResponse
+    from serialization import INVOICE_LIST_ADAPTER, encode_invoice_list
+
+    def generic(rows):
+        # Ce que fait FastAPI pour un `response_model` sans codec dédié
+        models = [InvoiceListResponse.model_validate(row) for row in rows]
+        return json.dumps(jsonable_encoder(models)).encode()
+
+    def generic_orjson(rows):
+        models = [InvoiceListResponse.model_validate(row) for row in rows]
+        return ORJSONResponse(jsonable_encoder(models)).body
+
+    def adapter_orjson(rows):
+        return ORJSONResponse(INVOICE_LIST_ADAPTER.dump_python(
+            INVOICE_LIST_ADAPTER.validate_python(rows), mode="json"
+        )).body
+
+    paths = [
+        ("response_model + json", generic),
+        ("response_model + orjson", generic_orjson),
+        ("TypeAdapter + orjson", adapter_orjson),
+        ("TypeAdapter dump_json (codec)", encode_invoice_list),
+    ]
+
+    for size in SIZES:
+        rows = make_rows(size)
+        reference = json.loads(encode_invoice_list(rows))
+        print(f"{size} rows")
+        baseline = None
+        for label, fn in paths:
+            assert json.loads(fn(rows)) == reference, f"{label} output differs"
+            ms = best_of(lambda: fn(rows))
+            baseline = baseline or ms
+            print(f"  {label:<32} {ms:8.1f} ms  {ms * 1000 / size:6.1f} µs/row  x{baseline / ms:.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
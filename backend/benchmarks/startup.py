@@ -0,0 +1,91 @@
+"""
+Benchmark du démarrage à froid de l'API.
+
+Mesure, dans un processus Python neuf :
+- le temps d'import de `main` ;
+- le temps jusqu'à la première requête servie (lifespan inclus) ;
+- l'absence des dépendances lourdes (LangChain, OpenAI, Tesseract, ...) après l'import.
+
+Le script sort en erreur si un budget est dépassé, ce qui permet de l'utiliser
+comme garde-fou en CI :
+
+    cd backend && python -m benchmarks.startup
+
+Budgets configurables via STARTUP_IMPORT_BUDGET_MS et STARTUP_FIRST_REQUEST_BUDGET_MS ;
+tests/test_startup.py les vérifie aussi avec la suite de tests (une seule mesure).
+"""
+import json
+import os
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+FIRST_REQUEST_BUDGET_MS = float(os.getenv("STARTUP_FIRST_REQUEST_BUDGET_MS", "2500"))
+RUNS = int(os.getenv("STARTUP_BENCH_RUNS", "5"))
+
+# Modules qui ne doivent être chargés qu'à la première utilisation
+HEAVY_MODULES = ["langchain_text_splitters", "tiktoken", "openai", "pytesseract", "pdf2image", "PIL"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    response = client.get("/openapi.json")
+t2 = time.perf_counter()
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_request_ms": (t2 - t0) * 1000,
+    "status": response.status_code,
+    "heavy_modules": heavy,
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_probe() -> dict:
+    env = dict(os.environ)
+    # Pas d'appel réseau vers PandaDoc pendant la mesure
+    env.setdefault("APP_URL", "")
+    env.setdefault("SUPABASE_URL", "http://localhost:54321")
+    env.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    results = [run_probe() for _ in range(RUNS)]
+    import_ms = sorted(r["import_ms"] for r in results)[len(results) // 2]
+    first_request_ms = sorted(r["first_request_ms"] for r in results)[len(results) // 2]
+    heavy = sorted({m for r in results for m in r["heavy_modules"]})
+
+    print(f"import main (median of {RUNS}):      {import_ms:8.1f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    print(f"time to first request (median):  {first_request_ms:8.1f} ms (budget {FIRST_REQUEST_BUDGET_MS:.0f} ms)")
+    print(f"heavy modules loaded at import:  {heavy or 'none'}")
+
+    failures = []
+    if import_ms > IMPORT_BUDGET_MS:
+        failures.append("import time over budget")
+    if first_request_ms > FIRST_REQUEST_BUDGET_MS:
+        failures.append("time to first request over budget")
+    if heavy:
+        failures.append(f"heavy modules imported eagerly: {heavy}")
+    if any(r["status"] != 200 for r in results):
+        failures.append("first request did not succeed")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,30 @@
 from .supabase_client import supabase
 from fastapi import HTTPException
-from datetime import datetime
+from postgrest.exceptions import APIError
+from datetime import datetime, timezone
 import uuid
 import os
 from dotenv import load_dotenv
 import logging
+from timestamps import format_datetime
 
 load_dotenv()
 FRONTEND_URL = os.getenv('FRONTEND_URL')
 
+# Code Postgres d'une violation de contrainte d'unicité
+UNIQUE_VIOLATION = '23505'
+
+def _is_unique_violation(e: Exception) -> bool:
+    """Erreur PostgREST due à une contrainte d'unicité (et non au message, qui peut changer)"""
+    return isinstance(e, APIError) and e.code == UNIQUE_VIOLATION
+
+def _touch(data: dict) -> dict:
+    """
+    Horodate une écriture sur la table invoices (utilisé par le flux de changements)
+    """
+    data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    return data
+
 async def find_user(username: str):
     try:
         response = supabase.from_('users')\
@@ -57,7 +73,7 @@ async def insert_user(username: str, email: str, password: str, siren_number: st
         
     except Exception as e:
         logging.error(f"Error inserting user: {str(e)}")
-        if "duplicate key" in str(e).lower():
+        if _is_unique_violation(e):
             raise HTTPException(status_code=400, detail="Username or email already exists")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
@@ -65,39 +81,40 @@ async def update_user_profile(user_id: str, update_data: dict):
     response = supabase.table('users').update(update_data).eq('id', user_id).execute()
     return response.data[0] if response.data else None
 
+def _prepare_invoice_row(invoice_data: dict) -> dict:
+    """
+    Complète une facture avant insertion (ID, valeurs par défaut, dates ISO)
+    """
+    # Dates en ISO-8601, Supabase s'occupera de la conversion en timestamptz
+    for date_field in ('created_date', 'due_date', 'financing_date'):
+        if date_field in invoice_data:
+            invoice_data[date_field] = format_datetime(invoice_data[date_field])
+    
+    # Ne pas regénérer l'ID s'il existe déjà
+    if 'id' not in invoice_data:
+        invoice_data['id'] = str(uuid.uuid4())
+        
+    # Ensure line_items is an array if not present
+    if 'line_items' not in invoice_data:
+        invoice_data['line_items'] = []
+        
+    # Set default values for required fields if not present
+    if 'client_type' not in invoice_data:
+        invoice_data['client_type'] = 'company'
+    if 'client_country' not in invoice_data:
+        invoice_data['client_country'] = 'FR'
+    if 'currency' not in invoice_data:
+        invoice_data['currency'] = 'EUR'
+    if 'language' not in invoice_data:
+        invoice_data['language'] = 'fr'
+    if 'payment_conditions' not in invoice_data:
+        invoice_data['payment_conditions'] = 'upon_receipt'
+    return _touch(invoice_data)
+
 async def create_invoice(invoice_data: dict):
     try:
         logging.info(f"Creating invoice with data: {invoice_data}")
-        
-        # Pour les dates, on les laisse au format PostgreSQL timestamptz
-        # Supabase s'occupera de la conversion
-        if 'created_date' in invoice_data and isinstance(invoice_data['created_date'], datetime):
-            invoice_data['created_date'] = invoice_data['created_date'].strftime('%Y-%m-%d %H:%M:%S%z')
-        if 'due_date' in invoice_data and isinstance(invoice_data['due_date'], datetime):
-            invoice_data['due_date'] = invoice_data['due_date'].strftime('%Y-%m-%d %H:%M:%S%z')
-        if 'financing_date' in invoice_data and invoice_data['financing_date']:
-            if isinstance(invoice_data['financing_date'], datetime):
-                invoice_data['financing_date'] = invoice_data['financing_date'].strftime('%Y-%m-%d %H:%M:%S%z')
-        
-        # Ne pas regénérer l'ID s'il existe déjà
-        if 'id' not in invoice_data:
-            invoice_data['id'] = str(uuid.uuid4())
-            
-        # Ensure line_items is an array if not present
-        if 'line_items' not in invoice_data:
-            invoice_data['line_items'] = []
-            
-        # Set default values for required fields if not present
-        if 'client_type' not in invoice_data:
-            invoice_data['client_type'] = 'company'
-        if 'client_country' not in invoice_data:
-            invoice_data['client_country'] = 'FR'
-        if 'currency' not in invoice_data:
-            invoice_data['currency'] = 'EUR'
-        if 'language' not in invoice_data:
-            invoice_data['language'] = 'fr'
-        if 'payment_conditions' not in invoice_data:
-            invoice_data['payment_conditions'] = 'upon_receipt'
+        invoice_data = _prepare_invoice_row(invoice_data)
             
         logging.info(f"Inserting invoice into database with final data: {invoice_data}")
         response = supabase.table('invoices').insert(invoice_data).execute()
@@ -116,57 +133,105 @@ async def create_invoice(invoice_data: dict):
             detail=f"Failed to create invoice: {str(e)}"
         )
 
+async def create_invoice_if_absent(invoice_data: dict):
+    """
+    Insère la facture sauf si une facture avec cet ID existe déjà (upsert sans
+    mise à jour, atomique). Retourne None si elle existait.
+    """
+    response = supabase.table('invoices')\
+        .upsert(_prepare_invoice_row(invoice_data), on_conflict='id', ignore_duplicates=True)\
+        .execute()
+    return response.data[0] if response.data else None
+
+async def create_invoices_bulk(invoices: list):
+    """
+    Insère plusieurs factures en une seule requête (INSERT multi-lignes, atomique)
+
+    Returns:
+        Les factures insérées (seulement les colonnes id et invoice_number)
+    """
+    if not invoices:
+        return []
+    rows = [_prepare_invoice_row(invoice) for invoice in invoices]
+    try:
+        supabase.table('invoices')\
+            .insert(rows, returning='minimal')\
+            .execute()
+        logging.info(f"Inserted {len(rows)} invoices")
+        return [{'id': row['id'], 'invoice_number': row.get('invoice_number')} for row in rows]
+    except Exception as e:
+        logging.error(f"Error inserting {len(rows)} invoices: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create invoices: {str(e)}")
+
 async def get_user_invoices(user_id: str):
     try:
         response = supabase.table('invoices')\
             .select('*')\
             .eq('user_id', user_id)\
+            .is_('deleted_at', 'null')\
             .execute()
             
-        invoices = response.data if response.data else []
-        for invoice in invoices:
-            for date_field in ['created_date', 'due_date', 'financing_date']:
-                if invoice.get(date_field):
-                    try:
-                        # Pour les timestamps PostgreSQL, on les laisse tels quels
-                        # car ils sont déjà au bon format pour JavaScript
-                        if isinstance(invoice[date_field], str):
-                            # Assurons-nous que le format est cohérent
-                            if 'T' not in invoice[date_field]:
-                                # Si c'est un format simple comme '2024-02-13 00:00:00+00'
-                                dt = datetime.strptime(invoice[date_field], '%Y-%m-%d %H:%M:%S%z')
-                                invoice[date_field] = dt.isoformat()
-                    except (ValueError, TypeError) as e:
-                        logging.error(f"Error parsing date {date_field}: {e}")
-                        invoice[date_field] = None
-                        
-        return invoices
+        # Les dates restent des chaînes : elles sont parsées une seule fois,
+        # à la sérialisation de la réponse (voir serialization.py)
+        return response.data if response.data else []
+    except Exception as e:
+        logging.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+async def get_batch_invoices(batch_id: str, user_id: str):
+    """
+    Factures d'un lot d'upload (colonnes utiles au suivi de progression)
+    """
+    try:
+        response = supabase.table('invoices')\
+            .select('id, status, invoice_number, error')\
+            .eq('batch_id', batch_id)\
+            .eq('user_id', user_id)\
+            .is_('deleted_at', 'null')\
+            .execute()
+        return response.data or []
+    except Exception as e:
+        logging.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+async def get_user_invoices_version(user_id: str):
+    """
+    Version de la liste des factures d'un utilisateur, suppressions comprises :
+    dernière position (change_xid, change_seq) validée et nombre de lignes.
+    Une écriture validée dans le désordre la change toujours
+    (voir migrations/011_commit_safe_list_version.sql). Utilisée pour les ETags.
+    """
+    try:
+        response = supabase.rpc('get_invoices_version', {'p_user_id': user_id}).execute()
+        row = response.data[0] if response.data else {}
+        return f"{row.get('change_xid') or 0}.{row.get('change_seq') or 0}.{row.get('row_count') or 0}"
     except Exception as e:
         logging.error(f"Database error: {str(e)}")
         raise HTTPException(status_code=500, detail="Database error")
 
 async def update_invoice_status(invoice_id: str, user_id: str, status: str):
     response = supabase.table('invoices')\
-        .update({'status': status})\
+        .update(_touch({'status': status}))\
         .eq('id', invoice_id)\
         .eq('user_id', user_id)\
         .execute()
     return response.data[0] if response.data else None 
 
-async def update_user_id_document(username: str, file_path: str):
+async def update_user_id_document(user_id: str, blob_key: str):
+    """
+    Enregistre la clé (blob store) de la pièce d'identité d'un utilisateur
+    """
     try:
-        full_url = f"{FRONTEND_URL}/user_documents/{os.path.basename(file_path)}"
-        
         # Update the user record in Supabase
         response = supabase.table('users')\
             .update({
-                'id_document': full_url,
+                'id_document': blob_key,
                 'id_document_status': 'pending'
             })\
-            .eq('username', username)\
+            .eq('id', user_id)\
             .execute()
         
-        logging.info(f"Update user ID document for {username}: {response}")
+        logging.info(f"Update user ID document for {user_id}: {response}")
         
         if response.data:
             return response.data[0]
@@ -194,16 +259,12 @@ async def find_user_by_email(email: str):
 # Ajout de la fonction create_user
 async def create_user(user_data: dict):
     try:
-        # Vérifier si l'utilisateur existe déjà
-        existing_user = await find_user_by_email(user_data['email'])
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Email already registered")
-
         # S'assurer que l'ID est présent
         if 'id' not in user_data:
             user_data['id'] = str(uuid.uuid4())
 
-        # Insérer l'utilisateur dans la table users
+        # Insérer l'utilisateur dans la table users ; l'unicité de l'email est
+        # garantie par la contrainte, sans lecture préalable
         response = supabase.table('users').insert(user_data).execute()
         
         if not response.data:
@@ -211,14 +272,38 @@ async def create_user(user_data: dict):
             
         return response.data[0]
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error creating user: {str(e)}")
+        if _is_unique_violation(e):
+            raise HTTPException(status_code=400, detail="Email already registered")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def create_user_if_absent(user_data: dict):
+    """
+    Insère l'utilisateur sauf s'il existe déjà (upsert sans mise à jour, un seul
+    aller-retour). Retourne None si un utilisateur avec cet ID existait.
+    """
+    try:
+        response = supabase.table('users')\
+            .upsert(user_data, on_conflict='id', ignore_duplicates=True)\
+            .execute()
+    except APIError as e:
+        # Autre utilisateur avec le même email
+        if _is_unique_violation(e):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        raise
+    return response.data[0] if response.data else None
+
 async def get_invoice_by_id(invoice_id: str):
     try:
         logging.info(f"Fetching invoice with ID: {invoice_id}")
-        response = supabase.table('invoices').select('*').eq('id', invoice_id).execute()
+        response = supabase.table('invoices')\
+            .select('*')\
+            .eq('id', invoice_id)\
+            .is_('deleted_at', 'null')\
+            .execute()
         
         if not response.data:
             logging.warning(f"No invoice found with ID: {invoice_id}")
@@ -235,14 +320,14 @@ async def get_invoice_by_id(invoice_id: str):
 
 async def update_invoice_pennylane_id(invoice_id: str, pennylane_id: str):
     response = supabase.table('invoices')\
-        .update({'pennylane_id': pennylane_id})\
+        .update(_touch({'pennylane_id': pennylane_id}))\
         .eq('id', invoice_id)\
         .execute()
     return response.data[0] if response.data else None
 
 async def update_invoice_pandadoc_id(invoice_id: str, pandadoc_id: str):
     response = supabase.table('invoices')\
-        .update({'pandadoc_id': pandadoc_id})\
+        .update(_touch({'pandadoc_id': pandadoc_id}))\
         .eq('id', invoice_id)\
         .execute()
     return response.data[0] if response.data else None
@@ -259,10 +344,10 @@ async def update_invoice_score(invoice_id: str, score: float, possible_financing
     Update the score and possible financing amount for an invoice
     """
     response = supabase.table('invoices')\
-        .update({
+        .update(_touch({
             'score': score,
             'possible_financing': possible_financing
-        })\
+        }))\
         .eq('id', invoice_id)\
         .execute()
     return response.data[0] if response.data else None
@@ -280,15 +365,12 @@ async def update_invoice(invoice_id: str, update_data: dict):
     """
     try:
         # Convertir les dates en chaînes ISO si présentes
-        if 'created_date' in update_data:
-            update_data['created_date'] = update_data['created_date'].isoformat()
-        if 'due_date' in update_data:
-            update_data['due_date'] = update_data['due_date'].isoformat()
-        if 'financing_date' in update_data and update_data['financing_date']:
-            update_data['financing_date'] = update_data['financing_date'].isoformat()
+        for date_field in ('created_date', 'due_date', 'financing_date'):
+            if date_field in update_data:
+                update_data[date_field] = format_datetime(update_data[date_field])
 
         response = supabase.table('invoices')\
-            .update(update_data)\
+            .update(_touch(update_data))\
             .eq('id', invoice_id)\
             .execute()
             
@@ -299,4 +381,244 @@ async def update_invoice(invoice_id: str, update_data: dict):
         
     except Exception as e:
         logging.error(f"Error updating invoice: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Résultats de update_owned_invoice (voir migrations/003_owned_invoice_update.sql)
+OWNED_UPDATE_ERRORS = {
+    'not_found': (404, "Invoice not found"),
+    'forbidden': (403, "Not authorized to modify this invoice"),
+    'conflict': (409, "Invoice is not in the expected status"),
+}
+
+async def update_owned_invoice(invoice_id: str, user_id: str, update_data: dict,
+                               expected_status: str = None, errors: dict = None):
+    """
+    Met à jour une facture si elle appartient à `user_id` (None : facture d'onboarding
+    sans propriétaire), et éventuellement si elle est au statut `expected_status`.
+    Un seul aller-retour : le prédicat est appliqué dans l'UPDATE ... RETURNING.
+
+    Args:
+        errors: messages à utiliser à la place de OWNED_UPDATE_ERRORS
+
+    Returns:
+        La facture mise à jour
+
+    Raises:
+        HTTPException: 404 si la facture n'existe pas, 403 si elle appartient à un
+        autre utilisateur, 409 si son statut n'est pas celui attendu
+    """
+    for date_field in ('created_date', 'due_date', 'financing_date'):
+        if date_field in update_data:
+            update_data[date_field] = format_datetime(update_data[date_field])
+
+    try:
+        response = supabase.rpc('update_owned_invoice', {
+            'p_invoice_id': invoice_id,
+            'p_user_id': user_id,
+            'p_patch': _touch(update_data),
+            'p_expected_status': expected_status
+        }).execute()
+    except Exception as e:
+        logging.error(f"Error updating invoice {invoice_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    result = response.data or {}
+    if result.get('status') == 'ok':
+        return result['invoice']
+    status_code, detail = {**OWNED_UPDATE_ERRORS, **(errors or {})}.get(
+        result.get('status'), (500, "Unexpected update result")
+    )
+    raise HTTPException(status_code=status_code, detail=detail)
+
+async def update_invoices_bulk(updates: list, user_id: str = None):
+    """
+    Applique des modifications sur plusieurs factures en une transaction
+    (voir migrations/004_bulk_invoice_update.sql)
+
+    Args:
+        updates: liste de {'id': ..., 'patch': {...}}
+        user_id: si renseigné, limite les modifications aux factures de cet utilisateur
+
+    Returns:
+        Les factures modifiées
+    """
+    if not updates:
+        return []
+    for update in updates:
+        patch = update['patch']
+        for date_field in ('created_date', 'due_date', 'financing_date'):
+            if date_field in patch:
+                patch[date_field] = format_datetime(patch[date_field])
+        _touch(patch)
+    try:
+        response = supabase.rpc('update_invoices_bulk', {
+            'p_updates': updates,
+            'p_user_id': user_id
+        }).execute()
+        return response.data or []
+    except Exception as e:
+        logging.error(f"Error updating {len(updates)} invoices: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+async def get_owned_invoice(invoice_id: str, user_id: str,
+                            detail: str = "Not authorized to access this invoice"):
+    """
+    Lit une facture et vérifie son propriétaire (404 si elle n'existe pas, 403 sinon)
+    """
+    invoice = await get_invoice_by_id(invoice_id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    if invoice.get('user_id') != user_id:
+        raise HTTPException(status_code=403, detail=detail)
+    return invoice
+
+async def update_invoice_status_by_pandadoc_id(pandadoc_id: str, status: str):
+    """
+    Met à jour le statut de la facture liée à un document PandaDoc, sans la relire avant
+    """
+    response = supabase.table('invoices')\
+        .update(_touch({'status': status}))\
+        .eq('pandadoc_id', pandadoc_id)\
+        .is_('deleted_at', 'null')\
+        .execute()
+    return response.data[0] if response.data else None
+
+async def soft_delete_invoice(invoice_id: str, user_id: str):
+    """
+    Supprime logiquement une facture : elle disparaît des lectures mais reste
+    visible comme suppression dans le flux de changements
+    """
+    response = supabase.table('invoices')\
+        .update(_touch({'deleted_at': datetime.now(timezone.utc).isoformat()}))\
+        .eq('id', invoice_id)\
+        .eq('user_id', user_id)\
+        .is_('deleted_at', 'null')\
+        .execute()
+    if not response.data:
+        return None
+    # Le PDF n'est plus utilisé par cette facture : le garbage collector pourra le supprimer
+    await release_blob_reference('invoice', invoice_id)
+    return response.data[0]
+
+async def get_invoice_changes(user_id: str, since_xid: int, since_seq: int, limit: int):
+    """
+    Retourne les factures de l'utilisateur créées, modifiées ou supprimées
+    depuis le curseur (since_xid, since_seq), dans l'ordre des changements.
+    Seules les écritures de transactions terminées avant toutes celles en cours
+    sont renvoyées (voir migrations/009_commit_safe_change_feed.sql).
+
+    Returns:
+        Les lignes modifiées (au plus `limit`) et un booléen indiquant s'il en reste
+    """
+    try:
+        response = supabase.rpc('get_invoice_changes', {
+            'p_user_id': user_id,
+            'p_since_xid': str(since_xid),
+            'p_since_seq': since_seq,
+            'p_limit': limit + 1
+        }).execute()
+        rows = response.data or []
+        return rows[:limit], len(rows) > limit
+    except Exception as e:
+        logging.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+async def set_blob_reference(owner_type: str, owner_id: str, blob_key: str):
+    """
+    Associe un blob à son propriétaire (remplace la référence précédente s'il y en a une)
+    """
+    response = supabase.table('blob_refs')\
+        .upsert({
+            'owner_type': owner_type,
+            'owner_id': owner_id,
+            'blob_key': blob_key
+        }, on_conflict='owner_type,owner_id')\
+        .execute()
+    return response.data[0] if response.data else None
+
+async def set_blob_references_bulk(owner_type: str, references: dict):
+    """
+    Variante de set_blob_reference pour plusieurs propriétaires (un seul upsert)
+
+    Args:
+        references: {owner_id: blob_key}
+    """
+    if not references:
+        return []
+    response = supabase.table('blob_refs')\
+        .upsert([
+            {'owner_type': owner_type, 'owner_id': owner_id, 'blob_key': blob_key}
+            for owner_id, blob_key in references.items()
+        ], on_conflict='owner_type,owner_id')\
+        .execute()
+    return response.data or []
+
+async def release_blob_reference(owner_type: str, owner_id: str):
+    supabase.table('blob_refs')\
+        .delete()\
+        .eq('owner_type', owner_type)\
+        .eq('owner_id', owner_id)\
+        .execute()
+
+async def get_referenced_blob_keys(blob_keys: list) -> set:
+    """
+    Retourne le sous-ensemble des clés encore référencées par au moins un propriétaire
+    """
+    if not blob_keys:
+        return set()
+    response = supabase.table('blob_refs')\
+        .select('blob_key')\
+        .in_('blob_key', blob_keys)\
+        .execute()
+    return {row['blob_key'] for row in (response.data or [])}
+
+async def get_invoices_page(columns: str, after_id: str = None, limit: int = 1000):
+    """
+    Page de factures (non supprimées) triées par id, pour les traitements par lots :
+    passer l'id de la dernière ligne reçue pour obtenir la page suivante
+    """
+    query = supabase.table('invoices')\
+        .select(columns)\
+        .is_('deleted_at', 'null')
+    if after_id:
+        query = query.gt('id', after_id)
+    response = query.order('id').limit(limit).execute()
+    return response.data or []
+
+async def get_users_siren_numbers(user_ids: list) -> dict:
+    """
+    SIREN des utilisateurs donnés : {user_id: siren_number}
+    """
+    if not user_ids:
+        return {}
+    response = supabase.table('users')\
+        .select('id, siren_number')\
+        .in_('id', user_ids)\
+        .execute()
+    return {row['id']: row.get('siren_number') for row in (response.data or [])}
+
+async def get_open_invoices_page(columns: str, excluded_statuses: list, after_id: str = None, limit: int = 200):
+    """
+    Page de factures ouvertes (statut hors `excluded_statuses`) triées par id
+    """
+    query = supabase.table('invoices')\
+        .select(columns)\
+        .is_('deleted_at', 'null')\
+        .not_.in_('status', excluded_statuses)
+    if after_id:
+        query = query.gt('id', after_id)
+    response = query.order('id').limit(limit).execute()
+    return response.data or []
+
+async def find_invoices_by_lsh_bands(user_id: str, bands: list, exclude_id: str = None, limit: int = 20):
+    """
+    Factures de l'utilisateur qui partagent au moins une bande LSH (candidates
+    à la détection des doublons), celles qui en partagent le plus d'abord
+    """
+    response = supabase.rpc('find_invoices_by_lsh_bands', {
+        'p_user_id': user_id,
+        'p_bands': bands,
+        'p_exclude_id': exclude_id,
+        'p_limit': limit
+    }).execute()
+    return response.data or []
@@ -0,0 +1,12 @@
+-- Références vers les fichiers du blob store (services/blob_store.py).
+-- Un propriétaire (facture, pièce d'identité d'un utilisateur...) référence au plus
+-- un blob ; un blob sans aucune ligne ici est supprimé par le garbage collector.
+create table if not exists blob_refs (
+    owner_type text not null,
+    owner_id text not null,
+    blob_key text not null,
+    created_at timestamptz not null default now(),
+    primary key (owner_type, owner_id)
+);
+
+create index if not exists blob_refs_blob_key_idx on blob_refs (blob_key);
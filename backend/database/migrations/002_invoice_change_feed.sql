@@ -0,0 +1,23 @@
+-- Flux de changements des factures (GET /invoices/changes).
+-- `change_seq` est renuméroté à chaque insertion/mise à jour et sert de curseur ;
+-- `updated_at` est renseigné par database/db.py ; les suppressions sont logiques
+-- (`deleted_at`) pour pouvoir être propagées aux clients.
+create sequence if not exists invoice_change_seq;
+
+alter table invoices add column if not exists updated_at timestamptz not null default now();
+alter table invoices add column if not exists deleted_at timestamptz;
+alter table invoices add column if not exists change_seq bigint not null default nextval('invoice_change_seq');
+
+create or replace function invoices_bump_change_seq() returns trigger as $$
+begin
+    new.change_seq := nextval('invoice_change_seq');
+    return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists invoices_bump_change_seq on invoices;
+create trigger invoices_bump_change_seq
+    before update on invoices
+    for each row execute function invoices_bump_change_seq();
+
+create index if not exists invoices_user_change_seq_idx on invoices (user_id, change_seq);
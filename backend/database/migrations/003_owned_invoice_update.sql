@@ -0,0 +1,67 @@
+-- Mise à jour d'une facture limitée à son propriétaire, en un seul aller-retour
+-- (appelée via supabase.rpc par database/db.py:update_owned_invoice).
+--
+-- Le prédicat de propriété (et éventuellement de statut) est appliqué dans le
+-- UPDATE ... RETURNING ; ce n'est qu'en cas d'échec qu'on regarde pourquoi, pour
+-- distinguer facture inexistante / autre propriétaire / statut inattendu.
+-- `p_user_id` à null cible les factures d'onboarding (sans propriétaire).
+--
+-- Résultat : {"status": "ok" | "not_found" | "forbidden" | "conflict", "invoice": {...}}
+create or replace function update_owned_invoice(
+    p_invoice_id invoices.id%type,
+    p_user_id invoices.user_id%type,
+    p_patch jsonb,
+    p_expected_status text default null
+) returns jsonb as $$
+declare
+    v_set text;
+    v_row jsonb;
+    v_current invoices%rowtype;
+begin
+    -- Seules les colonnes existantes sont mises à jour ; id et change_seq ne le sont jamais
+    select string_agg(format('%I = r.%I', c.column_name, c.column_name), ', ')
+      into v_set
+      from information_schema.columns c
+     where c.table_schema = 'public'
+       and c.table_name = 'invoices'
+       and c.column_name not in ('id', 'change_seq')
+       and p_patch ? c.column_name;
+
+    if v_set is null then
+        select * into v_current from invoices where id = p_invoice_id and deleted_at is null;
+        if not found then
+            return jsonb_build_object('status', 'not_found');
+        end if;
+        if v_current.user_id is distinct from p_user_id then
+            return jsonb_build_object('status', 'forbidden');
+        end if;
+        return jsonb_build_object('status', 'ok', 'invoice', to_jsonb(v_current));
+    end if;
+
+    execute format(
+        'update invoices i set %s
+           from jsonb_populate_record(null::invoices, $1) r
+          where i.id = $2
+            and i.user_id is not distinct from $3
+            and i.deleted_at is null
+            and ($4 is null or i.status = $4)
+          returning to_jsonb(i)', v_set)
+      into v_row
+      using p_patch, p_invoice_id, p_user_id, p_expected_status;
+
+    if v_row is not null then
+        return jsonb_build_object('status', 'ok', 'invoice', v_row);
+    end if;
+
+    select * into v_current from invoices where id = p_invoice_id and deleted_at is null;
+    if not found then
+        return jsonb_build_object('status', 'not_found');
+    end if;
+    if v_current.user_id is distinct from p_user_id then
+        return jsonb_build_object('status', 'forbidden');
+    end if;
+    return jsonb_build_object('status', 'conflict', 'invoice', to_jsonb(v_current));
+end;
+$$ language plpgsql;
+
+create index if not exists invoices_pandadoc_id_idx on invoices (pandadoc_id);
@@ -0,0 +1,44 @@
+-- Application groupée de modifications sur plusieurs factures, en une transaction
+-- et un seul aller-retour (database/unit_of_work.py, workers en tâche de fond).
+--
+-- p_updates : [{"id": "...", "patch": {"colonne": valeur, ...}}, ...]
+-- p_user_id : si renseigné, seules les factures de cet utilisateur sont modifiées
+-- Résultat : tableau des lignes modifiées
+create or replace function update_invoices_bulk(
+    p_updates jsonb,
+    p_user_id invoices.user_id%type default null
+) returns jsonb as $$
+declare
+    v_update jsonb;
+    v_set text;
+    v_row jsonb;
+    v_rows jsonb := '[]'::jsonb;
+begin
+    for v_update in select * from jsonb_array_elements(p_updates) loop
+        select string_agg(format('%I = r.%I', c.column_name, c.column_name), ', ')
+          into v_set
+          from information_schema.columns c
+         where c.table_schema = 'public'
+           and c.table_name = 'invoices'
+           and c.column_name not in ('id', 'change_seq')
+           and (v_update -> 'patch') ? c.column_name;
+
+        continue when v_set is null;
+
+        execute format(
+            'update invoices i set %s
+               from jsonb_populate_record(null::invoices, $1) r
+              where i.id = r.id
+                and ($2 is null or i.user_id = $2)
+                and i.deleted_at is null
+              returning to_jsonb(i)', v_set)
+          into v_row
+          using (v_update -> 'patch') || jsonb_build_object('id', v_update -> 'id'), p_user_id;
+
+        if v_row is not null then
+            v_rows := v_rows || jsonb_build_array(v_row);
+        end if;
+    end loop;
+    return v_rows;
+end;
+$$ language plpgsql;
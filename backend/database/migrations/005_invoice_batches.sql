@@ -0,0 +1,5 @@
+-- Lots d'upload (POST /invoices/upload/batch) : les factures créées ensemble
+-- partagent un batch_id, utilisé pour suivre la progression de l'OCR du lot.
+alter table invoices add column if not exists batch_id uuid;
+
+create index if not exists invoices_batch_id_idx on invoices (batch_id) where batch_id is not null;
@@ -0,0 +1,11 @@
+-- Re-scoring incrémental (services/rescoring.py) : empreinte des caractéristiques
+-- et de la version du modèle ayant produit le score, et date du dernier calcul.
+-- Seules les factures dont l'empreinte change sont re-scorées.
+alter table invoices add column if not exists score_fingerprint text;
+alter table invoices add column if not exists scored_at timestamptz;
+
+-- Parcours des factures ouvertes par id (pagination par clé) ; même liste de
+-- statuts que RESCORE_EXCLUDED_STATUSES
+create index if not exists invoices_open_id_idx on invoices (id)
+    where deleted_at is null
+      and status not in ('Signed', 'Paid', 'Rejected', 'Cancelled', 'Demo', 'OCR_PENDING', 'OCR_FAILED');
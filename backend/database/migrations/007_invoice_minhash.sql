@@ -0,0 +1,10 @@
+-- Détection des factures en double (services/duplicates.py) : signature MinHash
+-- du texte et des champs clés, et ses bandes LSH ("<bande>:<hash>"). Deux
+-- factures qui partagent une bande sont candidates ; l'index GIN rend la
+-- recherche indépendante du nombre de factures de l'utilisateur.
+alter table invoices add column if not exists minhash integer[];
+alter table invoices add column if not exists lsh_bands text[];
+alter table invoices add column if not exists duplicate_of uuid;
+alter table invoices add column if not exists duplicate_similarity real;
+
+create index if not exists invoices_lsh_bands_idx on invoices using gin (lsh_bands);
@@ -0,0 +1,8 @@
+-- PDF contenant plusieurs factures (services/document_split.py) : chaque facture
+-- trouvée devient une ligne. La première reprend la facture déposée, les
+-- suivantes pointent vers elle (split_from) ; source_pages donne les pages du
+-- PDF d'origine qui la composent.
+alter table invoices add column if not exists split_from uuid references invoices(id) on delete set null;
+alter table invoices add column if not exists source_pages integer[];
+
+create index if not exists invoices_split_from_idx on invoices (split_from) where split_from is not null;
@@ -0,0 +1,37 @@
+-- Curseur du flux de changements sûr vis-à-vis des commits (GET /invoices/changes).
+--
+-- `change_seq` est pris au moment de l'écriture, pas du commit : une transaction
+-- lente peut rendre visible un change_seq plus petit qu'un autre déjà renvoyé, et
+-- un client dont le curseur l'a dépassé ne le verrait jamais. On enregistre donc
+-- aussi la transaction qui a écrit la ligne (`change_xid`) et le flux est parcouru
+-- dans l'ordre (change_xid, change_seq), en ne renvoyant que les lignes écrites par
+-- des transactions plus anciennes que la plus ancienne transaction encore en cours
+-- (pg_snapshot_xmin) : toute ligne qui deviendra visible plus tard aura un
+-- change_xid supérieur au curseur. change_seq reste la version de la ligne (ETags).
+alter table invoices add column if not exists change_xid xid8 not null default pg_current_xact_id();
+
+create or replace function invoices_bump_change_seq() returns trigger as $$
+begin
+    new.change_seq := nextval('invoice_change_seq');
+    new.change_xid := pg_current_xact_id();
+    return new;
+end;
+$$ language plpgsql;
+
+create index if not exists invoices_user_change_xid_idx on invoices (user_id, change_xid, change_seq);
+
+-- Changements d'un utilisateur après le curseur (p_since_xid, p_since_seq)
+create or replace function get_invoice_changes(
+    p_user_id invoices.user_id%type,
+    p_since_xid xid8,
+    p_since_seq bigint,
+    p_limit integer
+) returns setof invoices as $$
+    select *
+      from invoices
+     where user_id = p_user_id
+       and (change_xid, change_seq) > (p_since_xid, p_since_seq)
+       and change_xid < pg_snapshot_xmin(pg_current_snapshot())
+     order by change_xid, change_seq
+     limit p_limit;
+$$ language sql stable;
@@ -0,0 +1,32 @@
+-- Candidats à la détection des doublons (services/duplicates.py), appelée via
+-- supabase.rpc par database/db.py:find_invoices_by_lsh_bands.
+--
+-- Les factures qui partagent au moins une bande LSH (index GIN) sont classées
+-- par nombre de bandes partagées avant la limite : plus elles en partagent,
+-- plus leurs signatures MinHash sont proches. Sans ce classement, un utilisateur
+-- avec beaucoup de factures similaires (même client, même modèle) verrait le
+-- vrai doublon écarté par la limite.
+create or replace function find_invoices_by_lsh_bands(
+    p_user_id invoices.user_id%type,
+    p_bands text[],
+    p_exclude_id invoices.id%type default null,
+    p_limit integer default 20
+) returns table (
+    id invoices.id%type,
+    invoice_number invoices.invoice_number%type,
+    client invoices.client%type,
+    amount invoices.amount%type,
+    due_date invoices.due_date%type,
+    minhash integer[],
+    shared_bands integer
+) as $$
+    select i.id, i.invoice_number, i.client, i.amount, i.due_date, i.minhash,
+           cardinality(array(select unnest(i.lsh_bands) intersect select unnest(p_bands))) as shared_bands
+      from invoices i
+     where i.user_id = p_user_id
+       and i.lsh_bands && p_bands
+       and i.deleted_at is null
+       and (p_exclude_id is null or i.id <> p_exclude_id)
+     order by shared_bands desc, i.created_date desc
+     limit p_limit;
+$$ language sql stable;
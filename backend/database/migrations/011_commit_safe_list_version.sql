@@ -0,0 +1,28 @@
+-- Version de la liste des factures d'un utilisateur (ETag de GET /invoices/list),
+-- appelée via supabase.rpc par database/db.py:get_user_invoices_version.
+--
+-- max(change_seq) ne suffit pas : deux transactions peuvent valider dans le
+-- désordre (T1 prend le change_seq 100, T2 le 101 et valide la première), et la
+-- ligne de T1 ne changerait pas la version. Comme le flux de changements
+-- (009_commit_safe_change_feed.sql), la version est la dernière position
+-- (change_xid, change_seq) écrite par une transaction plus ancienne que toutes
+-- celles en cours : une ligne validée plus tard la fait toujours avancer. Le
+-- nombre de lignes couvre les suppressions définitives.
+create or replace function get_invoices_version(
+    p_user_id invoices.user_id%type
+) returns table (
+    change_xid xid8,
+    change_seq bigint,
+    row_count bigint
+) as $$
+    select last.change_xid, last.change_seq, (select count(*) from invoices where user_id = p_user_id)
+      from (select null) as anchor
+      left join lateral (
+            select change_xid, change_seq
+              from invoices
+             where user_id = p_user_id
+               and change_xid < pg_snapshot_xmin(pg_current_snapshot())
+             order by change_xid desc, change_seq desc
+             limit 1
+      ) as last on true;
+$$ language sql stable;
@@ -0,0 +1,83 @@
+"""
+Unité de travail pour les écritures sur la table invoices.
+
+Les modifications de champs faites pendant une requête ou un job sont accumulées
+par facture puis envoyées en une seule écriture à la fin, au lieu d'un aller-retour
+Supabase par colonne :
+
+    async with InvoiceUnitOfWork(owner_id=current_user['id']) as uow:
+        uow.update(invoice_id, status="Sent")
+        ...
+        uow.update(invoice_id, pandadoc_id=document_id)
+    # une seule requête, limitée aux factures de l'utilisateur
+
+Avec plusieurs factures (workers en tâche de fond), le flush regroupe les lignes
+par lots de `batch_size` dans une seule transaction par lot.
+"""
+import logging
+from typing import Dict, List, Optional
+from .db import update_invoice, update_owned_invoice, update_invoices_bulk
+
+logger = logging.getLogger(__name__)
+
+# Propriétaire non vérifié (jobs internes) ; None désigne une facture sans propriétaire
+ANY_OWNER = object()
+DEFAULT_BATCH_SIZE = 200
+
+class InvoiceUnitOfWork:
+    def __init__(self, owner_id=ANY_OWNER, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.owner_id = owner_id
+        self.batch_size = batch_size
+        self._changes: Dict[str, dict] = {}
+
+    def update(self, invoice_id: str, data: Optional[dict] = None, **fields):
+        """Enregistre des modifications ; les suivantes sur le même champ l'emportent"""
+        self._changes.setdefault(invoice_id, {}).update(data or {}, **fields)
+
+    def pending(self, invoice_id: str) -> dict:
+        return dict(self._changes.get(invoice_id, {}))
+
+    def __len__(self) -> int:
+        return len(self._changes)
+
+    def discard(self):
+        self._changes.clear()
+
+    async def flush(self) -> List[dict]:
+        """
+        Écrit toutes les modifications en attente
+
+        Returns:
+            Les factures mises à jour
+        """
+        changes, self._changes = self._changes, {}
+        if not changes:
+            return []
+
+        if len(changes) == 1:
+            (invoice_id, data), = changes.items()
+            if self.owner_id is ANY_OWNER:
+                return [await update_invoice(invoice_id, data)]
+            return [await update_owned_invoice(invoice_id, self.owner_id, data)]
+
+        if self.owner_id is None:
+            raise ValueError("Batched updates of unowned invoices are not supported")
+        user_id = None if self.owner_id is ANY_OWNER else self.owner_id
+        updates = [{'id': invoice_id, 'patch': data} for invoice_id, data in changes.items()]
+        rows = []
+        for start in range(0, len(updates), self.batch_size):
+            rows.extend(await update_invoices_bulk(updates[start:start + self.batch_size], user_id))
+        if len(rows) < len(updates):
+            logger.warning(f"Unit of work: {len(updates) - len(rows)} of {len(updates)} invoices were not updated")
+        return rows
+
+    async def __aenter__(self) -> "InvoiceUnitOfWork":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # En cas d'erreur, rien n'est écrit
+        if exc_type is None:
+            await self.flush()
+        else:
+            self.discard()
+        return False
@@ -1,9 +1,15 @@
-from fastapi import Depends, HTTPException, Header
+from fastapi import Depends, HTTPException, Header, Query
 from fastapi.security import HTTPBearer
 from database.supabase_client import supabase
+from database.db import find_user_by_id
 from typing import Optional
+import hmac
 import jwt
 import logging
+import os
+
+# Jeton partagé des outils internes (supervision) pour les routes /metrics
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
 
 security = HTTPBearer()
 
@@ -47,8 +53,65 @@ async def get_optional_user(authorization: Optional[str] = Header(None)) -> Opti
         if not user:
             return None
             
-        return user.user.user_metadata
+        return {
+            'id': user.user.id,
+            **user.user.user_metadata
+        }
         
     except Exception as e:
         logging.error(f"Optional auth error: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+async def authenticate_token(token: str) -> Optional[dict]:
+    """
+    Retourne l'utilisateur correspondant à un access token Supabase, ou None
+    """
+    try:
+        user = supabase.auth.get_user(token)
+        if not user:
+            return None
+        return {
+            'id': user.user.id,
+            **user.user.user_metadata
+        }
+    except Exception as e:
+        logging.error(f"Token auth error: {str(e)}")
+        return None
+
+async def get_streaming_user(
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = Query(None, description="Access token, for clients that cannot set headers (EventSource)")
+) -> dict:
+    """
+    Comme get_current_user, mais accepte aussi le token en paramètre de requête
+    pour les flux SSE ouverts avec EventSource
+    """
+    token = None
+    if authorization and authorization.startswith('Bearer '):
+        token = authorization.split(' ')[1]
+    elif access_token:
+        token = access_token
+    user = await authenticate_token(token) if token else None
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return user
+
+async def get_admin_or_internal(
+    authorization: Optional[str] = Header(None),
+    x_internal_token: Optional[str] = Header(None)
+) -> dict:
+    """
+    Accès réservé aux administrateurs (colonne users.is_admin) ou aux outils
+    internes qui présentent INTERNAL_API_TOKEN dans l'en-tête X-Internal-Token
+    """
+    if x_internal_token and INTERNAL_API_TOKEN and hmac.compare_digest(x_internal_token, INTERNAL_API_TOKEN):
+        return {'id': None, 'internal': True}
+    user = None
+    if authorization and authorization.startswith('Bearer '):
+        user = await authenticate_token(authorization.split(' ')[1])
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    db_user = await find_user_by_id(user['id'])
+    if not db_user or not db_user.get('is_admin'):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
@@ -0,0 +1,55 @@
+"""
+Outils pour les GET conditionnels (ETag / If-None-Match) sur les routes de lecture.
+
+Les ETags sont forts : dérivés de la version de la ligne (`change_seq`) quand elle
+est disponible, sinon d'une empreinte du contenu.
+"""
+from fastapi import Response
+from typing import Optional
+import hashlib
+import json
+
+# Les données sont propres à l'utilisateur : pas de cache partagé, et le client
+# doit revalider à chaque fois (ce qui coûte un 304 sans corps)
+PRIVATE_REVALIDATE = "private, no-cache"
+PUBLIC_REVALIDATE = "no-cache"
+
+def make_etag(*parts) -> str:
+    """ETag fort construit à partir de versions de lignes ou d'autres valeurs stables"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def content_etag(content) -> str:
+    """ETag fort calculé sur le contenu JSON (pour les données sans version)"""
+    payload = json.dumps(content, sort_keys=True, default=str, separators=(",", ":"))
+    return make_etag(payload)
+
+def row_etag(row: dict) -> str:
+    """ETag d'une ligne : sa version si elle en a une, sinon son contenu"""
+    if row.get('change_seq') is not None:
+        return make_etag(row.get('id'), row['change_seq'])
+    return content_etag(row)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Compare l'en-tête If-None-Match à l'ETag courant
+    (comparaison faible, comme l'exige la RFC 9110 pour If-None-Match)
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def set_cache_headers(response: Response, etag: str, cache_control: str = PRIVATE_REVALIDATE):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    if cache_control.startswith("private"):
+        response.headers["Vary"] = "Authorization"
+
+def not_modified(etag: str, cache_control: str = PRIVATE_REVALIDATE) -> Response:
+    """Réponse 304 sans corps"""
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, cache_control)
+    return response
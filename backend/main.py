@@ -1,11 +1,18 @@
 from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, user, invoice, siren, docs, invoice_onboarding
+from routers import auth, user, invoice, siren, docs, invoice_onboarding, metrics, uploads, webhook
 from dotenv import load_dotenv
 import logging
 import os
 from services.pandadoc import setup_pandadoc_webhook
+from services.blob_store import run_garbage_collector
+from services.risk_model import get_model
+from services.rescoring import RESCORE_ENABLED, run_rescoring_scheduler
+from services.sirene_index import run_delta_updates
+from services.entity_resolution import run_index_refresh
 
 # Configuration du logging
 logging.basicConfig(
@@ -27,10 +34,26 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Setup
+    # L'enregistrement du webhook PandaDoc se fait en tâche de fond pour ne pas
+    # bloquer le démarrage du serveur
+    webhook_task = None
     app_url = os.getenv('APP_URL', 'https://app.freelpay.com/api')
     if app_url:
-        await setup_pandadoc_webhook(app_url)
+        webhook_task = asyncio.create_task(setup_pandadoc_webhook(app_url))
+    blob_gc_task = asyncio.create_task(run_garbage_collector())
+    # Modèle de risque chargé une fois, avant la première requête de scoring
+    await asyncio.to_thread(get_model)
+    rescoring_task = asyncio.create_task(run_rescoring_scheduler()) if RESCORE_ENABLED else None
+    sirene_task = asyncio.create_task(run_delta_updates())
+    client_index_task = asyncio.create_task(run_index_refresh())
     yield
+    sirene_task.cancel()
+    client_index_task.cancel()
+    blob_gc_task.cancel()
+    if rescoring_task:
+        rescoring_task.cancel()
+    if webhook_task and not webhook_task.done():
+        webhook_task.cancel()
 
 app = FastAPI(
     title="Freelpay API",
@@ -60,9 +83,18 @@ app = FastAPI(
         {
             "name": "siren",
             "description": "SIREN number validation operations"
+        },
+        {
+            "name": "uploads",
+            "description": "Direct-to-storage upload sessions"
+        },
+        {
+            "name": "metrics",
+            "description": "Internal performance metrics"
         }
     ],
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     root_path="/api",
     docs_url=None,
     redoc_url=None,
@@ -97,6 +129,9 @@ app.include_router(user.router, prefix="/users", tags=["users"])
 app.include_router(invoice.router, prefix="/invoices", tags=["invoices"])
 app.include_router(siren.router, prefix="/siren", tags=["siren"])
 app.include_router(invoice_onboarding.router, prefix="/invoices", tags=["invoice-onboarding"])
+app.include_router(webhook.router, prefix="/webhook")
+app.include_router(uploads.router, prefix="/uploads", tags=["uploads"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
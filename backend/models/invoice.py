@@ -1,11 +1,12 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, BeforeValidator, field_validator, field_serializer
+from typing import Optional, List, Dict, Annotated
 from datetime import datetime, timezone
 import uuid
-from pydantic.json import timedelta_isoformat
 from enum import Enum
-from pydantic import validator
-import logging
+from timestamps import parse_datetime
+
+# Datetime accepté sous toutes les formes renvoyées par Supabase
+IsoDatetime = Annotated[datetime, BeforeValidator(parse_datetime)]
 
 class ClientType(str, Enum):
     COMPANY = "company"
@@ -22,30 +23,14 @@ class InvoiceBase(BaseModel):
     due_date: Optional[datetime] = None
     financing_date: Optional[datetime] = None
 
-    class Config:
-        json_encoders = {
-            datetime: lambda dt: dt.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S%z')
-        }
-
-    @validator('created_date', 'due_date', 'financing_date', pre=True)
+    @field_validator('created_date', 'due_date', 'financing_date', mode='before')
+    @classmethod
     def parse_datetime(cls, value):
-        if value is None:
-            return None
-        if isinstance(value, datetime):
-            return value
-        try:
-            if isinstance(value, str):
-                if '+' in value:
-                    # Format PostgreSQL timestamptz
-                    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S%z')
-                else:
-                    # Format sans timezone
-                    dt = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-                    return dt.replace(tzinfo=timezone.utc)
-        except (ValueError, TypeError) as e:
-            logging.error(f"Date parsing error: {e}")
-            raise ValueError(f'Invalid datetime format: {value}')
-        return value
+        return parse_datetime(value)
+
+    @field_serializer('created_date', 'due_date', 'financing_date', when_used='json-unless-none')
+    def serialize_datetime(self, dt: datetime) -> str:
+        return dt.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S%z')
 
 class InvoiceCreate(InvoiceBase):
     invoice_number: str
@@ -82,6 +67,7 @@ class InvoiceInDB(InvoiceBase):
     client_country: str = "FR"
     client_vat_number: Optional[str] = None
     client_type: Optional[ClientType] = None
+    client_siren: Optional[str] = None
     amount: float = Field(gt=0)
     currency: str = "EUR"
     due_date: datetime
@@ -166,25 +152,26 @@ class Invoice(InvoiceBase):
     pdf_invoice_subject: Optional[str] = None
     client_siren: Optional[str] = None
     user_id: Optional[str] = None
+    duplicate_of: Optional[str] = Field(default=None, description="Earlier invoice this one probably duplicates")
+    duplicate_similarity: Optional[float] = None
+    split_from: Optional[str] = Field(default=None, description="Uploaded invoice whose PDF also contained this one")
+    source_pages: Optional[List[int]] = Field(default=None, description="Pages of the uploaded PDF making up this invoice")
 
 class ScoreDetails(BaseModel):
-    siren_score: float = Field(
-        description="Score component based on SIREN validation",
-        example=0.4,
-        ge=0,
-        le=1
+    contributions: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Contribution of each model feature to the score logit (positive values increase the risk)",
+        example={"log_amount": 1.4, "due_horizon_days": 0.12, "has_siren": -0.6}
     )
-    amount_score: float = Field(
-        description="Score component based on invoice amount",
-        example=0.3,
-        ge=0,
-        le=1
+    intercept: Optional[float] = Field(
+        default=None,
+        description="Model intercept; the score is sigmoid(intercept + sum of contributions)",
+        example=-1.6
     )
-    authentication_bonus: float = Field(
-        description="Bonus for authenticated users",
-        example=0.1,
-        ge=0,
-        le=1
+    model_version: Optional[str] = Field(default=None, example="prior-2")
+    explanation: Optional[str] = Field(
+        default=None,
+        description="Optional plain-language explanation of the score (explain=true)"
     )
 
 class ScoreResponse(BaseModel):
@@ -215,9 +202,9 @@ class ScoreResponse(BaseModel):
                 "possible_financing": 6500.0,
                 "amount": 10000.0,
                 "details": {
-                    "siren_score": 0.4,
-                    "amount_score": 0.3,
-                    "authentication_bonus": 0.1
+                    "contributions": {"log_amount": 1.4, "due_horizon_days": 0.12, "has_siren": -0.6},
+                    "intercept": -1.6,
+                    "model_version": "prior-2"
                 }
             }
         }
@@ -227,10 +214,12 @@ class InvoiceListResponse(BaseModel):
     invoice_number: str = Field(example="INV-2024-001")
     client: str = Field(example="Acme Corp")
     amount: float = Field(example=10000.0)
-    due_date: datetime = Field(example="2024-12-31T23:59:59")
+    due_date: IsoDatetime = Field(example="2024-12-31T23:59:59")
     status: str = Field(example="Draft")
     score: Optional[float] = Field(example=0.35)
     possible_financing: Optional[float] = Field(example=6500.0)
+    duplicate_of: Optional[str] = Field(default=None, example=None)
+    split_from: Optional[str] = Field(default=None, example=None)
 
     class Config:
         json_schema_extra = {
@@ -333,4 +322,66 @@ class DemoInvoiceResponse(BaseModel):
                 "score": 0.45,
                 "possible_financing": 5500.0
             }
-        }
\ No newline at end of file
+        }
+class InvoiceChangesResponse(BaseModel):
+    cursor: str = Field(
+        description="Curseur à renvoyer dans `since` lors de la prochaine synchronisation",
+        example="48213.1842"
+    )
+    has_more: bool = Field(
+        description="Vrai s'il reste des changements à récupérer avec le nouveau curseur",
+        example=False
+    )
+    upserted: List[InvoiceListResponse] = Field(
+        default_factory=list,
+        description="Factures créées ou modifiées depuis le curseur"
+    )
+    deleted: List[str] = Field(
+        default_factory=list,
+        description="IDs des factures supprimées depuis le curseur",
+        example=["550e8400-e29b-41d4-a716-446655440000"]
+    )
+
+class InvoiceImportError(BaseModel):
+    row: int = Field(description="Numéro de la ligne dans le fichier (en-tête CSV exclu)", example=12)
+    errors: List[str] = Field(example=["amount: Input should be greater than 0"])
+
+class InvoiceImportResponse(BaseModel):
+    imported: int = Field(description="Nombre de factures créées", example=998)
+    failed: int = Field(description="Nombre de lignes rejetées", example=2)
+    invoice_ids: List[str] = Field(default_factory=list, description="IDs des factures créées")
+    errors: List[InvoiceImportError] = Field(default_factory=list, description="Erreurs par ligne")
+    scoring: str = Field(
+        description="État du calcul des scores, fait en tâche de fond après l'import",
+        example="queued"
+    )
+
+class InvoiceBatchItem(BaseModel):
+    filename: str = Field(example="2024-03/facture-042.pdf")
+    invoice_id: Optional[str] = Field(default=None, example="550e8400-e29b-41d4-a716-446655440000")
+    error: Optional[str] = Field(default=None, description="Raison du rejet du fichier", example="File too large")
+
+class InvoiceBatchUploadResponse(BaseModel):
+    batch_id: str = Field(example="7c9e6679-7425-40de-944b-e07fc1f90ae7")
+    status: str = Field(example="processing")
+    accepted: int = Field(description="Nombre de factures créées", example=31)
+    rejected: int = Field(description="Nombre de fichiers rejetés", example=1)
+    items: List[InvoiceBatchItem] = Field(default_factory=list)
+
+class InvoiceBatchInvoice(BaseModel):
+    id: str
+    status: Optional[str] = None
+    invoice_number: Optional[str] = None
+    error: Optional[str] = None
+
+class InvoiceBatchStatusResponse(BaseModel):
+    batch_id: str = Field(example="7c9e6679-7425-40de-944b-e07fc1f90ae7")
+    status: str = Field(description="processing tant qu'une facture attend l'OCR, sinon done", example="processing")
+    total: int = Field(example=31)
+    done: int = Field(example=12)
+    completed: int = Field(example=11)
+    failed: int = Field(example=1)
+    pending: int = Field(example=19)
+    progress: float = Field(ge=0, le=1, example=0.387)
+    counts: Dict[str, int] = Field(default_factory=dict, description="Nombre de factures par statut")
+    invoices: List[InvoiceBatchInvoice] = Field(default_factory=list)
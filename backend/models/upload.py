@@ -0,0 +1,50 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Dict
+from datetime import datetime
+
+class UploadSessionCreate(BaseModel):
+    purpose: str = Field(
+        pattern="^(invoice|id_document)$",
+        description="Usage du fichier : facture à OCRiser ou pièce d'identité",
+        example="invoice"
+    )
+    content_type: str = Field(
+        description="Type MIME du fichier qui sera envoyé",
+        example="application/pdf"
+    )
+    size: Optional[int] = Field(
+        default=None,
+        gt=0,
+        description="Taille annoncée du fichier en octets",
+        example=245760
+    )
+
+class UploadSessionResponse(BaseModel):
+    session_token: str = Field(description="Jeton à renvoyer au endpoint de finalisation")
+    upload_url: str = Field(
+        description="URL pré-signée vers laquelle envoyer le fichier",
+        example="https://freelpay-uploads.fra1.digitaloceanspaces.com/incoming/550e8400?X-Amz-Signature=..."
+    )
+    method: str = Field(default="PUT", description="Méthode HTTP à utiliser pour l'envoi")
+    headers: Dict[str, str] = Field(
+        default_factory=dict,
+        description="En-têtes à inclure dans la requête d'envoi",
+        example={"Content-Type": "application/pdf"}
+    )
+    expires_at: datetime = Field(description="Date d'expiration de l'URL")
+
+class UploadFinalizeRequest(BaseModel):
+    session_token: str = Field(description="Jeton renvoyé à la création de la session")
+    ocr_profile: Optional[str] = Field(
+        default=None,
+        description="Profil OCR à utiliser pour les documents difficiles",
+        example="accurate"
+    )
+
+class UploadFinalizeResponse(BaseModel):
+    status: str = Field(example="processing")
+    invoice_id: Optional[str] = Field(
+        default=None,
+        description="ID de la facture créée (uploads de factures uniquement)",
+        example="550e8400-e29b-41d4-a716-446655440000"
+    )
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from models.user import UserCreate
-from database.supabase_client import supabase
+from database.db import create_user_if_absent
 import logging
 from uuid import UUID
 
@@ -12,17 +12,8 @@ async def create_user_record(user: UserCreate):
         # Convertir l'UUID en string pour Supabase
         user_id = str(user.id)
         
-        # Vérifier si l'utilisateur existe déjà dans la table users
-        existing_user = supabase.table('users').select('*').eq('id', user_id).execute()
-        
-        if existing_user.data and len(existing_user.data) > 0:
-            raise HTTPException(
-                status_code=400, 
-                detail="User already exists. Please sign in instead."
-            )
-
-        # Si l'utilisateur n'existe pas, l'insérer
-        response = supabase.table('users').insert({
+        # Insertion conditionnelle : si l'utilisateur existe déjà, rien n'est renvoyé
+        created_user = await create_user_if_absent({
             'id': user_id,  # Utiliser l'ID converti en string
             'username': user.username,
             'email': user.email,
@@ -30,12 +21,15 @@ async def create_user_record(user: UserCreate):
             'phone': user.phone,
             'address': user.address,
             'id_document_status': 'not_uploaded'
-        }).execute()
+        })
         
-        if not response.data:
-            raise HTTPException(status_code=400, detail="Failed to create user")
+        if not created_user:
+            raise HTTPException(
+                status_code=400, 
+                detail="User already exists. Please sign in instead."
+            )
             
-        return response.data[0]
+        return created_user
     except Exception as e:
         logging.error(f"Error creating user: {str(e)}")
         if isinstance(e, HTTPException):
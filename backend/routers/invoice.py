@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Path, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Path, Query, Body, Header, Request, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from models.user import User
-from models.invoice import InvoiceCreate, Invoice, InvoiceInDB, ScoreResponse, InvoiceListResponse, InvoiceCreateResponse, PdfUrlResponse, SendInvoiceResponse, PennylaneEstimateResponse, DemoInvoiceResponse, InvoiceUpdate, OCRStatus
-from services.ocr_service import process_invoice_async
-from services.scoring_service import calculate_score
+from models.invoice import InvoiceCreate, Invoice, InvoiceInDB, ScoreResponse, InvoiceListResponse, InvoiceCreateResponse, PdfUrlResponse, SendInvoiceResponse, PennylaneEstimateResponse, DemoInvoiceResponse, InvoiceUpdate, OCRStatus, InvoiceChangesResponse, InvoiceImportResponse, InvoiceBatchUploadResponse, InvoiceBatchStatusResponse
+from services.ocr_service import process_invoice_async, process_invoice_blob, build_pending_invoice
+from services.blob_store import save_upload
+from services import events
+from services.events import event_bus, publish_invoice_event, sse_stream, parse_last_event_id
+from services.ocr_profiles import PROFILES as OCR_PROFILES
+from services.scoring_service import calculate_score as compute_risk_score, calculate_scores_batch as compute_risk_scores, score_invoice
+from services.entity_resolution import remember as remember_client_siren, resolve_client_siren
+from services.invoice_import import detect_format, import_invoices, score_imported_invoices
+from services.batch_upload import store_batch_files, build_batch_invoices, process_batch, summarize_batch
 from services.pennylane import create_pennylane_estimate, send_estimate_for_signature
 from services.pandadoc import send_document_for_signature
-from dependencies import get_current_user, get_optional_user
-from database.db import create_invoice, get_user_invoices, update_invoice_status, get_invoice_by_id, update_invoice_pennylane_id, update_invoice_pandadoc_id, update_invoice_score, find_user_by_id, update_invoice
+from dependencies import get_current_user, get_optional_user, get_streaming_user, authenticate_token
+from http_cache import make_etag, row_etag, etag_matches, set_cache_headers, not_modified
+from serialization import invoice_response, invoice_list_response, invoice_changes_response
+from database.db import create_invoice, create_invoices_bulk, set_blob_references_bulk, get_batch_invoices, get_user_invoices, get_invoice_by_id, get_owned_invoice, update_owned_invoice, update_invoice_score, find_user_by_id, set_blob_reference, get_invoice_changes, soft_delete_invoice, get_user_invoices_version
+from database.unit_of_work import InvoiceUnitOfWork
 from database.supabase_client import supabase
 from datetime import datetime, timedelta
 import logging
@@ -23,23 +34,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-async def save_file(file: UploadFile) -> str:
-    """
-    Save uploaded file to disk and return the file path
-    """
-    upload_dir = os.path.join("uploads", "invoices")
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(upload_dir, unique_filename)
-    
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    return file_path
-
 @router.post(
     "/create",
     response_model=InvoiceCreateResponse,
@@ -50,26 +44,62 @@ async def create_invoice_route(
     invoice: InvoiceCreate,
     current_user: dict = Depends(get_current_user)
 ):
-    score = await calculate_score(
+    if invoice.client_siren:
+        remember_client_siren(current_user['id'], invoice.client, invoice.client_siren)
+    else:
+        invoice.client_siren = await resolve_client_siren(invoice.client, current_user['id'])
+    score = await compute_risk_score(
         invoice.dict(), 
-        user_siren=current_user.get('siren_number'),
-        is_authenticated=True
+        user_siren=current_user.get('siren_number')
     )
     possible_financing = invoice.amount * (1 - score)
     
-    invoice_data = InvoiceInDB(
+    invoice_data = InvoiceInDB(**{
         **invoice.dict(),
-        user_id=current_user['id'],
-        created_date=datetime.now(),
-        score=score,
-        possible_financing=possible_financing
-    )
+        'user_id': current_user['id'],
+        'created_date': datetime.now(),
+        'score': score,
+        'possible_financing': possible_financing
+    })
     
     result = await create_invoice(invoice_data.dict())
     if result:
         return InvoiceCreateResponse(**result)
     raise HTTPException(status_code=400, detail="Failed to create invoice")
 
+@router.post(
+    "/import",
+    response_model=InvoiceImportResponse,
+    summary="Import invoices in bulk",
+    description="""
+    Imports past invoices from a CSV (header row with `InvoiceCreate` field names)
+    or NDJSON file (one JSON object per line).
+
+    Rows are validated one by one; valid rows are inserted in multi-row batches and
+    invalid ones are reported with their row number. Risk scores are computed in the
+    background after the import.
+    """
+)
+async def import_invoices_route(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(..., description="CSV or NDJSON file"),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="File format, detected from the file name when omitted"),
+    current_user: dict = Depends(get_current_user)
+):
+    file_format = detect_format(file, format)
+    if not file_format:
+        raise HTTPException(status_code=400, detail="Unsupported file format, use CSV or NDJSON")
+
+    report, imported = await import_invoices(file, file_format, current_user['id'])
+    if imported:
+        background_tasks.add_task(
+            score_imported_invoices,
+            imported,
+            current_user['id'],
+            current_user.get('siren_number')
+        )
+    return report
+
 @router.post(
     "/upload",
     response_model=Invoice,
@@ -82,88 +112,237 @@ async def create_invoice_route(
 )
 async def upload_invoice(
     file: UploadFile = File(...),
+    ocr_profile: Optional[str] = Query(None, description="OCR profile override for hard documents (fast, balanced, accurate, legacy)"),
     current_user: dict = Depends(get_current_user),
     background_tasks: BackgroundTasks = None
 ):
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    if ocr_profile and ocr_profile not in OCR_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown OCR profile: {ocr_profile}")
+    
+    # Persist the PDF in the blob store (deduplicated by content)
+    blob = await save_upload(file)
     
     # Create invoice with pending status
     invoice_id = str(uuid.uuid4())
-    temp_invoice_number = f"TEMP-{invoice_id[:8]}"
-    
-    invoice_data = {
-        "id": invoice_id,
-        "user_id": current_user['id'],
-        "status": "OCR_PENDING",
-        "created_date": datetime.now(),
-        "invoice_number": temp_invoice_number,
-        "client": "Pending OCR",
-        "amount": 0,
-        "due_date": datetime.now() + timedelta(days=30),  # Valeur temporaire
-        "description": "Processing invoice...",
-        "client_type": "company",
-        "client_country": "FR",
-        "currency": "EUR",
-        "language": "fr_FR",
-        "payment_conditions": "upon_receipt"
-    }
+    invoice_data = build_pending_invoice(invoice_id, current_user['id'], blob_key=blob.key)
     
     # Create invoice record
     invoice = await create_invoice(invoice_data)
     
     if not invoice:
         raise HTTPException(status_code=500, detail="Failed to create invoice record")
+    await set_blob_reference('invoice', invoice_id, blob.key)
     
     # Start OCR processing in background
-    file_content = await file.read()
     background_tasks.add_task(
-        process_invoice_async,
+        process_invoice_blob,
         invoice_id,
-        file_content
+        blob.key,
+        ocr_profile,
+        user_id=current_user['id']
     )
     
     return invoice
 
+@router.post(
+    "/upload/batch",
+    response_model=InvoiceBatchUploadResponse,
+    summary="Upload several invoice PDFs at once",
+    description="""
+    Uploads several PDF invoices in one request, as multiple files and/or ZIP archives
+    of PDFs (up to 100 files, 10 MB per PDF).
+
+    All invoices are created right away with a pending OCR status and share a
+    `batch_id`; follow the OCR progress with GET /invoices/batches/{batch_id}.
+    Files that cannot be processed are listed with the reason in `items`.
+    """
+)
+async def upload_invoice_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(..., description="PDF files and/or ZIP archives of PDF files"),
+    ocr_profile: Optional[str] = Query(None, description="OCR profile override for hard documents (fast, balanced, accurate, legacy)"),
+    current_user: dict = Depends(get_current_user)
+):
+    if ocr_profile and ocr_profile not in OCR_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown OCR profile: {ocr_profile}")
+
+    items = await store_batch_files(files)
+    batch_id = str(uuid.uuid4())
+    invoices = build_batch_invoices(items, current_user['id'], batch_id)
+    if invoices:
+        # Toutes les factures provisoires et leurs références de fichiers en deux requêtes
+        await create_invoices_bulk(invoices)
+        await set_blob_references_bulk('invoice', {item.invoice_id: item.blob_key for item in items if item.invoice_id})
+        background_tasks.add_task(process_batch, items, ocr_profile, current_user['id'])
+
+    return {
+        "batch_id": batch_id,
+        "status": "processing" if invoices else "done",
+        "accepted": len(invoices),
+        "rejected": len(items) - len(invoices),
+        "items": [
+            {"filename": item.filename, "invoice_id": item.invoice_id, "error": item.error}
+            for item in items
+        ]
+    }
+
+@router.get(
+    "/batches/{batch_id}",
+    response_model=InvoiceBatchStatusResponse,
+    summary="Get the OCR progress of an upload batch",
+    description="Aggregated OCR progress of the invoices created by POST /invoices/upload/batch."
+)
+async def get_invoice_batch(
+    batch_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    invoices = await get_batch_invoices(batch_id, current_user['id'])
+    if not invoices:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {"batch_id": batch_id, **summarize_batch(invoices), "invoices": invoices}
+
 @router.get(
     "/list",
     response_model=List[InvoiceListResponse],
     summary="List all invoices",
-    description="Lists all invoices belonging to the current user"
+    description="""
+    Lists all invoices belonging to the current user.
+
+    Supports conditional requests: send the last `ETag` in `If-None-Match` to get
+    a `304 Not Modified` without the list being fetched when nothing changed.
+    """
 )
-async def list_invoices(current_user: dict = Depends(get_current_user)):
+async def list_invoices(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    # Version de la liste (une seule valeur) avant de charger toutes les lignes
+    version = await get_user_invoices_version(current_user['id'])
+    etag = make_etag("invoices", current_user['id'], version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
     invoices = await get_user_invoices(current_user['id'])
-    
-    # Format dates as ISO strings
-    for invoice in invoices:
-        if 'created_date' in invoice:
-            invoice['created_date'] = invoice['created_date'].isoformat() if invoice['created_date'] else None
-        if 'due_date' in invoice:
-            invoice['due_date'] = invoice['due_date'].isoformat() if invoice['due_date'] else None
-        if 'financing_date' in invoice:
-            invoice['financing_date'] = invoice['financing_date'].isoformat() if invoice['financing_date'] else None
-    
-    return invoices
+    response = invoice_list_response(invoices)
+    set_cache_headers(response, etag)
+    return response
+
+@router.get(
+    "/changes",
+    response_model=InvoiceChangesResponse,
+    summary="Incremental invoice sync",
+    description="""
+    Returns only the invoices created, updated or deleted since `since`.
+
+    Start with `since=0` (full sync), keep the returned `cursor` and pass it back on the
+    next call. Changes become visible once every transaction started before them has
+    ended, so a change committed late is never skipped. Apply `upserted` and `deleted` to the local copy; when `has_more` is true,
+    call again immediately with the new cursor.
+    """
+)
+async def list_invoice_changes(
+    since: str = Query("0", description="Cursor returned by the previous sync"),
+    limit: int = Query(500, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user)
+):
+    # Curseur "<change_xid>.<change_seq>" ; un ancien curseur (change_seq seul) repart de zéro
+    try:
+        if '.' in since:
+            since_xid, since_seq = (int(part) for part in since.split('.', 1))
+        else:
+            int(since)
+            since_xid, since_seq = 0, 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    rows, has_more = await get_invoice_changes(current_user['id'], since_xid, since_seq, limit)
+    upserted = [row for row in rows if not row.get('deleted_at')]
+    deleted = [row['id'] for row in rows if row.get('deleted_at')]
+    cursor = f"{rows[-1]['change_xid']}.{rows[-1]['change_seq']}" if rows else f"{since_xid}.{since_seq}"
+
+    return invoice_changes_response({
+        "cursor": cursor,
+        "has_more": has_more,
+        "upserted": upserted,
+        "deleted": deleted
+    })
 
 @router.get(
     "/{invoice_id}",
     response_model=Invoice,
     summary="Get invoice details",
-    description="Retrieves detailed information about a specific invoice"
+    description="Retrieves detailed information about a specific invoice. Supports `If-None-Match` conditional requests."
 )
 async def get_invoice(
     invoice_id: str,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
-    invoice = await get_invoice_by_id(invoice_id)
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-        
-    # Verify ownership
-    if invoice.get('user_id') != current_user['id']:
-        raise HTTPException(status_code=403, detail="Not authorized to access this invoice")
-        
-    return invoice
+    invoice = await get_owned_invoice(invoice_id, current_user['id'])
+
+    # Unchanged since the client's copy: skip serialization
+    etag = row_etag(invoice)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    response = invoice_response(invoice)
+    set_cache_headers(response, etag)
+    return response
+
+@router.get(
+    "/{invoice_id}/events",
+    summary="Stream invoice status updates",
+    description="""
+    Server-Sent Events stream of status transitions for an invoice: OCR started,
+    page progress, extraction done, scored, sent, signed.
+
+    The first event is the current status. Reconnecting clients send the standard
+    `Last-Event-ID` header to receive the events they missed. The access token can be
+    passed as `access_token` query parameter for EventSource clients.
+    """,
+    response_class=StreamingResponse
+)
+async def stream_invoice_events(
+    invoice_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: dict = Depends(get_streaming_user)
+):
+    invoice = await get_owned_invoice(invoice_id, current_user['id'])
+
+    return StreamingResponse(
+        sse_stream(request, invoice, parse_last_event_id(last_event_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/{invoice_id}/ws")
+async def invoice_events_websocket(websocket: WebSocket, invoice_id: str):
+    """
+    WebSocket variant of /{invoice_id}/events. Authenticate with the `access_token`
+    query parameter; resume with the `last_event_id` query parameter.
+    """
+    current_user = await authenticate_token(websocket.query_params.get('access_token', ''))
+    invoice = await get_invoice_by_id(invoice_id) if current_user else None
+    if not invoice or invoice.get('user_id') != current_user['id']:
+        await websocket.close(code=4403)
+        return
+
+    await websocket.accept()
+    last_event_id = parse_last_event_id(websocket.query_params.get('last_event_id'))
+    listener = event_bus.listen(invoice_id, last_event_id, snapshot=events.status_snapshot(invoice))
+    try:
+        async for event in listener:
+            if event is None:
+                await websocket.send_json({"type": "keepalive"})
+            else:
+                await websocket.send_json(event.to_dict())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await listener.aclose()
 
 @router.patch(
     "/{invoice_id}",
@@ -239,14 +418,6 @@ async def update_invoice_route(
     - 400: Données de mise à jour invalides
     """
     try:
-        existing_invoice = await get_invoice_by_id(invoice_id)
-        if not existing_invoice:
-            raise HTTPException(status_code=404, detail="Invoice not found")
-            
-        # Verify ownership
-        if existing_invoice.get('user_id') != current_user['id']:
-            raise HTTPException(status_code=403, detail="Not authorized to modify this invoice")
-        
         # Convert Pydantic model to dict and filter out None values
         update_data = {
             k: v for k, v in invoice_data.model_dump().items() 
@@ -266,7 +437,8 @@ async def update_invoice_route(
             # Remove user_id from update as it's already verified
             del update_data['user_id']
 
-        updated_invoice = await update_invoice(invoice_id, update_data)
+        # Ownership is checked by the update itself (404/403 in one round trip)
+        updated_invoice = await update_owned_invoice(invoice_id, current_user['id'], update_data)
         return updated_invoice
         
     except HTTPException:
@@ -278,6 +450,63 @@ async def update_invoice_route(
             detail=f"An error occurred while updating the invoice: {str(e)}"
         )
 
+@router.delete(
+    "/{invoice_id}",
+    status_code=204,
+    summary="Delete an invoice",
+    description="Deletes an invoice. The deletion is propagated to clients through /invoices/changes."
+)
+async def delete_invoice_route(
+    invoice_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    deleted = await soft_delete_invoice(invoice_id, current_user['id'])
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+
+# Données reprises d'une facture antérieure quand un doublon est confirmé
+DUPLICATE_REUSED_FIELDS = [
+    'invoice_number', 'client', 'client_email', 'client_phone', 'client_address', 'client_postal_code',
+    'client_city', 'client_country', 'client_vat_number', 'client_type', 'client_siren', 'amount',
+    'currency', 'due_date', 'description', 'line_items', 'score', 'possible_financing', 'score_fingerprint',
+]
+
+@router.post(
+    "/{invoice_id}/duplicate/reuse",
+    response_model=Invoice,
+    summary="Reuse the extraction and score of the duplicated invoice",
+    description="""
+    For an invoice flagged as a probable duplicate (`duplicate_of`), copies the extracted
+    fields, client SIREN and risk score of the earlier invoice instead of reviewing the new
+    extraction again. The `duplicate_of` link is kept.
+    """
+)
+async def reuse_duplicate_route(
+    invoice_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    invoice = await get_owned_invoice(invoice_id, current_user['id'])
+    if not invoice.get('duplicate_of'):
+        raise HTTPException(status_code=409, detail="Invoice is not flagged as a duplicate")
+    original = await get_owned_invoice(invoice['duplicate_of'], current_user['id'])
+    reused = {field: original.get(field) for field in DUPLICATE_REUSED_FIELDS if field in original}
+    return await update_owned_invoice(invoice_id, current_user['id'], reused)
+
+@router.delete(
+    "/{invoice_id}/duplicate",
+    response_model=Invoice,
+    summary="Dismiss a duplicate warning",
+    description="Clears the `duplicate_of` flag of an invoice that is not a duplicate."
+)
+async def dismiss_duplicate_route(
+    invoice_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    return await update_owned_invoice(invoice_id, current_user['id'], {
+        'duplicate_of': None,
+        'duplicate_similarity': None
+    })
+
 @router.post(
     "/{invoice_id}/send",
     response_model=SendInvoiceResponse,
@@ -289,13 +518,7 @@ async def send_invoice_endpoint(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        invoice = await get_invoice_by_id(invoice_id)
-        if not invoice:
-            raise HTTPException(status_code=404, detail="Invoice not found")
-            
-        # Verify ownership
-        if invoice.get('user_id') != current_user['id']:
-            raise HTTPException(status_code=403, detail="Not authorized to send this invoice")
+        invoice = await get_owned_invoice(invoice_id, current_user['id'], "Not authorized to send this invoice")
             
         if not invoice.get('client_email'):
             raise HTTPException(
@@ -309,9 +532,8 @@ async def send_invoice_endpoint(
                 detail="Invoice must be created in Pennylane first"
             )
         
-        # 1. Get PDF URL from Pennylane
-        pdf_response = await get_invoice_pdf_url(invoice_id, current_user)
-        pdf_url = pdf_response["pdf_url"]
+        # 1. Get PDF URL from Pennylane (the invoice is already loaded)
+        pdf_url = await fetch_pennylane_pdf_url(invoice['pennylane_id'])
         
         # 2. Send document for signature via PandaDoc
         pandadoc_response = await send_document_for_signature(
@@ -320,14 +542,16 @@ async def send_invoice_endpoint(
             recipient_name=invoice['client']
         )
         
-        # 3. Update invoice status
-        await update_invoice_status(invoice_id, current_user['id'], "Sent")
-        
-        # 4. Store PandaDoc document ID
-        await update_invoice_pandadoc_id(invoice_id, pandadoc_response['id'])
+        # 3. Update invoice status and store PandaDoc document ID (one write)
+        async with InvoiceUnitOfWork(owner_id=current_user['id']) as uow:
+            uow.update(invoice_id, status="Sent")
+            uow.update(invoice_id, pandadoc_id=pandadoc_response['id'])
+        publish_invoice_event(invoice_id, events.SENT, {"status": "Sent"})
         
         return {"message": "Invoice sent successfully for signature"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error sending invoice: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -369,10 +593,7 @@ async def create_demo_invoice(invoice: InvoiceCreate):
     Returns:
     - Facture de démonstration avec score calculé
     """
-    score = await calculate_score(
-        invoice.dict(),
-        is_authenticated=False
-    )
+    score = await compute_risk_score(invoice.dict())
     possible_financing = invoice.amount * (1 - score)
     
     invoice_data = Invoice(
@@ -545,9 +766,7 @@ async def create_pennylane_estimate_endpoint(
     - Message de confirmation et ID de l'estimation
     """
     try:
-        invoice = await get_invoice_by_id(invoice_id)
-        if not invoice:
-            raise HTTPException(status_code=404, detail="Invoice not found")
+        invoice = await get_owned_invoice(invoice_id, current_user['id'])
         
         # Vérification des données requises
         required_fields = ['client', 'amount', 'due_date']
@@ -573,7 +792,8 @@ async def create_pennylane_estimate_endpoint(
                 detail="No estimate ID in response"
             )
             
-        await update_invoice_pennylane_id(invoice_id, estimate_id)
+        async with InvoiceUnitOfWork(owner_id=current_user['id']) as uow:
+            uow.update(invoice_id, pennylane_id=estimate_id)
         
         return {
             "message": "Pennylane estimate created successfully",
@@ -632,16 +852,23 @@ async def get_invoice_pdf_url(
     Returns:
     - URL and expiration time for the PDF
     """
-    invoice = await get_invoice_by_id(invoice_id)
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
+    invoice = await get_owned_invoice(invoice_id, current_user['id'])
         
     if not invoice.get('pennylane_id'):
         raise HTTPException(
             status_code=400,
             detail="Invoice must be created in Pennylane first"
         )
-    
+
+    return {
+        "url": await fetch_pennylane_pdf_url(invoice['pennylane_id']),
+        "expires_at": datetime.now() + timedelta(hours=1)
+    }
+
+async def fetch_pennylane_pdf_url(pennylane_id: str) -> str:
+    """
+    Temporary download URL of a Pennylane estimate PDF
+    """
     try:
         headers = {
             'Authorization': f'Bearer {PENNYLANE_API_KEY}',
@@ -649,7 +876,7 @@ async def get_invoice_pdf_url(
         }
         
         response = requests.get(
-            f"{PENNYLANE_API_URL}/estimates/{invoice['pennylane_id']}/download",
+            f"{PENNYLANE_API_URL}/estimates/{pennylane_id}/download",
             headers=headers
         )
         
@@ -659,10 +886,7 @@ async def get_invoice_pdf_url(
                 detail="Failed to get PDF URL from Pennylane"
             )
             
-        return {
-            "url": response.json()['url'],
-            "expires_at": datetime.now() + timedelta(hours=1)
-        }
+        return response.json()['url']
         
     except Exception as e:
         logging.error(f"Error getting PDF URL: {str(e)}")
@@ -671,6 +895,36 @@ async def get_invoice_pdf_url(
             detail="Failed to get PDF URL"
         )
 
+@router.post(
+    "/calculate-score/batch",
+    response_model=List[ScoreResponse],
+    tags=["invoices"],
+    summary="Calculate risk scores for many invoices",
+    description="""
+    Batch variant of /invoices/calculate-score for up to 100 invoices.
+    Requires authentication: a batch can trigger up to 100 SIREN lookups.
+
+    SIREN numbers are looked up concurrently (each one once) and the whole batch
+    is scored in one pass of the in-process risk model. Returns one score per
+    invoice, in the request order.
+    """
+)
+async def calculate_score_batch(
+    invoices: List[InvoiceCreate] = Body(..., min_length=1, max_length=100),
+    current_user: dict = Depends(get_current_user)
+):
+    # Same SIREN choice as the single-invoice endpoint
+    user_siren = current_user.get('siren_number')
+    sirens = [user_siren or invoice.client_siren for invoice in invoices]
+    try:
+        return await compute_risk_scores(
+            [invoice.model_dump() for invoice in invoices],
+            sirens
+        )
+    except Exception as e:
+        logging.error(f"Error calculating batch scores: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to calculate scores")
+
 @router.post(
     "/calculate-score",
     response_model=ScoreResponse,
@@ -680,11 +934,13 @@ async def get_invoice_pdf_url(
     Calculates a risk score from invoice data.
     Works with or without authentication.
     
-    The score is calculated based on:
-    - Invoice amount
-    - Client information
-    - SIREN number (from invoice or authenticated user)
-    - Authentication status
+    The score is computed in-process by the learned risk model (logistic regression
+    trained offline on past invoice outcomes) from:
+    - Invoice amount and due date horizon
+    - SIREN number (from invoice or authenticated user) and company data
+
+    `details.contributions` gives the contribution of each feature to the score logit.
+    With `explain=true`, a short plain-language explanation is added (LLM, slower).
     """,
     responses={
         200: {
@@ -696,9 +952,16 @@ async def get_invoice_pdf_url(
                         "possible_financing": 6500.0,
                         "amount": 10000.0,
                         "details": {
-                            "siren_score": 0.4,
-                            "amount_score": 0.3,
-                            "authentication_bonus": 0.1
+                            "contributions": {
+                                "log_amount": 1.4,
+                                "due_horizon_days": 0.12,
+                                "has_siren": -0.6,
+                                "company_age_years": -0.25,
+                                "has_employees": -0.2
+                            },
+                            "intercept": -1.6,
+                            "model_version": "prior-2",
+                            "explanation": None
                         }
                     }
                 }
@@ -716,6 +979,7 @@ async def get_invoice_pdf_url(
 )
 async def calculate_score(
     invoice_data: InvoiceCreate,
+    explain: bool = Query(False, description="Add a plain-language explanation of the score"),
     current_user: Optional[dict] = Depends(get_optional_user)
 ):
     """
@@ -723,6 +987,7 @@ async def calculate_score(
     
     Parameters:
     - invoice_data: Complete invoice information
+    - explain: Add an LLM explanation of the score
     - current_user: Optional authenticated user information
     
     Returns:
@@ -734,26 +999,12 @@ async def calculate_score(
         user_siren = current_user.get('siren_number') if current_user else None
         siren = user_siren or client_siren
         
-        # Calculate score
-        score = await calculate_score(
-            invoice_data=invoice_data.dict(),
-            user_siren=siren,
-            is_authenticated=bool(current_user)
-        )
-        
-        possible_financing = invoice_data.amount * (1 - score)
-        
-        return ScoreResponse(
-            score=score,
-            possible_financing=possible_financing,
-            amount=invoice_data.amount,
-            details={
-                "siren_score": 0.4 if siren else 0.6,
-                "amount_score": min(invoice_data.amount / 100000, 0.3),
-                "authentication_bonus": 0.1 if current_user else 0
-            }
+        return await score_invoice(
+            invoice_data.model_dump(),
+            siren=siren,
+            explain=explain
         )
         
     except Exception as e:
         logging.error(f"Error calculating score: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to calculate score")
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query, Header, Request, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
 from models.ocr import OCRResponse, OCRResult
 from models.invoice import Invoice, InvoiceCreate, InvoiceUpdate, OCRStatus
-from services.ocr_service import process_invoice_async
-from database.db import create_invoice, get_invoice_by_id, update_invoice
+from services.ocr_service import process_invoice_blob, build_pending_invoice
+from services.blob_store import save_upload
+from services.events import sse_stream, parse_last_event_id
+from http_cache import row_etag, etag_matches, set_cache_headers, not_modified, PUBLIC_REVALIDATE
+from serialization import invoice_response
+from services.ocr_profiles import PROFILES as OCR_PROFILES
+from database.db import create_invoice, get_invoice_by_id, update_owned_invoice, set_blob_reference
 from database.supabase_client import supabase
 import logging
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 from pydantic import BaseModel, Field
 
 router = APIRouter(
@@ -79,45 +85,36 @@ class ManualInvoiceCreate(BaseModel):
 )
 async def upload_invoice_ocr(
     file: UploadFile = File(...),
+    ocr_profile: Optional[str] = Query(None, description="OCR profile override for hard documents (fast, balanced, accurate, legacy)"),
     background_tasks: BackgroundTasks = None
 ):
     try:
         if not file.content_type == "application/pdf":
             raise HTTPException(status_code=400, detail="Only PDF files are accepted")
+        if ocr_profile and ocr_profile not in OCR_PROFILES:
+            raise HTTPException(status_code=400, detail=f"Unknown OCR profile: {ocr_profile}")
             
+        # Persist the PDF in the blob store (deduplicated by content)
+        blob = await save_upload(file)
+        
         # Create invoice with pending status
         invoice_id = str(uuid.uuid4())
-        temp_invoice_number = f"TEMP-{invoice_id[:8]}"
-        
-        invoice_data = {
-            "id": invoice_id,
-            "status": "OCR_PENDING",
-            "created_date": datetime.now(),
-            "user_id": None,  # Will be set after OCR and user registration
-            "invoice_number": temp_invoice_number,
-            "client": "Pending OCR",
-            "amount": 0,
-            "due_date": datetime.now() + timedelta(days=30),  # Valeur temporaire
-            "description": "Processing invoice...",
-            "client_type": "company",
-            "client_country": "FR",
-            "currency": "EUR",
-            "language": "fr",
-            "payment_conditions": "upon_receipt"
-        }
+        # user_id will be set after OCR and user registration
+        invoice_data = build_pending_invoice(invoice_id, None, language="fr", blob_key=blob.key)
         
         # Create invoice record
         invoice = await create_invoice(invoice_data)
         
         if not invoice:
             raise HTTPException(status_code=500, detail="Failed to create invoice record")
+        await set_blob_reference('invoice', invoice_id, blob.key)
         
         # Start OCR processing in background
-        file_content = await file.read()
         background_tasks.add_task(
-            process_invoice_async,
+            process_invoice_blob,
             invoice_id,
-            file_content
+            blob.key,
+            ocr_profile
         )
         
         return OCRResponse(
@@ -176,9 +173,15 @@ async def create_manual_invoice(invoice: ManualInvoiceCreate):
     "/{invoice_id}",
     response_model=Invoice,
     summary="Get invoice information during onboarding",
-    description="Retrieves information for an invoice that is not yet associated with a user"
+    description="""
+    Retrieves information for an invoice that is not yet associated with a user.
+    Supports `If-None-Match` conditional requests for polling clients.
+    """
 )
-async def get_invoice_info(invoice_id: str):
+async def get_invoice_info(
+    invoice_id: str,
+    if_none_match: Optional[str] = Header(None)
+):
     try:
         invoice = await get_invoice_by_id(invoice_id)
         if not invoice:
@@ -190,14 +193,50 @@ async def get_invoice_info(invoice_id: str):
                 status_code=400,
                 detail="This invoice is already associated with a user"
             )
-            
-        return invoice
+
+        etag = row_etag(invoice)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag, PUBLIC_REVALIDATE)
+
+        response = invoice_response(invoice)
+        set_cache_headers(response, etag, PUBLIC_REVALIDATE)
+        return response
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error getting invoice: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get(
+    "/{invoice_id}/events",
+    summary="Stream OCR status updates during onboarding",
+    description="""
+    Server-Sent Events stream of OCR progress for an invoice that is not yet
+    associated with a user. Replaces polling GET /invoices/onboarding/{invoice_id}.
+    Supports the standard `Last-Event-ID` header to resume after a disconnect.
+    """,
+    response_class=StreamingResponse
+)
+async def stream_onboarding_invoice_events(
+    invoice_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None)
+):
+    invoice = await get_invoice_by_id(invoice_id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    if invoice.get('user_id'):
+        raise HTTPException(
+            status_code=400,
+            detail="This invoice is already associated with a user"
+        )
+
+    return StreamingResponse(
+        sse_stream(request, invoice, parse_last_event_id(last_event_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.patch(
     "/{invoice_id}",
     response_model=Invoice,
@@ -256,17 +295,6 @@ async def update_invoice_info(
     - La facture mise à jour
     """
     try:
-        existing_invoice = await get_invoice_by_id(invoice_id)
-        if not existing_invoice:
-            raise HTTPException(status_code=404, detail="Invoice not found")
-            
-        # Verify this is an onboarding invoice (no user_id)
-        if existing_invoice.get('user_id'):
-            raise HTTPException(
-                status_code=400,
-                detail="This invoice is already associated with a user"
-            )
-        
         # Convertir le modèle Pydantic en dict et filtrer les None
         update_data = {
             k: v for k, v in invoice_data.model_dump().items() 
@@ -283,26 +311,23 @@ async def update_invoice_info(
                 update_data['user_id'] = str(update_data['user_id'])
                 
                 # Vérifier si l'utilisateur existe
-                user_response = supabase.table('users').select('*').eq('id', update_data['user_id']).execute()
+                user_response = supabase.table('users').select('id').eq('id', update_data['user_id']).execute()
                 if not user_response.data:
                     raise HTTPException(
                         status_code=400, 
                         detail=f"User not found with ID: {update_data['user_id']}"
                     )
-                    
-                # Vérifier que c'est la première association d'utilisateur
-                if existing_invoice.get('user_id'):
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Invoice is already associated with a user"
-                    )
             except ValueError as e:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Invalid UUID format for user_id: {update_data['user_id']}"
                 )
 
-        updated_invoice = await update_invoice(invoice_id, update_data)
+        # Mise à jour limitée aux factures sans propriétaire : une facture déjà
+        # associée à un utilisateur est refusée par la même requête
+        updated_invoice = await update_owned_invoice(invoice_id, None, update_data, errors={
+            'forbidden': (400, "This invoice is already associated with a user")
+        })
         return updated_invoice
         
     except HTTPException:
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+from dependencies import get_admin_or_internal
+from services import llm_gateway, text_preparation, ocr_service, document_split, field_extraction, invoice_classifier, pipeline, rescoring, sirene_index
+
+router = APIRouter(dependencies=[Depends(get_admin_or_internal)])
+
+@router.get(
+    "/llm",
+    summary="LLM gateway metrics",
+    description="Latency, token usage and retry counters of the LLM gateway since process start"
+)
+async def get_llm_metrics():
+    return llm_gateway.get_metrics()
+
+@router.get(
+    "/ocr",
+    summary="OCR pipeline metrics",
+    description="Pages OCRed/skipped, multi-invoice documents split, token counts before and after OCR text preparation, documents classified without the LLM, LLM extractions skipped by rule-based field extraction and per-stage timings of the upload pipeline since process start"
+)
+async def get_ocr_metrics():
+    return {
+        "pages": ocr_service.get_page_metrics(),
+        "document_split": document_split.get_metrics(),
+        "text_preparation": text_preparation.get_metrics(),
+        "invoice_classifier": invoice_classifier.get_metrics(),
+        "field_extraction": field_extraction.get_metrics(),
+        "pipeline": pipeline.get_metrics()
+    }
+
+@router.get(
+    "/rescoring",
+    summary="Re-scoring metrics",
+    description="Progress of the background re-scoring of open invoices: runs, invoices scanned and re-scored, throttling"
+)
+async def get_rescoring_metrics():
+    return rescoring.get_metrics()
+
+@router.get(
+    "/sirene",
+    summary="SIRENE index metrics",
+    description="Local SIRENE index freshness, local hits and misses (remote API fallbacks) and daily updates"
+)
+async def get_sirene_metrics():
+    return sirene_index.get_metrics()
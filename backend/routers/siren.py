@@ -1,22 +1,30 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 import httpx
-import os
 from typing import Optional
 import re
 from datetime import datetime, timedelta
 import logging
+from services.sirene_index import INSEE_API_BASE_URL, get_insee_token, lookup
+from services.entity_resolution import search
+from dependencies import get_current_user
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-INSEE_API_BASE_URL = "https://api.insee.fr/entreprises/sirene/V3.11"
-INSEE_TOKEN = os.getenv("INSEE_TOKEN", "12d5485c-0e0f-3fa3-8c0a-090966ec8b61")  # Votre token par défaut
+@router.get("/search")
+async def search_siren(
+    q: str = Query(..., min_length=2, max_length=200, description="Nom de l'entreprise cliente"),
+    limit: int = Query(5, ge=1, le=20),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Recherche les SIREN possibles pour un nom d'entreprise
 
-async def get_insee_token():
-    """Récupère un nouveau token INSEE si nécessaire"""
-    # Pour l'instant on utilise le token statique, 
-    # mais on pourrait implémenter le renouvellement automatique plus tard
-    return INSEE_TOKEN
+    Les candidats viennent de l'index SIRENE local et des factures déjà saisies
+    par l'utilisateur, classés par similarité du nom (0 à 1). `match` contient le
+    SIREN à retenir quand le premier candidat est suffisamment sûr, sinon null.
+    """
+    return await search(q, limit=limit, user_id=current_user['id'])
 
 @router.get("/validate/{siren}")
 async def validate_siren(siren: str):
@@ -26,6 +34,11 @@ async def validate_siren(siren: str):
     # Vérifier le format du SIREN (9 chiffres)
     if not re.match(r'^\d{9}$', siren):
         raise HTTPException(status_code=400, detail="Format du SIREN incorrect")
+
+    # Index SIRENE local ; l'API INSEE seulement si le SIREN est absent ou l'index trop ancien
+    unite_legale = lookup(siren)
+    if unite_legale:
+        return {"unite_legale": unite_legale}
     
     try:
         token = await get_insee_token()
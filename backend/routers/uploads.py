@@ -0,0 +1,155 @@
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from typing import Optional
+from models.upload import UploadSessionCreate, UploadSessionResponse, UploadFinalizeRequest, UploadFinalizeResponse
+from services.blob_store import get_blob_store, STAGING_PREFIX
+from services.ocr_service import process_staged_invoice, build_pending_invoice
+from services.ocr_profiles import PROFILES as OCR_PROFILES
+from database.db import create_invoice_if_absent, get_invoice_by_id, set_blob_reference, update_user_id_document
+from dependencies import get_optional_user
+from datetime import datetime, timedelta, timezone
+import jwt
+import logging
+import os
+import uuid
+
+router = APIRouter()
+
+UPLOAD_SESSION_SECRET = os.getenv("UPLOAD_SESSION_SECRET") or os.getenv("JWT_SECRET_KEY")
+UPLOAD_URL_EXPIRES_SECONDS = int(os.getenv("UPLOAD_URL_EXPIRES_SECONDS", "600"))
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10 Mo, comme pour les uploads via l'API
+
+# L'ID de la facture est dérivé de la clé de dépôt : une session ne crée qu'une facture
+UPLOAD_INVOICE_NAMESPACE = uuid.UUID("9d3c7f0e-6a4b-4f4e-8f0a-2b5e1c7d9a31")
+
+ALLOWED_CONTENT_TYPES = {
+    "invoice": ["application/pdf"],
+    "id_document": ["image/jpeg", "image/png", "application/pdf"],
+}
+
+def _encode_session(payload: dict) -> str:
+    if not UPLOAD_SESSION_SECRET:
+        raise HTTPException(status_code=500, detail="Upload session secret is not configured")
+    return jwt.encode(payload, UPLOAD_SESSION_SECRET, algorithm="HS256")
+
+def _decode_session(token: str) -> dict:
+    try:
+        return jwt.decode(token, UPLOAD_SESSION_SECRET, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=410, detail="Upload session expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=400, detail="Invalid upload session")
+
+async def _process_staged_id_document(user_id: str, staging_key: str):
+    try:
+        blob = await get_blob_store().promote(staging_key)
+        await set_blob_reference('user_id_document', user_id, blob.key)
+        await update_user_id_document(user_id, blob.key)
+    except Exception as e:
+        logging.error(f"Error processing staged ID document {staging_key}: {str(e)}")
+
+@router.post(
+    "/sessions",
+    response_model=UploadSessionResponse,
+    summary="Create a direct-to-storage upload session",
+    description="""
+    Returns a short-lived pre-signed URL. The client uploads the file directly to
+    object storage with it, then calls /uploads/finalize. The file bytes never go
+    through the API process.
+
+    Invoice uploads work with or without authentication (onboarding flow);
+    ID document uploads require authentication.
+    """
+)
+async def create_upload_session(
+    session: UploadSessionCreate,
+    current_user: Optional[dict] = Depends(get_optional_user)
+):
+    store = get_blob_store()
+    if not store.supports_presigned_uploads:
+        raise HTTPException(status_code=501, detail="Direct uploads are not available with this storage backend")
+
+    if session.content_type not in ALLOWED_CONTENT_TYPES[session.purpose]:
+        raise HTTPException(status_code=400, detail=f"Content type not allowed for {session.purpose}")
+    if session.size and session.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    user_id = current_user.get('id') if current_user else None
+    if session.purpose == "id_document":
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Authentication required")
+        if current_user.get('id_document_status') == "pending":
+            raise HTTPException(status_code=403, detail="You cannot upload an ID document at this time.")
+
+    staging_key = f"{STAGING_PREFIX}/{uuid.uuid4()}"
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_URL_EXPIRES_SECONDS)
+    upload_url = await store.presigned_put_url(staging_key, session.content_type, UPLOAD_URL_EXPIRES_SECONDS)
+
+    session_token = _encode_session({
+        "key": staging_key,
+        "purpose": session.purpose,
+        "user_id": user_id,
+        "content_type": session.content_type,
+        # La finalisation reste possible un peu après l'expiration de l'URL
+        "exp": expires_at + timedelta(seconds=UPLOAD_URL_EXPIRES_SECONDS),
+    })
+
+    return UploadSessionResponse(
+        session_token=session_token,
+        upload_url=upload_url,
+        headers={"Content-Type": session.content_type},
+        expires_at=expires_at
+    )
+
+@router.post(
+    "/finalize",
+    response_model=UploadFinalizeResponse,
+    summary="Finalize a direct-to-storage upload",
+    description="""
+    Checks that the file is in storage and enqueues its processing by object key:
+    OCR for invoices (creates a pending invoice), attachment to the user profile
+    for ID documents. A session creates at most one invoice: finalizing it again
+    returns that invoice.
+    """
+)
+async def finalize_upload(
+    request: UploadFinalizeRequest,
+    background_tasks: BackgroundTasks,
+    current_user: Optional[dict] = Depends(get_optional_user)
+):
+    session = _decode_session(request.session_token)
+    user_id = current_user.get('id') if current_user else None
+    if session.get("user_id") and session["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Upload session belongs to another user")
+    if request.ocr_profile and request.ocr_profile not in OCR_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown OCR profile: {request.ocr_profile}")
+
+    store = get_blob_store()
+    staging_key = session["key"]
+    size = await store.size(staging_key)
+    if size is None:
+        raise HTTPException(status_code=409, detail="File has not been uploaded yet")
+    if size > MAX_UPLOAD_SIZE:
+        await store.delete(staging_key)
+        raise HTTPException(status_code=413, detail="File too large")
+
+    if session["purpose"] == "id_document":
+        background_tasks.add_task(_process_staged_id_document, session["user_id"], staging_key)
+        return UploadFinalizeResponse(status="processing")
+
+    invoice_id = str(uuid.uuid5(UPLOAD_INVOICE_NAMESPACE, staging_key))
+    invoice = await create_invoice_if_absent(build_pending_invoice(
+        invoice_id,
+        session.get("user_id"),
+        language="fr_FR" if session.get("user_id") else "fr"
+    ))
+    if not invoice:
+        # Session déjà finalisée (rejeu du jeton) : on renvoie la facture existante sans relancer l'OCR
+        existing = await get_invoice_by_id(invoice_id)
+        if not existing:
+            raise HTTPException(status_code=409, detail="Upload session already finalized")
+        return UploadFinalizeResponse(status=existing.get("status") or "processing", invoice_id=invoice_id)
+
+    background_tasks.add_task(
+        process_staged_invoice, invoice_id, staging_key, request.ocr_profile, session.get("user_id")
+    )
+    return UploadFinalizeResponse(status="processing", invoice_id=invoice_id)
@@ -1,16 +1,15 @@
-import os
-import aiofiles
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Header
+from typing import Optional
 from models.user import UserUpdate, User
-from database.db import update_user_profile, update_user_id_document
+from database.db import update_user_profile, update_user_id_document, set_blob_reference
 from dependencies import get_current_user
-from fastapi.responses import JSONResponse
+from services.blob_store import save_upload
+from fastapi.responses import JSONResponse, Response
+from http_cache import content_etag, etag_matches, set_cache_headers, not_modified
 import logging
 
 router = APIRouter()
 
-UPLOAD_DIRECTORY = "user_documents"
-os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 ALLOWED_MIME_TYPES = ["image/jpeg", "image/png", "application/pdf"]
 
 @router.post("/upload-id")
@@ -24,26 +23,20 @@ async def upload_id_document(
     if file.content_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and PDF are allowed.")
 
-    unique_filename = f"{current_user['username']}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIRECTORY, unique_filename)
-
     try:
-        async with aiofiles.open(file_path, "wb") as buffer:
-            content = await file.read()
-            await buffer.write(content)
-
-        result = await update_user_id_document(current_user['username'], file_path)
+        # Stockage adressé par le contenu : pas de collision entre utilisateurs,
+        # et la référence précédente de l'utilisateur est remplacée
+        blob = await save_upload(file)
+        await set_blob_reference('user_id_document', current_user['id'], blob.key)
 
-        await update_user_profile(current_user['id'], {"id_document_status": "pending"})
+        await update_user_id_document(current_user['id'], blob.key)
 
         return JSONResponse(
             status_code=200,
-            content={"message": "ID document uploaded successfully", "file_path": file_path}
+            content={"message": "ID document uploaded successfully", "file_path": blob.key}
         )
 
     except Exception as e:
-        if os.path.exists(file_path):
-            os.remove(file_path)
         logging.error(f"Error uploading ID document: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -62,12 +55,21 @@ async def update_user_profile_route(user_update: UserUpdate, current_user: dict
     raise HTTPException(status_code=400, detail="Failed to update profile")
 
 @router.get("/me", response_model=User)
-async def read_users_me(current_user: dict = Depends(get_current_user)):
-    return {
+async def read_users_me(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    user = {
         "id": current_user["id"],
         "username": current_user["username"],
         "email": current_user["email"],
         "siren_number": current_user.get("siren_number"),
         "phone": current_user.get("phone"),
         "address": current_user.get("address")
-    }
\ No newline at end of file
+    }
+    etag = content_etag(user)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    return user
\ No newline at end of file
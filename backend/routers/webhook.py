@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Request, HTTPException
-from database.db import update_invoice_status, get_invoice_by_pandadoc_id
+from database.db import update_invoice_status_by_pandadoc_id
+from services import events
+from services.events import publish_invoice_event
 import logging
 
 router = APIRouter()
@@ -57,16 +59,11 @@ async def pandadoc_webhook(request: Request):
             document_status = payload['data']['status']
             document_id = payload['data']['id']
             
-            invoice = await get_invoice_by_pandadoc_id(document_id)
-            if not invoice:
-                raise HTTPException(status_code=404, detail="Invoice not found")
-            
             if document_status == 'document.completed':
-                await update_invoice_status(
-                    invoice_id=invoice['id'],
-                    user_id=invoice['user_id'],
-                    status="Signed"
-                )
+                invoice = await update_invoice_status_by_pandadoc_id(document_id, "Signed")
+                if not invoice:
+                    raise HTTPException(status_code=404, detail="Invoice not found")
+                publish_invoice_event(invoice['id'], events.SIGNED, {"status": "Signed"})
                 
         return {"status": "success"}
         
@@ -0,0 +1,38 @@
+"""
+Chemin de sérialisation rapide des réponses factures.
+
+Les lignes Supabase sont validées et encodées en JSON en une seule passe par des
+`TypeAdapter` Pydantic v2 compilés une fois au chargement du module, au lieu de
+passer par la validation de `response_model` puis `jsonable_encoder` puis `json.dumps`.
+Les autres routes utilisent `ORJSONResponse` (classe de réponse par défaut de l'app).
+"""
+from fastapi import Response
+from pydantic import TypeAdapter
+from typing import Iterable, List
+from models.invoice import Invoice, InvoiceListResponse, InvoiceChangesResponse
+
+INVOICE_ADAPTER = TypeAdapter(Invoice)
+INVOICE_LIST_ADAPTER = TypeAdapter(List[InvoiceListResponse])
+INVOICE_CHANGES_ADAPTER = TypeAdapter(InvoiceChangesResponse)
+
+class JSONBytesResponse(Response):
+    """Réponse dont le corps est déjà encodé en JSON"""
+    media_type = "application/json"
+
+def encode_invoice(row: dict) -> bytes:
+    return INVOICE_ADAPTER.dump_json(INVOICE_ADAPTER.validate_python(row))
+
+def encode_invoice_list(rows: Iterable[dict]) -> bytes:
+    return INVOICE_LIST_ADAPTER.dump_json(INVOICE_LIST_ADAPTER.validate_python(rows))
+
+def encode_invoice_changes(changes: dict) -> bytes:
+    return INVOICE_CHANGES_ADAPTER.dump_json(INVOICE_CHANGES_ADAPTER.validate_python(changes))
+
+def invoice_response(row: dict) -> JSONBytesResponse:
+    return JSONBytesResponse(encode_invoice(row))
+
+def invoice_list_response(rows: Iterable[dict]) -> JSONBytesResponse:
+    return JSONBytesResponse(encode_invoice_list(rows))
+
+def invoice_changes_response(changes: dict) -> JSONBytesResponse:
+    return JSONBytesResponse(encode_invoice_changes(changes))
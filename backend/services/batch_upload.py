@@ -0,0 +1,178 @@
+"""
+Upload de plusieurs factures en une requête (plusieurs PDF et/ou archives ZIP).
+
+Les PDF sont écrits dans le blob store au fil de l'eau (les entrées des ZIP sont
+décompressées par morceaux, sans extraire l'archive), puis toutes les factures
+provisoires du lot sont créées en un seul INSERT. L'OCR est lancé par une seule
+tâche de fond, limitée par les emplacements partagés de services.ocr_service.
+"""
+import asyncio
+import logging
+import os
+import uuid
+import zipfile
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+from fastapi import UploadFile
+from services.blob_store import CHUNK_SIZE, get_blob_store, iter_upload
+from services.ocr_service import build_pending_invoice, process_invoice_blob
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+BATCH_MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 Mo par PDF, comme pour les uploads unitaires
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+PDF_MAGIC = b"%PDF"
+
+
+@dataclass
+class BatchItem:
+    filename: str
+    invoice_id: Optional[str] = None
+    blob_key: Optional[str] = None
+    error: Optional[str] = None
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+async def _limited(chunks: AsyncIterator[bytes], max_size: int) -> AsyncIterator[bytes]:
+    size = 0
+    first = True
+    async for chunk in chunks:
+        if first and not chunk.startswith(PDF_MAGIC):
+            raise ValueError("Not a PDF file")
+        first = False
+        size += len(chunk)
+        if size > max_size:
+            raise FileTooLarge()
+        yield chunk
+    if first:
+        raise ValueError("Empty file")
+
+
+async def _iter_zip_entry(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> AsyncIterator[bytes]:
+    """Décompresse une entrée par morceaux (dans un thread)"""
+    entry = await asyncio.to_thread(archive.open, info)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(entry.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        entry.close()
+
+
+async def _store(item: BatchItem, chunks: AsyncIterator[bytes]) -> BatchItem:
+    try:
+        blob = await get_blob_store().put_stream(_limited(chunks, BATCH_MAX_FILE_SIZE), content_type="application/pdf")
+        item.blob_key = blob.key
+    except FileTooLarge:
+        item.error = "File too large"
+    except ValueError as e:
+        item.error = str(e)
+    return item
+
+
+def _is_zip(file: UploadFile) -> bool:
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+async def store_batch_files(files: List[UploadFile]) -> List[BatchItem]:
+    """
+    Enregistre les PDF envoyés (directement ou dans des ZIP) dans le blob store
+
+    Returns:
+        Un élément par fichier, avec la clé du blob ou l'erreur
+    """
+    items: List[BatchItem] = []
+
+    def limit_reached() -> bool:
+        return len(items) >= BATCH_MAX_FILES
+
+    for file in files:
+        if limit_reached():
+            items.append(BatchItem(filename=file.filename or "", error=f"Batch limited to {BATCH_MAX_FILES} files"))
+            continue
+
+        if not _is_zip(file):
+            item = BatchItem(filename=file.filename or "")
+            if file.content_type != "application/pdf":
+                item.error = "Only PDF and ZIP files are allowed"
+                items.append(item)
+            else:
+                items.append(await _store(item, iter_upload(file)))
+            continue
+
+        try:
+            archive = zipfile.ZipFile(file.file)
+        except zipfile.BadZipFile:
+            items.append(BatchItem(filename=file.filename or "", error="Invalid ZIP archive"))
+            continue
+        with archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                    continue
+                if limit_reached():
+                    items.append(BatchItem(filename=name, error=f"Batch limited to {BATCH_MAX_FILES} files"))
+                    break
+                item = BatchItem(filename=name)
+                if not name.lower().endswith(".pdf"):
+                    item.error = "Only PDF files are allowed"
+                elif info.file_size > BATCH_MAX_FILE_SIZE:
+                    item.error = "File too large"
+                else:
+                    try:
+                        await _store(item, _iter_zip_entry(archive, info))
+                    except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                        # Entrée corrompue, chiffrée ou méthode de compression non supportée
+                        item.error = f"Unreadable ZIP entry: {str(e)}"
+                items.append(item)
+    return items
+
+
+def build_batch_invoices(items: List[BatchItem], user_id: str, batch_id: str) -> List[dict]:
+    """Factures provisoires des fichiers correctement enregistrés"""
+    invoices = []
+    for item in items:
+        if item.blob_key:
+            item.invoice_id = str(uuid.uuid4())
+            invoices.append(build_pending_invoice(item.invoice_id, user_id, blob_key=item.blob_key, batch_id=batch_id))
+    return invoices
+
+
+async def process_batch(items: List[BatchItem], ocr_profile: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    OCR des factures du lot ; la concurrence est limitée par OCR_MAX_CONCURRENT_JOBS
+    """
+    jobs = [item for item in items if item.invoice_id]
+    await asyncio.gather(*(
+        process_invoice_blob(item.invoice_id, item.blob_key, ocr_profile, user_id=user_id) for item in jobs
+    ))
+    logger.info(f"Batch OCR done for {len(jobs)} invoices")
+
+
+def summarize_batch(invoices: List[dict]) -> dict:
+    """Progression agrégée d'un lot à partir du statut de ses factures"""
+    counts = {}
+    for invoice in invoices:
+        status = invoice.get('status') or "unknown"
+        counts[status] = counts.get(status, 0) + 1
+    total = len(invoices)
+    pending = counts.get("OCR_PENDING", 0)
+    failed = counts.get("OCR_FAILED", 0)
+    done = total - pending
+    return {
+        "total": total,
+        "done": done,
+        "completed": done - failed,
+        "failed": failed,
+        "pending": pending,
+        "progress": round(done / total, 3) if total else 1.0,
+        "status": "processing" if pending else "done",
+        "counts": counts,
+    }
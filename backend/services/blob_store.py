@@ -0,0 +1,370 @@
+"""
+Stockage des fichiers envoyés par les utilisateurs (factures PDF, pièces d'identité).
+
+Les fichiers sont adressés par leur contenu : la clé est dérivée du SHA-256, ce qui
+déduplique automatiquement les envois identiques. Les objets qui utilisent un fichier
+(facture, pièce d'identité d'un utilisateur) sont enregistrés dans la table
+`blob_refs` ; un fichier qui n'est plus référencé par personne est supprimé par
+le garbage collector.
+
+Deux backends sont disponibles (BLOB_STORE_BACKEND) :
+- `local` : système de fichiers local (BLOB_STORE_PATH) ;
+- `s3` : stockage compatible S3 (AWS, DigitalOcean Spaces, MinIO...).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", os.path.join("uploads", "blobs"))
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+BLOB_GC_INTERVAL_SECONDS = int(os.getenv("BLOB_GC_INTERVAL_SECONDS", str(6 * 3600)))
+# Un blob tout juste écrit n'est pas encore référencé : on lui laisse le temps de l'être
+BLOB_GC_MIN_AGE_SECONDS = int(os.getenv("BLOB_GC_MIN_AGE_SECONDS", "3600"))
+
+CHUNK_SIZE = 1024 * 1024
+KEY_PREFIX = "blobs"
+# Objets déposés directement par les clients via une URL pré-signée, avant promotion
+STAGING_PREFIX = "incoming"
+STAGING_TTL_SECONDS = 24 * 3600
+
+
+@dataclass
+class StoredBlob:
+    key: str
+    size: int
+    sha256: str
+    content_type: Optional[str] = None
+
+
+def blob_key(sha256: str) -> str:
+    """Clé d'un blob à partir de son empreinte SHA-256"""
+    return f"{KEY_PREFIX}/{sha256[:2]}/{sha256}"
+
+
+async def iter_upload(file, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Lit un UploadFile par morceaux sans le charger entièrement en mémoire"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class BlobStore(ABC):
+    """Interface commune aux backends de stockage"""
+
+    supports_presigned_uploads = False
+
+    @abstractmethod
+    async def put_stream(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> StoredBlob:
+        """
+        Stocke le contenu sous sa clé ; si elle existe déjà, sa date de modification
+        est rafraîchie pour que le garbage collector ne la supprime pas avant que la
+        nouvelle référence soit enregistrée
+        """
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        pass
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    async def list_blobs(self, prefix: str = KEY_PREFIX) -> List[Tuple[str, datetime]]:
+        """Liste les blobs stockés sous `prefix` avec leur date de dernière modification"""
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """Taille de l'objet en octets, ou None s'il n'existe pas"""
+
+    async def presigned_put_url(self, key: str, content_type: str, expires_in: int) -> str:
+        """URL permettant au client d'envoyer le fichier directement au stockage"""
+        raise NotImplementedError("This blob store backend does not support pre-signed uploads")
+
+    async def promote(self, staging_key: str) -> StoredBlob:
+        """
+        Déplace un objet déposé via URL pré-signée vers sa clé adressée par le contenu
+        """
+        raise NotImplementedError("This blob store backend does not support pre-signed uploads")
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> StoredBlob:
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, str(uuid.uuid4()))
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+
+            key = blob_key(digest.hexdigest())
+            path = self._path(key)
+            if os.path.exists(path):
+                # Contenu déjà stocké : on garde l'existant, rajeuni pour le garbage collector
+                os.remove(tmp_path)
+                os.utime(path, None)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return StoredBlob(key=key, size=size, sha256=digest.hexdigest(), content_type=content_type)
+
+    async def get(self, key: str) -> bytes:
+        async with aiofiles.open(self._path(key), "rb") as f:
+            return await f.read()
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    async def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def size(self, key: str) -> Optional[int]:
+        path = self._path(key)
+        return os.path.getsize(path) if os.path.exists(path) else None
+
+    async def list_blobs(self, prefix: str = KEY_PREFIX) -> List[Tuple[str, datetime]]:
+        blobs = []
+        base = os.path.join(self.root, prefix)
+        for directory, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                modified_at = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+                blobs.append((key, modified_at))
+        return blobs
+
+
+class S3BlobStore(BlobStore):
+    supports_presigned_uploads = True
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+        )
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> StoredBlob:
+        # La clé dépend du contenu : on bufferise (sur disque au-delà de 8 Mo) avant l'envoi
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                buffer.write(chunk)
+
+            key = blob_key(digest.hexdigest())
+            if await self.exists(key):
+                await self._touch(key)
+            else:
+                buffer.seek(0)
+                extra_args = {"ContentType": content_type} if content_type else None
+                await asyncio.to_thread(self.client.upload_fileobj, buffer, self.bucket, key, ExtraArgs=extra_args)
+        return StoredBlob(key=key, size=size, sha256=digest.hexdigest(), content_type=content_type)
+
+    async def _touch(self, key: str):
+        """Rafraîchit LastModified d'un objet existant (copie sur lui-même, côté serveur)"""
+        # S3 refuse une copie sur soi-même sans changement de métadonnées : on les réécrit à l'identique
+        head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+        extra_args = {"ContentType": head["ContentType"]} if head.get("ContentType") else {}
+        await asyncio.to_thread(
+            self.client.copy_object,
+            Bucket=self.bucket,
+            Key=key,
+            CopySource={"Bucket": self.bucket, "Key": key},
+            Metadata=head.get("Metadata", {}),
+            MetadataDirective="REPLACE",
+            **extra_args,
+        )
+
+    async def get(self, key: str) -> bytes:
+        response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=key)
+        return await asyncio.to_thread(response["Body"].read)
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=key)
+            return response["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    async def presigned_put_url(self, key: str, content_type: str, expires_in: int) -> str:
+        # Signature locale, sans appel réseau
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires_in,
+        )
+
+    async def promote(self, staging_key: str) -> StoredBlob:
+        def hash_object():
+            response = self.client.get_object(Bucket=self.bucket, Key=staging_key)
+            digest = hashlib.sha256()
+            size = 0
+            for chunk in response["Body"].iter_chunks(CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+            return digest.hexdigest(), size, response.get("ContentType")
+
+        sha256, size, content_type = await asyncio.to_thread(hash_object)
+        key = blob_key(sha256)
+        if await self.exists(key):
+            await self._touch(key)
+        else:
+            # Copie côté serveur : les octets ne transitent pas par l'API
+            await asyncio.to_thread(
+                self.client.copy_object,
+                Bucket=self.bucket,
+                Key=key,
+                CopySource={"Bucket": self.bucket, "Key": staging_key},
+            )
+        await self.delete(staging_key)
+        return StoredBlob(key=key, size=size, sha256=sha256, content_type=content_type)
+
+    async def list_blobs(self, prefix: str = KEY_PREFIX) -> List[Tuple[str, datetime]]:
+        def list_all():
+            blobs = []
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{prefix}/"):
+                for obj in page.get("Contents", []):
+                    blobs.append((obj["Key"], obj["LastModified"]))
+            return blobs
+        return await asyncio.to_thread(list_all)
+
+
+_store = None
+
+
+def get_blob_store() -> BlobStore:
+    """Retourne le backend de stockage configuré (instancié une seule fois)"""
+    global _store
+    if _store is None:
+        if BLOB_STORE_BACKEND == "s3":
+            if not S3_BUCKET:
+                raise ValueError("S3_BUCKET must be set when BLOB_STORE_BACKEND is 's3'")
+            _store = S3BlobStore(
+                bucket=S3_BUCKET,
+                endpoint_url=S3_ENDPOINT_URL,
+                region=S3_REGION,
+                access_key_id=S3_ACCESS_KEY_ID,
+                secret_access_key=S3_SECRET_ACCESS_KEY,
+            )
+        else:
+            _store = LocalBlobStore(BLOB_STORE_PATH)
+    return _store
+
+
+async def save_upload(file) -> StoredBlob:
+    """Enregistre un UploadFile dans le blob store en streaming"""
+    return await get_blob_store().put_stream(iter_upload(file), content_type=file.content_type)
+
+
+async def collect_garbage(min_age_seconds: int = BLOB_GC_MIN_AGE_SECONDS) -> int:
+    """
+    Supprime les blobs qui ne sont plus référencés dans `blob_refs`
+
+    Returns:
+        Le nombre de blobs supprimés
+    """
+    from database.db import get_referenced_blob_keys
+
+    store = get_blob_store()
+    cutoff = datetime.now(timezone.utc).timestamp() - min_age_seconds
+    candidates = [key for key, modified_at in await store.list_blobs() if modified_at.timestamp() < cutoff]
+
+    deleted = 0
+    for i in range(0, len(candidates), 500):
+        batch = candidates[i:i + 500]
+        referenced = await get_referenced_blob_keys(batch)
+        for key in batch:
+            if key not in referenced:
+                await store.delete(key)
+                deleted += 1
+
+    # Dépôts pré-signés jamais finalisés
+    staging_cutoff = datetime.now(timezone.utc).timestamp() - STAGING_TTL_SECONDS
+    for key, modified_at in await store.list_blobs(prefix=STAGING_PREFIX):
+        if modified_at.timestamp() < staging_cutoff:
+            await store.delete(key)
+            deleted += 1
+
+    logger.info(f"Blob garbage collection: {deleted} orphan blob(s) deleted out of {len(candidates)} checked")
+    return deleted
+
+
+async def run_garbage_collector():
+    """Boucle de garbage collection lancée au démarrage de l'application"""
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        started = time.perf_counter()
+        try:
+            await collect_garbage()
+        except Exception as e:
+            logger.error(f"Blob garbage collection failed: {str(e)}")
+        logger.debug(f"Blob garbage collection took {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,51 @@
+"""
+Normalisation des noms d'entreprises pour la recherche approchée.
+
+"Société Générale S.A." et "STE GENERALE" donnent la même forme : minuscules,
+sans accents ni ponctuation, sans forme juridique (SAS, SARL, ...), abréviations
+courantes développées.
+"""
+import re
+import unicodedata
+from typing import Optional, Set
+
+# Formes juridiques et mots de liaison, sans valeur pour distinguer deux entreprises
+IGNORED_WORDS = {
+    "sa", "sas", "sasu", "sarl", "eurl", "sci", "snc", "scs", "sca", "scp", "scop", "scic",
+    "selarl", "selas", "selafa", "sel", "ei", "eirl", "gie", "sem", "spa", "gmbh", "ltd", "inc",
+    "et",
+}
+ABBREVIATIONS = {"ste": "societe", "ets": "etablissements", "cie": "compagnie", "st": "saint"}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+# Formes juridiques écrites avec des points (S.A.S., S.A.R.L.)
+_DOTTED = re.compile(r"\b(?:[a-z]\.)+[a-z]\.?(?![a-z0-9])")
+
+
+def normalize_name(name: Optional[str]) -> str:
+    if not name:
+        return ""
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().lower()
+    text = _DOTTED.sub(lambda m: m.group(0).replace(".", ""), text)
+    words = [
+        ABBREVIATIONS.get(word, word)
+        for word in _NON_ALNUM.sub(" ", text).split()
+        if word not in IGNORED_WORDS
+    ]
+    return " ".join(words)
+
+
+def trigrams(normalized: str) -> Set[str]:
+    """Trigrammes d'un nom normalisé, mots bordés d'espaces (comme pg_trgm)"""
+    grams = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    """Indice de Jaccard entre deux ensembles de trigrammes"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
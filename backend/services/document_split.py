@@ -0,0 +1,128 @@
+"""
+Découpage des PDF qui contiennent plusieurs factures (exports mensuels, ...).
+
+Une page est résumée par l'OCR de ses bords (bande du haut, où sont le titre et
+le numéro de facture, et bande du bas, où est la pagination), rendus en basse
+résolution. Seuls les bords de la première et de la dernière page sont lus
+d'abord : le document n'est examiné page par page que s'ils l'annoncent
+(`should_examine`), la plupart des PDF de plusieurs pages ne contenant qu'une
+facture. Une nouvelle facture commence alors sur une page qui porte la mention
+"Page 1/N", ou dont le numéro de facture diffère de celui de la facture en
+cours ; "Page 2/N" et suivantes la prolongent toujours.
+
+Chaque morceau est ensuite traité comme une facture à part
+(voir ocr_service._process_invoice).
+"""
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+from services.field_extraction import find_invoice_number
+
+logger = logging.getLogger(__name__)
+
+OCR_SPLIT_DOCUMENTS = os.getenv("OCR_SPLIT_DOCUMENTS", "true").lower() in ("1", "true", "yes")
+# En dessous, le document n'est pas examiné
+OCR_SPLIT_MIN_PAGES = int(os.getenv("OCR_SPLIT_MIN_PAGES", "2"))
+
+# Factures d'un même PDF traitées en même temps, tous documents confondus
+OCR_SPLIT_CONCURRENCY = int(os.getenv("OCR_SPLIT_CONCURRENCY", "2"))
+
+EDGE_DPI = 100
+# Pages rendues à la fois pour l'OCR des bords (mémoire bornée sur les longs PDF)
+EDGE_CHUNK_PAGES = 8
+TOP_FRACTION = 0.3
+BOTTOM_FRACTION = 0.12
+
+_PAGE_MARKER = re.compile(r"\bpage\s*(\d{1,3})\s*(?:/|sur|of)\s*(\d{1,3})\b", re.I)
+
+_metrics = {
+    "documents_checked": 0,
+    "documents_examined": 0,
+    "documents_split": 0,
+    "invoices_created": 0,
+    "segments_failed": 0,
+}
+
+
+def page_marker(text: str) -> Optional[Tuple[int, int]]:
+    """Pagination "Page k/N" d'une page, si elle est lisible"""
+    match = _PAGE_MARKER.search(text or "")
+    if not match:
+        return None
+    number, total = int(match.group(1)), int(match.group(2))
+    return (number, total) if 1 <= number <= total else None
+
+
+def should_examine(first_edges: str, last_edges: str, page_count: int) -> bool:
+    """
+    Indices, sur les bords de la première et de la dernière page, que le document
+    contient plusieurs factures :
+    - "Page 1/N" en première page, avec N inférieur au nombre de pages ;
+    - une dernière page qui n'est pas la dernière d'une pagination sur tout le
+      document ("Page 2/2" dans un PDF de 6 pages) ;
+    - des numéros de facture différents en première et en dernière page.
+    """
+    first_marker, last_marker = page_marker(first_edges), page_marker(last_edges)
+    if first_marker and first_marker[0] == 1:
+        return first_marker[1] < page_count
+    if last_marker and last_marker != (page_count, page_count):
+        return True
+    first_number, last_number = find_invoice_number(first_edges), find_invoice_number(last_edges)
+    return bool(first_number and last_number and first_number != last_number)
+
+
+def split_pages(edges: List[str]) -> List[List[int]]:
+    """
+    Regroupe les pages (numérotées à partir de 1) en factures
+
+    Args:
+        edges: texte OCR des bords de chaque page, dans l'ordre
+    """
+    segments: List[List[int]] = []
+    current_number = None
+    for page, text in enumerate(edges, start=1):
+        number = find_invoice_number(text)
+        marker = page_marker(text)
+        if not segments:
+            starts = True
+        elif marker:
+            starts = marker[0] == 1
+        else:
+            # Sans numéro connu pour la facture en cours, un numéro qui apparaît ne suffit pas
+            starts = bool(number and current_number and number != current_number)
+        if starts:
+            segments.append([page])
+            current_number = number
+        else:
+            segments[-1].append(page)
+            current_number = current_number or number
+    return segments
+
+
+def crop_edges(image) -> list:
+    """Bandes du haut et du bas d'une page rendue"""
+    width, height = image.size
+    return [
+        image.crop((0, 0, width, int(height * TOP_FRACTION))),
+        image.crop((0, int(height * (1 - BOTTOM_FRACTION)), width, height)),
+    ]
+
+
+def record(segments: List[List[int]], completed: Optional[int] = None, examined: bool = False):
+    """
+    Compte un document vérifié ; `examined` : ses pages ont toutes été lues,
+    `completed` : factures extraites de ses morceaux
+    """
+    completed = len(segments) if completed is None else completed
+    _metrics["documents_checked"] += 1
+    _metrics["documents_examined"] += examined
+    if len(segments) > 1:
+        _metrics["documents_split"] += 1
+        # La première facture extraite reprend la ligne déposée
+        _metrics["invoices_created"] += max(completed - 1, 0)
+        _metrics["segments_failed"] += len(segments) - completed
+
+
+def get_metrics() -> dict:
+    return {**_metrics, "enabled": OCR_SPLIT_DOCUMENTS, "concurrency": OCR_SPLIT_CONCURRENCY}
@@ -0,0 +1,146 @@
+"""
+Détection des factures presque identiques d'un même utilisateur (rescans,
+ré-exports, montant corrigé).
+
+Chaque facture extraite reçoit une signature MinHash de son texte (triplets de
+mots) et de ses champs clés, découpée en DUPLICATE_BANDS bandes LSH stockées
+avec la facture (migration 007). Les factures qui partagent une bande sont
+candidates ; la similarité de Jaccard est estimée sur les signatures. Un modèle
+de facture réutilisé chaque mois donne des textes très proches : un candidat
+n'est retenu que si ses champs clés désignent aussi la même facture (même
+numéro, ou même client, montant et échéance).
+"""
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from database.db import find_invoices_by_lsh_bands
+from services.company_names import normalize_name
+from timestamps import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.7"))
+# 64 permutations en 16 bandes de 4 : une paire à 0,7 de similarité partage une
+# bande avec une probabilité ~0,99, une paire à 0,3 avec une probabilité ~0,12
+NUM_PERMUTATIONS = 64
+DUPLICATE_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // DUPLICATE_BANDS
+AMOUNT_TOLERANCE = 0.005
+
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"[a-z0-9]+")
+_permutations = None
+
+
+def _coefficients():
+    """Coefficients (a, b) des permutations, fixes pour que les signatures restent comparables"""
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+
+        rng = np.random.default_rng(20240501)
+        _permutations = (
+            rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64),
+            rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64),
+        )
+    return _permutations
+
+
+def _hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "little") & _PRIME
+
+
+def _invoice_number(value: Optional[str]) -> str:
+    return "".join(_WORD.findall((value or "").lower()))
+
+
+def shingles(text: str, fields: dict) -> set:
+    """Triplets de mots du texte et jetons des champs clés"""
+    words = _WORD.findall((text or "").lower())
+    tokens = {" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))} if words else set()
+    if fields.get('invoice_number'):
+        tokens.add(f"#number:{_invoice_number(fields['invoice_number'])}")
+    if fields.get('client'):
+        tokens.add(f"#client:{normalize_name(fields['client'])}")
+    if fields.get('amount') is not None:
+        tokens.add(f"#amount:{float(fields['amount']):.2f}")
+    if fields.get('due_date'):
+        tokens.add(f"#due:{_day(fields['due_date'])}")
+    return tokens
+
+
+def signature(tokens: set) -> List[int]:
+    """Signature MinHash (NUM_PERMUTATIONS entiers < 2^31)"""
+    import numpy as np
+
+    if not tokens:
+        return []
+    a, b = _coefficients()
+    hashes = np.fromiter((_hash(token) for token in tokens), dtype=np.uint64, count=len(tokens))
+    values = (hashes[:, None] * a[None, :] + b[None, :]) % _PRIME
+    return values.min(axis=0).astype(np.int64).tolist()
+
+
+def lsh_bands(minhash: List[int]) -> List[str]:
+    """Clés des bandes LSH : numéro de bande et hash des valeurs de la bande"""
+    bands = []
+    for band in range(DUPLICATE_BANDS):
+        rows = minhash[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(",".join(map(str, rows)).encode(), digest_size=6).hexdigest()
+        bands.append(f"{band:02d}{digest}")
+    return bands
+
+
+def estimate_similarity(a: List[int], b: List[int]) -> float:
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def _day(value) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return parse_datetime(value).date().isoformat()
+
+
+def same_invoice(fields: dict, other: dict) -> bool:
+    """Les champs clés désignent-ils la même facture ?"""
+    number = _invoice_number(fields.get('invoice_number'))
+    if number and number == _invoice_number(other.get('invoice_number')):
+        return True
+    if normalize_name(fields.get('client')) != normalize_name(other.get('client')):
+        return False
+    if not fields.get('due_date') or not other.get('due_date') or _day(fields['due_date']) != _day(other['due_date']):
+        return False
+    amount, other_amount = float(fields.get('amount') or 0), float(other.get('amount') or 0)
+    return abs(amount - other_amount) <= AMOUNT_TOLERANCE * max(amount, other_amount)
+
+
+async def find_duplicate(user_id: str, invoice_id: str, text: str, fields: dict) -> Tuple[dict, Optional[Tuple[str, float]]]:
+    """
+    Calcule la signature d'une facture extraite et cherche un doublon parmi les
+    factures de l'utilisateur
+
+    Returns:
+        Les colonnes à enregistrer avec la facture (minhash, lsh_bands) et, s'il
+        y en a un, le doublon le plus proche : (id, similarité estimée)
+    """
+    minhash = signature(shingles(text, fields))
+    if not minhash:
+        return {}, None
+    bands = lsh_bands(minhash)
+    columns = {"minhash": minhash, "lsh_bands": bands}
+
+    best = None
+    for candidate in await find_invoices_by_lsh_bands(user_id, bands, exclude_id=invoice_id):
+        similarity = estimate_similarity(minhash, candidate.get('minhash') or [])
+        if similarity < DUPLICATE_THRESHOLD or not same_invoice(fields, candidate):
+            continue
+        if best is None or similarity > best[1]:
+            best = (candidate['id'], similarity)
+    if best:
+        logger.info(f"Invoice {invoice_id} is a probable duplicate of {best[0]} (similarity {best[1]:.2f})")
+    return columns, best
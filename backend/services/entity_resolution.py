@@ -0,0 +1,204 @@
+"""
+Résolution d'un nom de client vers un SIREN.
+
+Deux sources, interrogées par similarité de trigrammes sur les noms normalisés
+(services.company_names) :
+- l'index SIRENE local (table FTS5 `noms`, voir services.sirene_index) ;
+- les couples (client, client_siren) déjà présents dans les factures de
+  l'utilisateur, gardés en mémoire (un index par utilisateur : les clients des
+  autres ne sont jamais proposés) et reconstruits toutes les
+  ENTITY_INDEX_REFRESH_SECONDS secondes.
+
+Les candidats sont classés par similarité ; le SIREN n'est rempli automatiquement
+que si le premier est assez sûr (ENTITY_AUTOFILL_THRESHOLD) et nettement devant
+le second (ENTITY_AUTOFILL_MARGIN).
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set
+from database.db import get_invoices_page
+from services import sirene_index
+from services.company_names import normalize_name, similarity, trigrams
+
+logger = logging.getLogger(__name__)
+
+ENTITY_AUTOFILL_THRESHOLD = float(os.getenv("ENTITY_AUTOFILL_THRESHOLD", "0.85"))
+ENTITY_AUTOFILL_MARGIN = float(os.getenv("ENTITY_AUTOFILL_MARGIN", "0.1"))
+ENTITY_INDEX_REFRESH_SECONDS = int(os.getenv("ENTITY_INDEX_REFRESH_SECONDS", "3600"))
+
+REGISTRY_CANDIDATES = 50
+MIN_SCORE = 0.2
+# Un SIREN trouvé dans nos factures et dans le répertoire est plus sûr
+BOTH_SOURCES_BONUS = 0.05
+CEASED_PENALTY = 0.9
+SIREN_FORMAT = re.compile(r"^\d{9}$")
+
+
+class InvoiceNameIndex:
+    """Index en mémoire des noms de clients de nos factures et de leurs SIREN"""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.labels: List[str] = []
+        self.grams: List[Set[str]] = []
+        self.sirens: List[Counter] = []
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self._positions: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, client: Optional[str], siren: Optional[str]):
+        normalized = normalize_name(client)
+        if not normalized or not siren or not SIREN_FORMAT.match(siren):
+            return
+        position = self._positions.get(normalized)
+        if position is None:
+            position = self._positions[normalized] = len(self.names)
+            self.names.append(normalized)
+            self.labels.append(client.strip())
+            self.grams.append(trigrams(normalized))
+            self.sirens.append(Counter())
+            for gram in self.grams[position]:
+                self.postings[gram].append(position)
+        self.sirens[position][siren] += 1
+
+    def search(self, grams: Set[str], limit: int) -> List[tuple]:
+        """(position, similarité) des noms partageant le plus de trigrammes avec la requête"""
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        results = [
+            (position, count / (len(grams) + len(self.grams[position]) - count))
+            for position, count in shared.items()
+        ]
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:limit]
+
+
+# Index des noms de clients, par utilisateur
+_invoice_indexes: Dict[str, InvoiceNameIndex] = {}
+
+
+async def build_invoice_index(page_size: int = 1000) -> Dict[str, InvoiceNameIndex]:
+    """Reconstruit les index des noms de clients à partir des factures de chaque utilisateur"""
+    global _invoice_indexes
+    indexes: Dict[str, InvoiceNameIndex] = defaultdict(InvoiceNameIndex)
+    after_id = None
+    while True:
+        page = await get_invoices_page('id, user_id, client, client_siren', after_id=after_id, limit=page_size)
+        if not page:
+            break
+        after_id = page[-1]['id']
+        for invoice in page:
+            # Factures d'onboarding sans propriétaire : personne ne doit les retrouver
+            if invoice.get('user_id'):
+                indexes[invoice['user_id']].add(invoice.get('client'), invoice.get('client_siren'))
+        await asyncio.sleep(0)
+    _invoice_indexes = dict(indexes)
+    logger.info(f"Client name indexes built for {len(indexes)} users, "
+                f"{sum(len(index) for index in indexes.values())} names")
+    return _invoice_indexes
+
+
+async def run_index_refresh():
+    """Reconstruction périodique de l'index, lancée au démarrage de l'application"""
+    while True:
+        try:
+            await build_invoice_index()
+        except Exception as e:
+            logger.error(f"Client name index build failed: {str(e)}")
+        await asyncio.sleep(ENTITY_INDEX_REFRESH_SECONDS)
+
+
+def remember(user_id: Optional[str], client: Optional[str], siren: Optional[str]):
+    """Ajoute un couple client / SIREN de l'utilisateur sans attendre la prochaine reconstruction"""
+    if user_id:
+        _invoice_indexes.setdefault(user_id, InvoiceNameIndex()).add(client, siren)
+
+
+async def search(name: str, limit: int = 5, user_id: Optional[str] = None) -> dict:
+    """
+    Candidats SIREN pour un nom de client, classés par score décroissant ; les
+    factures ne sont consultées que pour `user_id` (ses propres clients).
+    La recherche dans l'index SIRENE (classement bm25 de toutes les
+    correspondances) tourne dans un thread pour ne pas bloquer la boucle.
+
+    Returns:
+        La requête normalisée, les candidats (siren, name, score, sources,
+        etat_administratif) et le SIREN à retenir si la confiance est suffisante
+    """
+    started = time.perf_counter()
+    normalized = normalize_name(name)
+    grams = trigrams(normalized)
+    candidates: Dict[str, dict] = {}
+
+    def offer(siren: str, label: str, score: float, source: str, etat: Optional[str] = None):
+        candidate = candidates.get(siren)
+        if candidate is None:
+            candidates[siren] = {"siren": siren, "name": label, "score": score, "sources": [source],
+                                 "etat_administratif": etat}
+            return
+        if source not in candidate["sources"]:
+            candidate["sources"].append(source)
+            score = min(max(score, candidate["score"]) + BOTH_SOURCES_BONUS, 1.0)
+        if source == "sirene":
+            candidate["name"], candidate["etat_administratif"] = label, etat
+        candidate["score"] = max(score, candidate["score"])
+
+    invoice_index = _invoice_indexes.get(user_id) if user_id else None
+    if grams:
+        for position, score in invoice_index.search(grams, REGISTRY_CANDIDATES) if invoice_index else ():
+            counts = invoice_index.sirens[position]
+            total = sum(counts.values())
+            for siren, count in counts.items():
+                # Un même nom associé à plusieurs SIREN : on pondère par fréquence
+                offer(siren, invoice_index.labels[position], score * (0.5 + 0.5 * count / total), "invoices")
+
+        units = await asyncio.to_thread(sirene_index.search_names, normalized, REGISTRY_CANDIDATES)
+        for unit in units:
+            score = similarity(grams, trigrams(unit["normalized_name"]))
+            if unit.get("etat_administratif") == "C":
+                score *= CEASED_PENALTY
+            offer(unit["siren"], unit.get("denomination") or unit["normalized_name"], score, "sirene",
+                  unit.get("etat_administratif"))
+
+    ranked = sorted(
+        (candidate for candidate in candidates.values() if candidate["score"] >= MIN_SCORE),
+        key=lambda candidate: candidate["score"], reverse=True
+    )[:limit]
+    for candidate in ranked:
+        candidate["score"] = round(candidate["score"], 3)
+    return {
+        "query": name,
+        "normalized": normalized,
+        "candidates": ranked,
+        "match": _confident_match(ranked),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _confident_match(ranked: List[dict]) -> Optional[str]:
+    if not ranked or ranked[0]["score"] < ENTITY_AUTOFILL_THRESHOLD:
+        return None
+    if len(ranked) > 1 and ranked[0]["score"] - ranked[1]["score"] < ENTITY_AUTOFILL_MARGIN:
+        return None
+    return ranked[0]["siren"]
+
+
+async def resolve_client_siren(client: Optional[str], user_id: Optional[str] = None) -> Optional[str]:
+    """SIREN du client si la correspondance est sûre, sinon None (factures de `user_id` seulement)"""
+    if not client:
+        return None
+    try:
+        siren = (await search(client, limit=2, user_id=user_id))["match"]
+    except Exception as e:
+        logger.warning(f"Client SIREN resolution failed for '{client}': {str(e)}")
+        return None
+    if siren:
+        logger.info(f"Client '{client}' resolved to SIREN {siren}")
+    return siren
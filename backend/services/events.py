@@ -0,0 +1,182 @@
+"""
+Pub/sub en mémoire des changements d'état des factures.
+
+Le pipeline OCR et les webhooks publient des événements (OCR démarré, progression
+par page, extraction terminée, score calculé, envoyée, signée...) ; les endpoints
+SSE et WebSocket les diffusent aux clients abonnés à la facture.
+
+Chaque facture garde un petit historique des derniers événements pour permettre
+la reprise après déconnexion via l'en-tête `Last-Event-ID`.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = 50
+MAX_TOPICS = 10000
+KEEPALIVE_SECONDS = 15
+
+# Types d'événements publiés
+OCR_STARTED = "ocr_started"
+OCR_PAGE = "ocr_page"
+EXTRACTION_DONE = "extraction_done"
+OCR_FAILED = "ocr_failed"
+SCORED = "scored"
+SENT = "sent"
+SIGNED = "signed"
+STATUS = "status"
+
+
+@dataclass
+class InvoiceEvent:
+    id: int
+    invoice_id: str
+    type: str
+    data: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "invoice_id": self.invoice_id, "type": self.type, "data": self.data}
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+class InvoiceEventBus:
+    def __init__(self, history_size: int = HISTORY_SIZE, max_topics: int = MAX_TOPICS):
+        self.history_size = history_size
+        self.max_topics = max_topics
+        self._last_id = 0
+        self._history: "OrderedDict[str, deque]" = OrderedDict()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def _next_id(self) -> int:
+        # Identifiants croissants même après un redémarrage (basés sur l'horloge)
+        self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+        return self._last_id
+
+    def publish(self, invoice_id: str, event_type: str, data: Optional[dict] = None) -> InvoiceEvent:
+        event = InvoiceEvent(id=self._next_id(), invoice_id=invoice_id, type=event_type, data=data or {})
+
+        history = self._history.get(invoice_id)
+        if history is None:
+            history = self._history[invoice_id] = deque(maxlen=self.history_size)
+            # On oublie les factures les plus anciennes au-delà de max_topics
+            while len(self._history) > self.max_topics:
+                self._history.popitem(last=False)
+        else:
+            self._history.move_to_end(invoice_id)
+        history.append(event)
+
+        for queue in self._subscribers.get(invoice_id, ()):
+            queue.put_nowait(event)
+        logger.debug(f"Published {event_type} for invoice {invoice_id}")
+        return event
+
+    def attach(self, invoice_id: str, last_event_id: Optional[int] = None) -> Tuple[asyncio.Queue, List[InvoiceEvent]]:
+        """
+        Abonne un client à une facture
+
+        Returns:
+            La file des nouveaux événements et les événements manqués depuis `last_event_id`
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(invoice_id, set()).add(queue)
+        backlog = []
+        if last_event_id is not None:
+            backlog = [event for event in self._history.get(invoice_id, ()) if event.id > last_event_id]
+        return queue, backlog
+
+    def detach(self, invoice_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(invoice_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[invoice_id]
+
+    async def listen(self, invoice_id: str, last_event_id: Optional[int] = None,
+                     keepalive: float = KEEPALIVE_SECONDS,
+                     snapshot: Optional[Callable[[], Awaitable[dict]]] = None) -> AsyncIterator[Optional[InvoiceEvent]]:
+        """
+        Itère sur les événements d'une facture : d'abord ceux manqués depuis
+        `last_event_id`, puis les nouveaux au fil de l'eau. Produit None après
+        `keepalive` secondes sans événement pour permettre d'entretenir la connexion.
+
+        Sans `last_event_id`, `snapshot` donne l'état courant, lu une fois l'abonnement
+        en place : un changement publié pendant la lecture arrive ensuite par la file
+        au lieu d'être perdu. Il est envoyé comme événement STATUS avec l'identifiant
+        courant, à partir duquel le client peut reprendre.
+        """
+        queue, backlog = self.attach(invoice_id, last_event_id)
+        try:
+            if last_event_id is None and snapshot is not None:
+                # Identifiant pris avant la lecture : une reprise rejoue ce qui a été publié pendant
+                snapshot_id = self._last_id
+                yield InvoiceEvent(id=snapshot_id, invoice_id=invoice_id, type=STATUS, data=await snapshot())
+            for event in backlog:
+                last_event_id = event.id
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                # Déjà envoyé pendant le rejeu de l'historique
+                if last_event_id is not None and event.id <= last_event_id:
+                    continue
+                yield event
+        finally:
+            self.detach(invoice_id, queue)
+
+
+event_bus = InvoiceEventBus()
+
+
+def publish_invoice_event(invoice_id: str, event_type: str, data: Optional[dict] = None):
+    """Publie un événement ; ne doit jamais faire échouer le traitement appelant"""
+    try:
+        event_bus.publish(invoice_id, event_type, data)
+    except Exception as e:
+        logger.error(f"Error publishing {event_type} for invoice {invoice_id}: {str(e)}")
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def status_snapshot(invoice: dict) -> Callable[[], Awaitable[dict]]:
+    """Relit le statut de la facture au moment de l'abonnement (voir InvoiceEventBus.listen)"""
+    async def read() -> dict:
+        from database.db import get_invoice_by_id
+
+        try:
+            current = await get_invoice_by_id(invoice['id'])
+        except Exception as e:
+            logger.warning(f"Could not reload invoice {invoice['id']} status: {str(e)}")
+            current = None
+        return {'status': (current or invoice).get('status')}
+    return read
+
+
+async def sse_stream(request, invoice: dict, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Flux Server-Sent Events pour une facture : état courant, événements manqués,
+    puis nouveaux événements, avec un commentaire keepalive régulier
+    """
+    events = event_bus.listen(invoice['id'], last_event_id, snapshot=status_snapshot(invoice))
+    try:
+        async for event in events:
+            if await request.is_disconnected():
+                break
+            yield event.to_sse() if event else ": keepalive\n\n"
+    finally:
+        await events.aclose()
@@ -0,0 +1,418 @@
+"""
+Extraction des champs d'une facture par règles, avant le LLM.
+
+Beaucoup de champs des factures françaises ont un format strict : SIREN (9
+chiffres, clé de Luhn), TVA intracommunautaire (FR + clé + SIREN), IBAN (clé
+modulo 97), dates, lignes "Total TTC" / "Net à payer", emails. Chaque règle
+propose des candidats avec une confiance ; seul le meilleur candidat de chaque
+champ est gardé.
+
+Si tous les champs requis d'OCRResult sont trouvés avec une confiance d'au
+moins FIELD_RULES_MIN_CONFIDENCE, l'appel au LLM est évité ; sinon les
+candidats lui sont transmis comme indices.
+"""
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from models.ocr import OCRResult
+
+logger = logging.getLogger(__name__)
+
+FIELD_RULES_ENABLED = os.getenv("FIELD_RULES_ENABLED", "true").lower() in ("1", "true", "yes")
+FIELD_RULES_MIN_CONFIDENCE = float(os.getenv("FIELD_RULES_MIN_CONFIDENCE", "0.85"))
+
+REQUIRED_FIELDS = ["invoice_number", "client", "amount", "due_date"]
+# Lignes lues après une étiquette "Client" pour trouver l'adresse, l'email, ...
+CLIENT_BLOCK_LINES = 6
+
+# SIREN ou SIRET, chiffres éventuellement groupés par trois
+_SIREN = re.compile(r"\b\d{3}[ .]?\d{3}[ .]?\d{3}(?:[ .]?\d{5})?\b")
+_VAT = re.compile(r"\bFR[ ]?([0-9A-Z]{2})[ ]?(\d{3})[ ]?(\d{3})[ ]?(\d{3})\b")
+_IBAN = re.compile(r"\b[A-Z]{2}\d{2}(?:[ ]?[A-Z0-9]{4}){2,7}(?:[ ]?[A-Z0-9]{1,3})?\b")
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[a-z]{2,}", re.I)
+_PHONE = re.compile(r"(?:\+33[ .]?|\b0)[1-9](?:[ .-]?\d{2}){4}\b")
+_POSTAL_CITY = re.compile(r"^(?:.*?\s)?(\d{5})\s+([A-Za-zÀ-ÿ][A-Za-zÀ-ÿ' -]+)$")
+
+_MONTHS = {
+    "janvier": 1, "fevrier": 2, "février": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6, "juillet": 7,
+    "aout": 8, "août": 8, "septembre": 9, "octobre": 10, "novembre": 11, "decembre": 12, "décembre": 12,
+}
+_DATE = re.compile(
+    r"\b(\d{4})-(\d{2})-(\d{2})\b"
+    r"|\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})\b"
+    r"|\b(\d{1,2})(?:er)?\s+(" + "|".join(_MONTHS) + r")\s+(\d{4})\b",
+    re.I,
+)
+_AMOUNT = re.compile(r"(?<![\d.,])(\d{1,3}(?:[ .,]\d{3})+|\d+)(?:[.,](\d{1,2}))?(?![\d%])(?!\s*%)")
+
+_INVOICE_NUMBER_LABELS = [
+    (re.compile(r"\b(?:facture|invoice|avoir)\s*(?:n[°ºo]\.?|num[ée]ro|no\.?|#)\s*:?\s*", re.I), 0.92),
+    (re.compile(r"\bn[°ºo]\s*(?:de\s+)?facture\s*:?\s*", re.I), 0.92),
+    (re.compile(r"\bfacture\s*:\s*", re.I), 0.85),
+    (re.compile(r"\br[ée]f[ée]rence\s*:?\s*", re.I), 0.6),
+]
+_INVOICE_NUMBER = re.compile(r"[A-Z0-9][A-Z0-9\-_/.]*", re.I)
+_CLIENT_LABEL = re.compile(
+    r"^(?:client|factur[ée]e? [àa]|destinataire|adress[ée]e? [àa]|bill to|customer|soci[ée]t[ée] cliente)\b\s*:?\s*(.*)$",
+    re.I,
+)
+# "Client n° 1234" : code client, pas un nom
+_CLIENT_CODE = re.compile(r"^(?:n[°ºo]|num|code|r[ée]f|id)\b", re.I)
+_AMOUNT_LABELS = [
+    (re.compile(r"\bnet [àa] payer\b", re.I), 0.95),
+    (re.compile(r"\b(?:total|montant) ttc\b|\btotal [àa] payer\b|\breste [àa] payer\b|\bmontant d[ûu]\b|\bamount due\b", re.I), 0.92),
+    (re.compile(r"\btotal\b(?!\s*(?:h\.?t|tva|t\.v\.a|vat|hors))", re.I), 0.5),
+]
+# Après ce mot sur la ligne d'un total, les montants sont ceux de la TVA ou du HT
+_AMOUNT_STOP = re.compile(r"\b(?:tva|t\.v\.a|vat|h\.t|ht|hors taxes?)\b|%", re.I)
+_DUE_DATE_LABEL = re.compile(
+    r"date d'[ée]ch[ée]ance|[ée]ch[ée]ance|date limite de (?:paiement|r[èe]glement)|[àa] payer avant le"
+    r"|payable (?:le|avant le|au plus tard le)|due date|date de r[èe]glement",
+    re.I,
+)
+_INVOICE_DATE_LABEL = re.compile(r"date de (?:la )?facture|date d'[ée]mission|facture du|[ée]mise? le|\bdate\s*:", re.I)
+_PAYMENT_TERMS = re.compile(r"(\d{1,3})\s*jours(\s+fin de mois)?", re.I)
+_UPON_RECEIPT = re.compile(r"[àa] r[ée]ception|comptant", re.I)
+
+_metrics = {
+    "documents": 0,
+    "llm_skipped": 0,
+    "llm_calls": 0,
+    "rules_ms": 0.0,
+    "llm_ms": 0.0,
+}
+
+
+@dataclass
+class FieldCandidate:
+    value: object
+    confidence: float
+    rule: str
+
+
+class FieldCandidates:
+    """Meilleur candidat de chaque champ"""
+
+    def __init__(self):
+        self.fields: Dict[str, FieldCandidate] = {}
+        self.elapsed_ms = 0.0
+
+    def offer(self, field: str, value, confidence: float, rule: str):
+        if value in (None, ""):
+            return
+        current = self.fields.get(field)
+        if current is None or confidence > current.confidence:
+            self.fields[field] = FieldCandidate(value, round(confidence, 3), rule)
+        elif current.value == value:
+            # Deux règles qui s'accordent : plus sûr
+            current.confidence = round(min(max(current.confidence, confidence) + 0.03, 0.99), 3)
+
+    def confident(self, min_confidence: float = None) -> Dict[str, object]:
+        threshold = FIELD_RULES_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        return {field: c.value for field, c in self.fields.items() if c.confidence >= threshold}
+
+    def to_ocr_result(self, min_confidence: float = None) -> Optional[OCRResult]:
+        """OCRResult complet si tous les champs requis sont sûrs, sinon None"""
+        values = self.confident(min_confidence)
+        if any(field not in values for field in REQUIRED_FIELDS):
+            return None
+        values.pop("iban", None)
+        try:
+            return OCRResult(**values)
+        except Exception as e:
+            logger.warning(f"Rule-based fields rejected by OCRResult: {e}")
+            return None
+
+    def hints(self) -> Dict[str, dict]:
+        """Candidats transmis au LLM"""
+        return {
+            field: {
+                "value": c.value.strftime("%Y-%m-%d") if isinstance(c.value, datetime) else c.value,
+                "confidence": c.confidence,
+            }
+            for field, c in self.fields.items()
+        }
+
+
+def luhn_valid(digits: str) -> bool:
+    total = 0
+    for index, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if index % 2 else 1)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+
+def siren_candidates(text: str) -> List[str]:
+    """Numéros SIREN (ou SIRET) valides (clé de Luhn) présents dans un texte"""
+    candidates = []
+    for match in _SIREN.finditer(text or ""):
+        siren = re.sub(r"\D", "", match.group(0))[:9]
+        if luhn_valid(siren) and siren not in candidates:
+            candidates.append(siren)
+    return candidates
+
+
+def vat_siren(key: str, siren: str) -> Optional[str]:
+    """SIREN d'un numéro de TVA français si sa clé est correcte"""
+    if key.isdigit() and int(key) != (12 + 3 * (int(siren) % 97)) % 97:
+        return None
+    return siren
+
+
+def iban_valid(iban: str) -> bool:
+    compact = iban.replace(" ", "").upper()
+    if not 15 <= len(compact) <= 34:
+        return False
+    rearranged = compact[4:] + compact[:4]
+    return int("".join(str(int(c, 36)) for c in rearranged)) % 97 == 1
+
+
+def parse_amount(integer: str, decimals: Optional[str]) -> Optional[float]:
+    """Montant à partir de sa partie entière et de ses centimes : ("1 250", "00") -> 1250.0"""
+    digits = re.sub(r"[ .,]", "", integer)
+    if not digits:
+        return None
+    return float(f"{int(digits)}.{decimals or '00'}")
+
+
+def parse_dates(text: str) -> List[datetime]:
+    dates = []
+    for match in _DATE.finditer(text):
+        try:
+            if match.group(1):
+                dates.append(datetime(int(match.group(1)), int(match.group(2)), int(match.group(3))))
+            elif match.group(4):
+                year = int(match.group(6))
+                dates.append(datetime(year + 2000 if year < 100 else year, int(match.group(5)), int(match.group(4))))
+            else:
+                dates.append(datetime(int(match.group(9)), _MONTHS[match.group(8).lower()], int(match.group(7))))
+        except ValueError:
+            continue
+    return dates
+
+
+def _next_line(lines: List[str], index: int) -> Tuple[int, str]:
+    """Première ligne non vide après `index` (tableaux : étiquette et valeur sur deux lignes)"""
+    for position in range(index + 1, min(index + 3, len(lines))):
+        if lines[position].strip():
+            return position, lines[position].strip()
+    return index, ""
+
+
+def _invoice_number(candidates: FieldCandidates, lines: List[str]):
+    for index, line in enumerate(lines):
+        for label, confidence in _INVOICE_NUMBER_LABELS:
+            match = label.search(line)
+            if not match:
+                continue
+            rest = line[match.end():].strip()
+            value_confidence = confidence
+            if not rest:
+                rest, value_confidence = _next_line(lines, index)[1], confidence - 0.1
+            number = _INVOICE_NUMBER.match(rest)
+            value = number.group(0).rstrip("./-") if number else ""
+            if any(c.isdigit() for c in value):
+                candidates.offer("invoice_number", value, value_confidence, "invoice_number_label")
+            break
+
+
+def find_invoice_number(text: str) -> Optional[str]:
+    """Numéro de facture annoncé par une étiquette ("Facture n° ...") dans un texte"""
+    candidates = FieldCandidates()
+    _invoice_number(candidates, (text or "").splitlines())
+    candidate = candidates.fields.get("invoice_number")
+    return candidate.value if candidate and candidate.confidence >= FIELD_RULES_MIN_CONFIDENCE else None
+
+
+def _client_block(candidates: FieldCandidates, lines: List[str]) -> List[str]:
+    """Nom du client après son étiquette ; renvoie les lignes suivantes (adresse, ...)"""
+    for index, line in enumerate(lines):
+        match = _CLIENT_LABEL.match(line.strip())
+        if not match:
+            continue
+        rest = match.group(1).strip()
+        if _CLIENT_CODE.match(rest):
+            continue
+        if rest and any(c.isalpha() for c in rest):
+            candidates.offer("client", rest, 0.9, "client_label")
+            return lines[index + 1:index + 1 + CLIENT_BLOCK_LINES]
+        position, name = _next_line(lines, index)
+        if name and any(c.isalpha() for c in name) and not _CLIENT_LABEL.match(name):
+            candidates.offer("client", name, 0.85, "client_label_next_line")
+            return lines[position + 1:position + 1 + CLIENT_BLOCK_LINES]
+    return []
+
+
+def _client_details(candidates: FieldCandidates, block: List[str]):
+    for position, line in enumerate(block):
+        match = _POSTAL_CITY.match(line.strip())
+        if match:
+            candidates.offer("client_postal_code", match.group(1), 0.85, "client_block")
+            candidates.offer("client_city", match.group(2).strip(), 0.85, "client_block")
+            if position > 0 and any(c.isdigit() for c in block[position - 1]):
+                candidates.offer("client_address", block[position - 1].strip(), 0.75, "client_block")
+            break
+    block_text = "\n".join(block)
+    email = _EMAIL.search(block_text)
+    if email:
+        candidates.offer("client_email", email.group(0), 0.85, "client_block")
+    phone = _PHONE.search(block_text)
+    if phone:
+        candidates.offer("client_phone", phone.group(0), 0.85, "client_block")
+
+
+def _label_amount(rest: str, next_line: str) -> Optional[float]:
+    """
+    Premier montant après l'étiquette d'un total, avant toute mention de TVA, de
+    HT ou de taux ("Total TTC 1 250,00 € dont TVA 208,33 €" -> 1250.0) ; sur la
+    ligne suivante si l'étiquette est seule sur sa ligne
+    """
+    if not _AMOUNT.search(rest):
+        rest = next_line
+    stop = _AMOUNT_STOP.search(rest)
+    first = _AMOUNT.search(rest[:stop.start()] if stop else rest)
+    return parse_amount(first.group(1), first.group(2)) if first else None
+
+
+def _amount(candidates: FieldCandidates, lines: List[str]):
+    # Une ligne lue par une étiquette n'est pas relue par les suivantes, moins précises :
+    # "Total TTC" ne doit pas être conforté par la règle générique "Total"
+    claimed = set()
+    for label, confidence in _AMOUNT_LABELS:
+        values = []
+        for index, line in enumerate(lines):
+            match = label.search(line) if index not in claimed else None
+            if not match:
+                continue
+            claimed.add(index)
+            values.append(_label_amount(line[match.end():], _next_line(lines, index)[1]))
+        values = [value for value in values if value]
+        if not values:
+            continue
+        # Plusieurs totaux différents (sous-totaux par page, ...) : le dernier, avec moins d'assurance
+        penalty = 1.0 if len(set(values)) == 1 else 0.8
+        candidates.offer("amount", values[-1], confidence * penalty, "amount_label")
+
+
+def _due_date(candidates: FieldCandidates, lines: List[str], text: str):
+    for index, line in enumerate(lines):
+        match = _DUE_DATE_LABEL.search(line)
+        if not match:
+            continue
+        dates = parse_dates(line[match.end():])
+        if dates:
+            candidates.offer("due_date", dates[0], 0.92, "due_date_label")
+            return
+        dates = parse_dates(_next_line(lines, index)[1])
+        if dates:
+            candidates.offer("due_date", dates[0], 0.8, "due_date_label_next_line")
+            return
+
+    # Pas d'échéance explicite : date de facture et conditions de paiement
+    invoice_date = None
+    for line in lines:
+        match = _INVOICE_DATE_LABEL.search(line)
+        dates = parse_dates(line[match.end():]) if match else []
+        if dates:
+            invoice_date = dates[0]
+            break
+    if not invoice_date:
+        return
+    terms = _PAYMENT_TERMS.search(text)
+    if terms:
+        due = invoice_date + timedelta(days=int(terms.group(1)))
+        if terms.group(2):
+            due = (due.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        candidates.offer("due_date", due, 0.75, "payment_terms")
+    elif _UPON_RECEIPT.search(text):
+        candidates.offer("due_date", invoice_date, 0.75, "payment_upon_receipt")
+
+
+def _identifiers(candidates: FieldCandidates, text: str, block: List[str], exclude_sirens: set):
+    """IBAN, TVA et SIREN (les chiffres des IBAN et numéros de TVA ne sont pas relus comme SIREN)"""
+    block_text = "\n".join(block)
+    stripped = text
+    for match in _IBAN.finditer(text):
+        if iban_valid(match.group(0)):
+            candidates.offer("iban", match.group(0).replace(" ", ""), 0.95, "iban_checksum")
+            stripped = stripped.replace(match.group(0), " ")
+
+    vat_numbers = []
+    for match in _VAT.finditer(stripped):
+        siren = vat_siren(match.group(1), "".join(match.group(2, 3, 4)))
+        if siren and siren not in exclude_sirens:
+            vat_numbers.append((match.group(0).replace(" ", ""), siren))
+    for vat, siren in vat_numbers:
+        in_block = vat in block_text.replace(" ", "")
+        if in_block or len({s for _, s in vat_numbers}) == 1:
+            candidates.offer("client_vat_number", vat, 0.92 if in_block else 0.8, "vat_checksum")
+            candidates.offer("client_siren", siren, 0.92 if in_block else 0.8, "vat_checksum")
+    stripped = _VAT.sub(" ", stripped)
+
+    sirens = [siren for siren in siren_candidates(stripped) if siren not in exclude_sirens]
+    block_sirens = set(siren_candidates(block_text))
+    for siren in sirens:
+        if siren in block_sirens:
+            candidates.offer("client_siren", siren, 0.9, "siren_luhn_client_block")
+        elif len(sirens) == 1 and exclude_sirens:
+            # Le SIREN de l'émetteur est connu et exclu : le seul restant est celui du client
+            candidates.offer("client_siren", siren, 0.8, "siren_luhn")
+        else:
+            candidates.offer("client_siren", siren, 0.5, "siren_luhn")
+
+
+def extract_candidates(text: str, exclude_sirens: Iterable[str] = ()) -> FieldCandidates:
+    """
+    Candidats de chaque champ trouvés par les règles
+
+    Args:
+        text: texte OCR (normalisé) de la facture
+        exclude_sirens: SIREN à ignorer, celui de l'émetteur en général
+    """
+    started = time.perf_counter()
+    candidates = FieldCandidates()
+    lines = (text or "").splitlines()
+    exclude = {siren for siren in exclude_sirens if siren}
+
+    _invoice_number(candidates, lines)
+    block = _client_block(candidates, lines)
+    _client_details(candidates, block)
+    _identifiers(candidates, text or "", block, exclude)
+    _amount(candidates, lines)
+    _due_date(candidates, lines, text or "")
+
+    candidates.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+    return candidates
+
+
+def record(candidates: FieldCandidates, llm_ms: Optional[float] = None):
+    """Compte un document : LLM évité (llm_ms None) ou durée de l'appel LLM"""
+    _metrics["documents"] += 1
+    _metrics["rules_ms"] += candidates.elapsed_ms
+    if llm_ms is None:
+        _metrics["llm_skipped"] += 1
+    else:
+        _metrics["llm_calls"] += 1
+        _metrics["llm_ms"] += llm_ms
+
+
+def get_metrics() -> dict:
+    """Taux d'extractions sans LLM et latence économisée (estimée avec la durée moyenne d'un appel)"""
+    documents = _metrics["documents"]
+    avg_llm_ms = _metrics["llm_ms"] / _metrics["llm_calls"] if _metrics["llm_calls"] else None
+    return {
+        "enabled": FIELD_RULES_ENABLED,
+        "min_confidence": FIELD_RULES_MIN_CONFIDENCE,
+        "documents": documents,
+        "llm_skipped": _metrics["llm_skipped"],
+        "llm_calls": _metrics["llm_calls"],
+        "skip_rate": round(_metrics["llm_skipped"] / documents, 3) if documents else None,
+        "avg_rules_ms": round(_metrics["rules_ms"] / documents, 3) if documents else None,
+        "avg_llm_ms": round(avg_llm_ms, 1) if avg_llm_ms is not None else None,
+        "estimated_ms_saved": round(_metrics["llm_skipped"] * avg_llm_ms - _metrics["rules_ms"], 1)
+        if avg_llm_ms is not None else None,
+    }
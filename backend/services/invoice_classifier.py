@@ -0,0 +1,133 @@
+"""
+Reconnaissance locale des factures, avant le LLM.
+
+Une facture se reconnaît à ses mots-clés ("Facture", "Total TTC", "TVA",
+"SIRET", "Échéance", ...) ; les devis, bons de commande, bulletins de paie ou
+relevés bancaires en partagent certains mais ont aussi les leurs. Chaque signal
+a un poids, la somme donne un score :
+- score >= INVOICE_CLASSIFIER_ACCEPT, sans signal de document voisin : facture ;
+- score <= INVOICE_CLASSIFIER_REJECT : pas une facture, sauf si le texte a à la
+  fois des signaux de facture et de document voisin ("suite à votre devis") ;
+- entre les deux, le document est ambigu et le LLM tranche.
+
+Les seuils se règlent avec `python -m benchmarks.invoice_classifier`.
+"""
+import logging
+import os
+import re
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from typing import List, Optional
+from services.field_extraction import siren_candidates
+
+logger = logging.getLogger(__name__)
+
+INVOICE_CLASSIFIER_ENABLED = os.getenv("INVOICE_CLASSIFIER_ENABLED", "true").lower() in ("1", "true", "yes")
+INVOICE_CLASSIFIER_ACCEPT = float(os.getenv("INVOICE_CLASSIFIER_ACCEPT", "6"))
+INVOICE_CLASSIFIER_REJECT = float(os.getenv("INVOICE_CLASSIFIER_REJECT", "1.5"))
+# En dessous, l'OCR n'a probablement rien lu d'exploitable : on laisse le LLM juger
+MIN_WORDS = 15
+
+# (nom, motif sur le texte en minuscules sans accents, poids) ; chaque signal ne compte qu'une fois
+SIGNALS = [
+    ("facture", r"\b(facture|invoice)\b", 3.0),
+    # "n°" devient "n" sans accents
+    ("invoice_number", r"\b(facture|invoice)\s*(no?\b|num|#)|\bno?\s*(de\s+)?facture\b", 2.0),
+    ("total_ttc", r"\b(total|montant)\s*t\.?t\.?c\b|\bnet a payer\b|\btotal a payer\b|\bamount due\b", 2.5),
+    ("total_ht", r"\b(total|montant)\s*h\.?t\b", 1.0),
+    ("tva", r"\b(tva|vat)\b", 1.0),
+    ("legal_ids", r"\b(siret|siren|rcs)\b", 1.0),
+    ("due_date", r"\b(echeance|date limite de (paiement|reglement)|due date|payable (le|avant|a))\b", 1.5),
+    ("late_penalties", r"\b(penalites? de retard|indemnite forfaitaire)\b", 1.0),
+    ("bank_details", r"\b(iban|bic|rib)\b", 1.0),
+    ("currency_amount", r"\d[\d .]*[,.]\d{2}\s*eur", 1.0),
+    # Documents proches d'une facture, mais qui n'en sont pas
+    ("quote", r"\b(devis|quotation|offre de prix|bon pour accord)\b", -4.0),
+    ("purchase_order", r"\bbon de (commande|livraison)\b", -3.0),
+    ("proforma", r"\bpro[ -]?forma\b", -3.0),
+    ("payslip", r"\b(bulletin de (paie|salaire)|salaire brut|net a payer avant impot)\b", -6.0),
+    ("bank_statement", r"\breleve (de compte|bancaire|d'identite bancaire)\b", -4.0),
+    ("certificate", r"\battestation\b", -2.0),
+    ("contract", r"\b(contrat|conditions particulieres)\b", -1.0),
+    ("resume", r"\b(curriculum vitae|experiences? professionnelles?)\b", -4.0),
+]
+_COMPILED = [(name, re.compile(pattern), weight) for name, pattern, weight in SIGNALS]
+_LOOKALIKES = {name for name, _, weight in SIGNALS if weight < 0}
+# Un SIREN valide vaut une mention "SIRET" : les deux ne se cumulent pas
+SIREN_WEIGHT = 1.0
+
+_metrics = {
+    "documents": 0,
+    "accepted": 0,
+    "rejected": 0,
+    "ambiguous": 0,
+    "classify_ms": 0.0,
+}
+
+
+@dataclass
+class Classification:
+    is_invoice: Optional[bool]
+    score: float
+    signals: List[str] = field(default_factory=list)
+
+    @property
+    def ambiguous(self) -> bool:
+        return self.is_invoice is None
+
+
+def _normalize(text: str) -> str:
+    text = (text or "").replace("€", " eur")
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+
+
+def score_text(text: str) -> Classification:
+    """Score et signaux d'un texte, sans décision"""
+    normalized = _normalize(text)
+    signals = [name for name, pattern, _ in _COMPILED if pattern.search(normalized)]
+    total = sum(weight for name, _, weight in _COMPILED if name in signals)
+    if "legal_ids" not in signals and siren_candidates(text):
+        signals.append("valid_siren")
+        total += SIREN_WEIGHT
+    return Classification(None, round(total, 2), signals)
+
+
+def classify(text: str, accept: float = None, reject: float = None) -> Classification:
+    """
+    Facture (True), pas une facture (False) ou ambigu (None, à confier au LLM)
+    """
+    started = time.perf_counter()
+    accept = INVOICE_CLASSIFIER_ACCEPT if accept is None else accept
+    reject = INVOICE_CLASSIFIER_REJECT if reject is None else reject
+    result = score_text(text)
+    if len((text or "").split()) >= MIN_WORDS:
+        # Un devis reprend tous les signaux d'une facture : jamais accepté sans le LLM ;
+        # et une facture qui cite un devis n'est pas rejetée sans lui
+        lookalike = not _LOOKALIKES.isdisjoint(result.signals)
+        positive = any(signal not in _LOOKALIKES for signal in result.signals)
+        if result.score >= accept and not lookalike:
+            result.is_invoice = True
+        elif result.score <= reject and not (lookalike and positive):
+            result.is_invoice = False
+
+    _metrics["documents"] += 1
+    _metrics["classify_ms"] += (time.perf_counter() - started) * 1000
+    _metrics["ambiguous" if result.ambiguous else "accepted" if result.is_invoice else "rejected"] += 1
+    return result
+
+
+def get_metrics() -> dict:
+    """Décisions locales et part des documents laissés au LLM"""
+    documents = _metrics["documents"]
+    return {
+        "enabled": INVOICE_CLASSIFIER_ENABLED,
+        "accept_threshold": INVOICE_CLASSIFIER_ACCEPT,
+        "reject_threshold": INVOICE_CLASSIFIER_REJECT,
+        "documents": documents,
+        "accepted": _metrics["accepted"],
+        "rejected": _metrics["rejected"],
+        "ambiguous": _metrics["ambiguous"],
+        "llm_rate": round(_metrics["ambiguous"] / documents, 3) if documents else None,
+        "avg_classify_us": round(_metrics["classify_ms"] * 1000 / documents, 1) if documents else None,
+    }
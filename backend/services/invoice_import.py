@@ -0,0 +1,189 @@
+"""
+Import en masse de factures depuis un fichier CSV ou NDJSON.
+
+Le fichier est lu ligne à ligne, chaque ligne est validée avec `InvoiceCreate`
+et les lignes valides sont insérées par lots (un INSERT multi-lignes par lot).
+Les scores sont calculés ensuite, en tâche de fond, et écrits par lots.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import UploadFile, HTTPException
+from pydantic import ValidationError
+from models.invoice import InvoiceCreate, InvoiceInDB
+from database.db import create_invoices_bulk
+from database.unit_of_work import InvoiceUnitOfWork
+from services.scoring_service import calculate_scores_batch
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "5000"))
+
+def detect_format(file: UploadFile, format: Optional[str] = None) -> Optional[str]:
+    if format:
+        return format
+    filename = (file.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or file.content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    if filename.endswith(".csv") or file.content_type in ("text/csv", "application/csv"):
+        return "csv"
+    return None
+
+def _clean_csv_row(row: dict) -> dict:
+    """Les cellules vides valent None ; line_items peut contenir du JSON"""
+    cleaned = {
+        key.strip(): (value.strip() if value.strip() else None)
+        for key, value in row.items()
+        if key and isinstance(value, str)
+    }
+    if cleaned.get("line_items"):
+        cleaned["line_items"] = json.loads(cleaned["line_items"])
+    return {key: value for key, value in cleaned.items() if value is not None}
+
+async def iter_rows(file: UploadFile, format: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Itère sur les lignes du fichier sans le charger en mémoire
+
+    Yields:
+        (numéro de ligne, données, erreur de lecture)
+    """
+    await file.seek(0)
+    text = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        if format == "csv":
+            for number, row in enumerate(csv.DictReader(text), start=1):
+                try:
+                    yield number, _clean_csv_row(row), None
+                except json.JSONDecodeError:
+                    yield number, None, "line_items: invalid JSON"
+                if number % IMPORT_BATCH_SIZE == 0:
+                    await asyncio.sleep(0)
+        else:
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield number, None, f"Invalid JSON: {e.msg}"
+                    continue
+                if isinstance(row, dict):
+                    yield number, row, None
+                else:
+                    yield number, None, "Each line must be a JSON object"
+                if number % IMPORT_BATCH_SIZE == 0:
+                    await asyncio.sleep(0)
+    finally:
+        # Ne pas fermer le fichier de l'UploadFile avec le wrapper
+        text.detach()
+
+def _format_errors(error: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(part) for part in item['loc']) or 'row'}: {item['msg']}"
+        for item in error.errors()
+    ]
+
+async def import_invoices(file: UploadFile, format: str, user_id: str) -> Tuple[dict, List[dict]]:
+    """
+    Valide et insère les factures du fichier
+
+    Returns:
+        Le rapport d'import (voir InvoiceImportResponse) et les factures insérées,
+        à scorer en tâche de fond
+    """
+    imported: List[dict] = []
+    errors: List[dict] = []
+    batch: List[Tuple[int, dict]] = []
+    now = datetime.now()
+
+    async def flush():
+        rows = [invoice for _, invoice in batch]
+        try:
+            await create_invoices_bulk(rows)
+            imported.extend(rows)
+        except Exception as e:
+            # L'insertion multi-lignes est atomique : on réessaie ligne par ligne pour
+            # importer les bonnes et nommer les fautives dans le rapport
+            logger.warning(f"Import batch of {len(rows)} invoices failed, retrying row by row: {str(e)}")
+            for number, invoice in batch:
+                try:
+                    await create_invoices_bulk([invoice])
+                    imported.append(invoice)
+                except Exception as e:
+                    detail = getattr(e, "detail", None) or str(e)
+                    errors.append({"row": number, "errors": [f"Database error, row not imported: {detail}"]})
+        batch.clear()
+
+    rows = iter_rows(file, format)
+    try:
+        async for number, row, read_error in rows:
+            if number > IMPORT_MAX_ROWS:
+                errors.append({"row": number, "errors": [f"Import limited to {IMPORT_MAX_ROWS} rows"]})
+                break
+            if read_error:
+                errors.append({"row": number, "errors": [read_error]})
+                continue
+            try:
+                invoice = InvoiceCreate.model_validate(row)
+            except ValidationError as e:
+                errors.append({"row": number, "errors": _format_errors(e)})
+                continue
+
+            batch.append((number, InvoiceInDB(**{
+                **invoice.model_dump(),
+                "user_id": user_id,
+                # Date d'émission d'origine si elle est dans le fichier
+                "created_date": invoice.created_date or now
+            }).model_dump(mode="json")))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The file must be UTF-8 encoded")
+    finally:
+        await rows.aclose()
+    if batch:
+        await flush()
+
+    logger.info(f"Import for user {user_id}: {len(imported)} invoices imported, {len(errors)} rows rejected")
+    report = {
+        "imported": len(imported),
+        "failed": len(errors),
+        "invoice_ids": [invoice["id"] for invoice in imported],
+        "errors": errors,
+        "scoring": "queued" if imported else "skipped",
+    }
+    return report, imported
+
+async def score_imported_invoices(invoices: List[dict], user_id: str, user_siren: Optional[str] = None):
+    """
+    Calcule les scores des factures importées, un passage du modèle par lot, et
+    les écrit par lots via l'unité de travail avec leur empreinte (le re-scoring
+    ne les recalcule pas tant qu'elle ne change pas)
+    """
+    uow = InvoiceUnitOfWork(owner_id=user_id)
+    for start in range(0, len(invoices), IMPORT_BATCH_SIZE):
+        batch = invoices[start:start + IMPORT_BATCH_SIZE]
+        # Même choix de SIREN qu'au scoring : celui de l'utilisateur, sinon celui du client
+        sirens = [user_siren or invoice.get('client_siren') for invoice in batch]
+        try:
+            results = await calculate_scores_batch(batch, sirens)
+        except Exception as e:
+            logger.error(f"Scoring of {len(batch)} imported invoices failed: {str(e)}")
+            continue
+        scored_at = datetime.now(timezone.utc).isoformat()
+        for invoice, result in zip(batch, results):
+            uow.update(
+                invoice["id"],
+                score=result["score"],
+                possible_financing=result["possible_financing"],
+                score_fingerprint=result["score_fingerprint"],
+                scored_at=scored_at,
+            )
+        await uow.flush()
+    logger.info(f"Scored {len(invoices)} imported invoices for user {user_id}")
@@ -0,0 +1,267 @@
+"""
+Passerelle unique vers l'API OpenAI.
+
+Tous les appels LLM de l'application passent par `chat_completion` qui :
+- réutilise un seul client `AsyncOpenAI` (pool de connexions httpx partagé) ;
+- limite le nombre d'appels simultanés avec un sémaphore ;
+- respecte les quotas RPM/TPM grâce à deux token buckets ;
+- réessaie les erreurs transitoires avec un backoff exponentiel à jitter ;
+- applique une deadline par appel ;
+- collecte des métriques de latence et de consommation de tokens.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+LLM_DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gpt-4o-mini")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_BACKOFF_BASE_SECONDS = 0.5
+LLM_BACKOFF_MAX_SECONDS = 8.0
+
+
+class LLMError(Exception):
+    """Erreur levée quand un appel LLM échoue définitivement"""
+
+
+class TokenBucket:
+    """
+    Token bucket asynchrone : `capacity` jetons maximum, rechargés en continu
+    à raison de `refill_per_second`.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        # Une demande plus grosse que le bucket ne doit pas bloquer indéfiniment
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.refill_per_second)
+
+    def debit(self, amount: float):
+        """Ajuste le bucket après coup (consommation réelle supérieure à l'estimation)"""
+        self._refill()
+        self.tokens -= amount
+
+
+_client = None
+_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_request_bucket = TokenBucket(LLM_RPM_LIMIT, LLM_RPM_LIMIT / 60)
+_token_bucket = TokenBucket(LLM_TPM_LIMIT, LLM_TPM_LIMIT / 60)
+_encoding = None
+
+_metrics = {
+    "calls": 0,
+    "errors": 0,
+    "retries": 0,
+    "timeouts": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "by_purpose": {},
+}
+_latencies_ms = deque(maxlen=1000)
+
+
+def get_client():
+    """Client AsyncOpenAI partagé, créé à la première utilisation"""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+        # Les retries sont gérés ici pour rester cohérents avec le rate limiting
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _client
+
+
+def count_tokens(text: str) -> int:
+    """
+    Compte les tokens d'un texte avec tiktoken si disponible,
+    sinon estimation à ~4 caractères par token
+    """
+    global _encoding
+    if not text:
+        return 0
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    # Respecter le Retry-After envoyé par OpenAI sur les 429
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    # Backoff exponentiel "full jitter"
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _record(purpose: str, latency_ms: float, prompt_tokens: int, completion_tokens: int, error: bool = False):
+    _latencies_ms.append(latency_ms)
+    _metrics["calls"] += 1
+    _metrics["prompt_tokens"] += prompt_tokens
+    _metrics["completion_tokens"] += completion_tokens
+    if error:
+        _metrics["errors"] += 1
+    stats = _metrics["by_purpose"].setdefault(purpose, {
+        "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_latency_ms": 0.0
+    })
+    stats["calls"] += 1
+    stats["prompt_tokens"] += prompt_tokens
+    stats["completion_tokens"] += completion_tokens
+    stats["total_latency_ms"] += latency_ms
+    if error:
+        stats["errors"] += 1
+
+
+async def _call_with_retries(params: dict, estimated_tokens: int, purpose: str):
+    client = get_client()
+    attempt = 0
+    while True:
+        await _request_bucket.acquire(1)
+        await _token_bucket.acquire(estimated_tokens)
+        started = time.perf_counter()
+        try:
+            async with _semaphore:
+                response = await client.chat.completions.create(**params)
+        except Exception as e:
+            latency_ms = (time.perf_counter() - started) * 1000
+            if attempt < LLM_MAX_RETRIES and _is_retryable(e):
+                attempt += 1
+                _metrics["retries"] += 1
+                delay = _retry_delay(e, attempt)
+                logger.warning(f"LLM call '{purpose}' failed ({e}), retry {attempt}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            _record(purpose, latency_ms, 0, 0, error=True)
+            raise LLMError(f"LLM call '{purpose}' failed: {e}") from e
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        # Corriger le bucket TPM avec la consommation réelle
+        actual = prompt_tokens + completion_tokens
+        if actual > estimated_tokens:
+            _token_bucket.debit(actual - estimated_tokens)
+        _record(purpose, latency_ms, prompt_tokens, completion_tokens)
+        logger.debug(f"LLM call '{purpose}' took {latency_ms:.0f}ms ({prompt_tokens}+{completion_tokens} tokens)")
+        return response
+
+
+async def chat_completion(
+    messages: list,
+    model: Optional[str] = None,
+    temperature: float = 0,
+    response_format: Optional[dict] = None,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+    purpose: str = "default",
+) -> str:
+    """
+    Envoie une conversation au LLM et retourne le contenu texte de la réponse
+
+    Args:
+        messages: Messages au format OpenAI ({"role": ..., "content": ...})
+        model: Modèle à utiliser (LLM_DEFAULT_MODEL par défaut)
+        temperature: Température d'échantillonnage
+        response_format: Format de réponse OpenAI (ex: {"type": "json_object"})
+        max_tokens: Nombre maximum de tokens générés
+        timeout: Deadline de l'appel en secondes, attente et retries compris
+        purpose: Libellé de l'appelant, utilisé pour les métriques
+
+    Returns:
+        Le contenu de la réponse (chaîne vide si le modèle n'a rien renvoyé)
+
+    Raises:
+        LLMError: si l'appel échoue ou dépasse sa deadline
+    """
+    params = {
+        "model": model or LLM_DEFAULT_MODEL,
+        "messages": messages,
+        "temperature": temperature,
+    }
+    if response_format:
+        params["response_format"] = response_format
+    if max_tokens:
+        params["max_tokens"] = max_tokens
+
+    estimated_tokens = sum(count_tokens(m.get("content") or "") for m in messages) + (max_tokens or 256)
+    deadline = timeout or LLM_TIMEOUT_SECONDS
+
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(
+            _call_with_retries(params, estimated_tokens, purpose),
+            timeout=deadline
+        )
+    except asyncio.TimeoutError as e:
+        _metrics["timeouts"] += 1
+        _record(purpose, (time.perf_counter() - started) * 1000, 0, 0, error=True)
+        raise LLMError(f"LLM call '{purpose}' exceeded its {deadline}s deadline") from e
+
+    return response.choices[0].message.content or ""
+
+
+def get_metrics() -> dict:
+    """Retourne un instantané des métriques de la passerelle LLM"""
+    latencies = sorted(_latencies_ms)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+    return {
+        **{k: v for k, v in _metrics.items() if k != "by_purpose"},
+        "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)},
+        "in_flight": LLM_MAX_CONCURRENCY - _semaphore._value,
+        "by_purpose": {
+            purpose: {
+                **stats,
+                "avg_latency_ms": round(stats["total_latency_ms"] / stats["calls"], 1) if stats["calls"] else None,
+            }
+            for purpose, stats in _metrics["by_purpose"].items()
+        },
+    }
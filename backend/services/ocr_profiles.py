@@ -0,0 +1,119 @@
+"""
+Profils du moteur OCR (Tesseract) et prétraitement des images.
+
+Un profil regroupe la langue, les modes `--psm`/`--oem`, la résolution de rendu
+du PDF et les étapes de prétraitement (niveaux de gris, binarisation, redressement).
+Le profil par défaut est configurable via OCR_PROFILE ; un profil plus coûteux peut
+être demandé au cas par cas pour les documents difficiles.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class OCRProfile:
+    name: str
+    lang: str = "fra"
+    psm: int = 6
+    oem: int = 1
+    dpi: int = 200
+    grayscale: bool = True
+    binarize: bool = False
+    deskew: bool = False
+
+    @property
+    def tesseract_config(self) -> str:
+        return f"--psm {self.psm} --oem {self.oem}"
+
+
+PROFILES = {
+    # Rendu basse résolution en niveaux de gris, modèle LSTM français seul
+    "fast": OCRProfile(name="fast", lang="fra", psm=6, oem=1, dpi=150),
+    # Segmentation automatique et binarisation, pour les scans moyens
+    "balanced": OCRProfile(name="balanced", lang="fra+eng", psm=3, oem=1, dpi=200, binarize=True),
+    # Scans de mauvaise qualité : haute résolution et redressement
+    "accurate": OCRProfile(name="accurate", lang="fra+eng", psm=3, oem=1, dpi=300, binarize=True, deskew=True),
+    # Comportement historique (modèle anglais, paramètres par défaut, couleur)
+    "legacy": OCRProfile(name="legacy", lang="eng", psm=3, oem=3, dpi=200, grayscale=False),
+}
+
+# Choisi avec `python -m benchmarks.ocr_profiles` : coût CPU minimal par page
+# à précision égale ou supérieure au profil historique
+DEFAULT_OCR_PROFILE = os.getenv("OCR_PROFILE", "fast")
+
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+
+
+def get_profile(name: Optional[str] = None) -> OCRProfile:
+    """
+    Retourne le profil demandé, ou le profil par défaut
+
+    Raises:
+        ValueError: si le profil n'existe pas
+    """
+    profile = PROFILES.get(name or DEFAULT_OCR_PROFILE)
+    if profile is None:
+        raise ValueError(f"Unknown OCR profile '{name}'. Available profiles: {', '.join(PROFILES)}")
+    return profile
+
+
+def _otsu_threshold(image) -> int:
+    """Seuil d'Otsu calculé sur l'histogramme d'une image en niveaux de gris"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold, best_variance = 127, 0.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def _skew_angle(image) -> float:
+    """
+    Estime l'inclinaison du texte par profil de projection : l'angle qui maximise
+    la variance des sommes de lignes correspond à des lignes de texte horizontales
+    """
+    import numpy as np
+
+    small = image.copy()
+    small.thumbnail((800, 800))
+    best_angle, best_score = 0.0, -1.0
+    angle = -DESKEW_MAX_ANGLE
+    while angle <= DESKEW_MAX_ANGLE:
+        rotated = np.asarray(small.rotate(angle, fillcolor=255), dtype=np.float32)
+        # Pixels sombres = texte
+        row_sums = (rotated < 128).sum(axis=1)
+        score = float(np.var(row_sums))
+        if score > best_score:
+            best_angle, best_score = angle, score
+        angle += DESKEW_STEP
+    return best_angle
+
+
+def preprocess_image(image, profile: OCRProfile):
+    """Applique le prétraitement du profil à une page rendue par pdf2image"""
+    if profile.grayscale or profile.binarize or profile.deskew:
+        image = image.convert("L")
+    if profile.binarize:
+        threshold = _otsu_threshold(image)
+        image = image.point(lambda p: 255 if p > threshold else 0)
+    if profile.deskew:
+        angle = _skew_angle(image)
+        if angle:
+            image = image.rotate(angle, expand=True, fillcolor=255)
+    return image
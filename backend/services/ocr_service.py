@@ -1,103 +1,600 @@
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
-import io
-from datetime import datetime
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from pydantic import BaseModel, Field
+from datetime import datetime, timedelta, timezone
+import asyncio
 import os
+import time
 import logging
-from typing import Optional
+from typing import Optional, List, Dict, Callable, Tuple
 import json
-from openai import OpenAI
+import uuid
 from models.ocr import OCRResult
-from database.db import update_invoice
+from database.db import create_invoices_bulk, find_user_by_id, get_invoice_by_id, set_blob_reference, set_blob_references_bulk
+from database.unit_of_work import InvoiceUnitOfWork
+from services.llm_gateway import chat_completion, LLMError
+from services.text_preparation import normalize_page, prepare_invoice_text
+from services.ocr_profiles import OCRProfile, get_profile, preprocess_image
+from services.blob_store import get_blob_store
+from services import events
+from services.events import publish_invoice_event
+from services.entity_resolution import resolve_client_siren
+from services.duplicates import find_duplicate
+from services import document_split, field_extraction, invoice_classifier
+from services.field_extraction import REQUIRED_FIELDS, extract_candidates, siren_candidates
+from services.pipeline import PipelineAbort, PipelineRun, Stage, run_pipeline
+from services.risk_model import build_features, get_model
+from services.scoring_service import fingerprint, get_siren_data_many
 
 # Configurer le logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Récupérer les variables d'environnement
-openai_api_key = os.getenv("OPENAI_API_KEY")
+# OCR progressif : première et dernière page d'abord, le reste seulement si nécessaire
+OCR_PROGRESSIVE = os.getenv("OCR_PROGRESSIVE", "true").lower() in ("1", "true", "yes")
+OCR_PROGRESSIVE_MIN_PAGES = int(os.getenv("OCR_PROGRESSIVE_MIN_PAGES", "3"))
+# Nombre de documents OCRisés en même temps, tous uploads confondus (unitaires et par lot)
+OCR_MAX_CONCURRENT_JOBS = int(os.getenv("OCR_MAX_CONCURRENT_JOBS", "4"))
 
-async def process_invoice_async(invoice_id: str, file_content: bytes):
+_job_slots = asyncio.Semaphore(OCR_MAX_CONCURRENT_JOBS)
+# Un PDF découpé n'occupe qu'un emplacement : ses factures se partagent ceux-ci
+_segment_slots = asyncio.Semaphore(document_split.OCR_SPLIT_CONCURRENCY)
+
+# Au-delà, les numéros trouvés dans le texte sont probablement autre chose (références, IBAN)
+MAX_PREFETCHED_SIRENS = 4
+
+_page_metrics = {
+    "documents": 0,
+    "pages_total": 0,
+    "pages_ocr": 0,
+    "pages_skipped": 0,
+    "full_fallbacks": 0,
+}
+
+def _render_page_range(file_content: bytes, first_page: int, last_page: int, profile: OCRProfile) -> list:
+    """
+    Rend les pages [first_page, last_page] (numérotées à partir de 1) en images.
+    Fonction bloquante, à exécuter dans un thread.
+    """
+    # Imports lourds chargés à la première utilisation pour ne pas ralentir le démarrage de l'API
+    from pdf2image import convert_from_bytes
+
+    return convert_from_bytes(
+        file_content,
+        dpi=profile.dpi,
+        grayscale=profile.grayscale,
+        first_page=first_page,
+        last_page=last_page
+    )
+
+def _ocr_image(image, profile: OCRProfile) -> str:
+    """OCR d'une page rendue. Fonction bloquante, à exécuter dans un thread."""
+    import pytesseract
+
+    return pytesseract.image_to_string(
+        preprocess_image(image, profile),
+        lang=profile.lang,
+        config=profile.tesseract_config
+    )
+
+def _count_pages(file_content: bytes) -> int:
+    from pdf2image import pdfinfo_from_bytes
+    return int(pdfinfo_from_bytes(file_content)["Pages"])
+
+def _page_ranges(page_numbers: List[int], max_pages: Optional[int] = None) -> List[List[int]]:
+    """Pages consécutives regroupées en intervalles [première, dernière] d'au plus `max_pages` pages"""
+    ranges = []
+    for number in sorted(page_numbers):
+        if ranges and ranges[-1][1] == number - 1 and (not max_pages or number - ranges[-1][0] < max_pages):
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
+async def _ocr_pages(file_content: bytes, page_numbers: List[int], profile: OCRProfile,
+                     on_page: Optional[Callable[[int, str], None]] = None) -> Dict[int, str]:
+    """
+    OCRise les pages demandées en regroupant les pages consécutives en un seul rendu.
+    `on_page` est appelé avec le numéro et le texte de chaque page terminée.
+    """
+    texts = {}
+    for first, last in _page_ranges(page_numbers):
+        images = await asyncio.to_thread(_render_page_range, file_content, first, last, profile)
+        for number, image in zip(range(first, last + 1), images):
+            texts[number] = await asyncio.to_thread(_ocr_image, image, profile)
+            if on_page:
+                on_page(number, texts[number])
+    _page_metrics["pages_ocr"] += len(page_numbers)
+    return texts
+
+def _first_pass_pages(page_numbers: List[int]) -> List[int]:
+    """Pages OCRisées avant la première tentative d'extraction"""
+    if not OCR_PROGRESSIVE or len(page_numbers) < OCR_PROGRESSIVE_MIN_PAGES:
+        return list(page_numbers)
+    return [page_numbers[0], page_numbers[-1]]
+
+def _ocr_page_edges(file_content: bytes, page_numbers: List[int], profile: OCRProfile) -> Dict[int, str]:
+    """
+    OCR des bords (haut et bas) des pages demandées en basse résolution, pour le
+    découpage des documents ; les pages sont rendues par paquets de
+    EDGE_CHUNK_PAGES. Fonction bloquante, à exécuter dans un thread.
+    """
+    from pdf2image import convert_from_bytes
+    import pytesseract
+
+    edges = {}
+    for first, last in _page_ranges(page_numbers, document_split.EDGE_CHUNK_PAGES):
+        images = convert_from_bytes(file_content, dpi=document_split.EDGE_DPI, grayscale=True,
+                                    first_page=first, last_page=last)
+        for number, image in zip(range(first, last + 1), images):
+            edges[number] = "\n".join(
+                pytesseract.image_to_string(band, lang=profile.lang, config="--psm 6")
+                for band in document_split.crop_edges(image)
+            )
+    return edges
+
+async def _split_document(file_content: bytes, page_count: int, profile: OCRProfile) -> Tuple[List[List[int]], bool]:
+    """
+    Factures contenues dans le document (listes de pages) : les bords de toutes
+    les pages ne sont lus que si ceux de la première et de la dernière l'annoncent
+
+    Returns:
+        Les morceaux et un booléen indiquant si toutes les pages ont été examinées
+    """
+    edges = await asyncio.to_thread(_ocr_page_edges, file_content, [1, page_count], profile)
+    if not document_split.should_examine(edges.get(1, ""), edges.get(page_count, ""), page_count):
+        return [list(range(1, page_count + 1))], False
+    if page_count > 2:
+        edges.update(await asyncio.to_thread(_ocr_page_edges, file_content, list(range(2, page_count)), profile))
+    return document_split.split_pages([edges.get(number, "") for number in range(1, page_count + 1)]), True
+
+async def process_invoice_async(invoice_id: str, file_content: bytes, ocr_profile: Optional[str] = None,
+                                uow: Optional[InvoiceUnitOfWork] = None):
     """
     Process invoice OCR asynchronously and update the database
+
+    Les documents attendent un emplacement libre (OCR_MAX_CONCURRENT_JOBS) avant
+    d'être traités, pour que les lots ne saturent pas les CPU.
+    """
+    async with _job_slots:
+        await _process_invoice(invoice_id, file_content, ocr_profile, uow)
+
+class _SirenPrefetch:
+    """
+    Recherches SIREN lancées dès qu'un numéro est connu (texte OCR, profil de
+    l'utilisateur), partagées par les étapes qui en ont besoin
     """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, siren: str):
+        if siren not in self._tasks and len(self._tasks) < MAX_PREFETCHED_SIRENS:
+            self._tasks[siren] = asyncio.create_task(get_siren_data_many([siren]))
+
+    async def get(self, siren: str) -> Optional[dict]:
+        task = self._tasks.get(siren)
+        data = await task if task else await get_siren_data_many([siren])
+        return data.get(siren)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+class _PageProgress:
+    """Événements de progression de l'OCR d'un document, tous morceaux confondus"""
+
+    def __init__(self, invoice_id: str, pages_total: int):
+        self.invoice_id = invoice_id
+        self.pages_total = pages_total
+        self.pages_done = 0
+
+    def page_done(self, number: int):
+        self.pages_done += 1
+        publish_invoice_event(self.invoice_id, events.OCR_PAGE, {
+            "page": number,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total
+        })
+
+async def _process_invoice(invoice_id: str, file_content: bytes, ocr_profile: Optional[str] = None,
+                           uow: Optional[InvoiceUnitOfWork] = None, user_id: Optional[str] = None):
+    """
+    OCR, extraction et scoring d'un document déposé
+
+    Un PDF peut contenir plusieurs factures (voir services.document_split) :
+    chaque morceau est traité comme une facture à part, en parallèle (au plus
+    OCR_SPLIT_CONCURRENCY à la fois, tous documents confondus) ; la première
+    reprend la ligne déposée, les autres sont créées en une seule insertion.
+
+    `ocr_profile` permet de forcer un profil Tesseract (voir services.ocr_profiles)
+    pour les documents difficiles.
+
+    Les modifications déjà enregistrées dans `uow` sont écrites avec le résultat,
+    en une seule requête.
+    """
+    uow = uow or InvoiceUnitOfWork()
     try:
-        # Convertir le PDF en images
-        images = convert_from_bytes(file_content)
-        text = ""
-        for image in images:
-            text += pytesseract.image_to_string(image)
-        
+        profile = get_profile(ocr_profile)
+        page_count = await asyncio.to_thread(_count_pages, file_content)
+        segments, examined = [list(range(1, page_count + 1))], False
+        if document_split.OCR_SPLIT_DOCUMENTS and page_count >= document_split.OCR_SPLIT_MIN_PAGES:
+            segments, examined = await _split_document(file_content, page_count, profile)
+    except Exception as e:
+        logger.error(f"Error processing invoice: {str(e)}")
+        await _mark_failed(invoice_id, str(e), uow)
+        return
+
+    publish_invoice_event(invoice_id, events.OCR_STARTED, {"pages_total": page_count, "invoices": len(segments)})
+    progress = _PageProgress(invoice_id, page_count)
+    if len(segments) > 1:
+        await _process_segments(invoice_id, file_content, segments, profile, uow, user_id, progress)
+        return
+
+    document_split.record(segments, examined=examined)
+    try:
+        run = await _run_invoice_pipeline(invoice_id, file_content, segments[0], profile, uow, user_id, progress)
+        await uow.flush()
+    except PipelineAbort as e:
+        await _mark_failed(invoice_id, str(e), uow)
+        return
+    except Exception as e:
+        logger.error(f"Error processing invoice: {str(e)}")
+        await _mark_failed(invoice_id, str(e), uow)
+        return
+    _publish_results(invoice_id, run)
+
+async def _process_segments(invoice_id: str, file_content: bytes, segments: List[List[int]], profile: OCRProfile,
+                            uow: InvoiceUnitOfWork, user_id: Optional[str], progress: _PageProgress):
+    """
+    Traite en parallèle les factures d'un PDF qui en contient plusieurs
+
+    La première facture extraite met à jour la ligne déposée ; les suivantes sont
+    insérées en une seule requête, avec les mêmes propriétaire, lot et fichier.
+    """
+    logger.info(f"Invoice {invoice_id}: {len(segments)} invoices found in {progress.pages_total} pages: {segments}")
+    ids = [invoice_id] + [str(uuid.uuid4()) for _ in segments[1:]]
+    # Résultats gardés en mémoire jusqu'à la fin de tous les morceaux
+    segment_uows = [InvoiceUnitOfWork() for _ in segments]
+
+    async def run_segment(i: int, pages: List[int]) -> PipelineRun:
+        async with _segment_slots:
+            return await _run_invoice_pipeline(ids[i], file_content, pages, profile, segment_uows[i], user_id, progress)
+
+    outcomes = await asyncio.gather(*(run_segment(i, pages) for i, pages in enumerate(segments)),
+                                    return_exceptions=True)
+
+    completed = [i for i, outcome in enumerate(outcomes) if isinstance(outcome, PipelineRun)]
+    for i, outcome in enumerate(outcomes):
+        if not isinstance(outcome, PipelineRun):
+            logger.error(f"Invoice {invoice_id}: pages {segments[i]} could not be processed: {str(outcome)}")
+    document_split.record(segments, len(completed), examined=True)
+    if not completed:
+        await _mark_failed(invoice_id, str(outcomes[0]), uow)
+        return
+
+    try:
+        original = await get_invoice_by_id(invoice_id) or {}
+        primary, others = completed[0], completed[1:]
+        blob_key = uow.pending(invoice_id).get('original_file_path') or original.get('original_file_path')
+        rows = []
+        for i in others:
+            row = build_pending_invoice(ids[i], original.get('user_id', user_id), language=original.get('language', "fr_FR"),
+                                        blob_key=blob_key, batch_id=original.get('batch_id'))
+            row.update(segment_uows[i].pending(ids[i]), split_from=invoice_id, source_pages=segments[i])
+            rows.append(row)
+        await create_invoices_bulk(rows)
+        if blob_key and rows:
+            await set_blob_references_bulk('invoice', {row['id']: blob_key for row in rows})
+        uow.update(invoice_id, segment_uows[primary].pending(ids[primary]), source_pages=segments[primary])
+        await uow.flush()
+    except Exception as e:
+        logger.error(f"Error saving the invoices split from {invoice_id}: {str(e)}")
+        await _mark_failed(invoice_id, str(e), uow)
+        return
+
+    _publish_results(invoice_id, outcomes[primary], {
+        "split_invoices": [ids[i] for i in others],
+        "segments_failed": len(segments) - len(completed),
+    })
+    for i in others:
+        _publish_results(ids[i], outcomes[i])
+
+def _publish_results(invoice_id: str, run: PipelineRun, extra: Optional[dict] = None):
+    extracted_data = run.results["extraction"]
+    duplicate = run.results["duplicates"]
+    publish_invoice_event(invoice_id, events.EXTRACTION_DONE, {
+        "status": "OCR_COMPLETED",
+        **extracted_data.model_dump(mode="json"),
+        "duplicate_of": duplicate[0] if duplicate else None,
+        **(extra or {})
+    })
+    if run.results["scoring"]:
+        publish_invoice_event(invoice_id, events.SCORED, {
+            "score": run.results["scoring"]["score"],
+            "possible_financing": run.results["scoring"]["possible_financing"],
+            "timings_ms": run.timings,
+        })
+
+async def _run_invoice_pipeline(invoice_id: str, file_content: bytes, page_numbers: List[int], profile: OCRProfile,
+                                uow: InvoiceUnitOfWork, user_id: Optional[str], progress: _PageProgress) -> PipelineRun:
+    """
+    Traitement d'une facture (les pages `page_numbers` du document), en un seul passage :
+
+        ocr ─────────────────────→ extraction → (siren client ∥ doublons) → scoring → écriture
+        profil de l'utilisateur ──↗
+
+    Les étapes indépendantes tournent en parallèle (services.pipeline) ; le
+    résultat (extraction, doublon et score) est enregistré dans `uow`, sans flush.
+
+    Les champs utiles sont presque toujours sur la première ou la dernière page :
+    on commence par celles-ci et on n'OCRise les pages du milieu que si
+    l'extraction échoue (voir OCR_PROGRESSIVE). Les SIREN lus dans chaque page
+    OCRisée sont recherchés tout de suite, sans attendre l'extraction.
+
+    Avec `user_id`, la facture extraite est comparée aux factures de l'utilisateur
+    (services.duplicates) et marquée si c'est un doublon probable ; le score est
+    calculé comme pour un utilisateur authentifié.
+
+    Raises:
+        PipelineAbort: document refusé ou champs requis introuvables
+    """
+    prefetch = _SirenPrefetch()
+    texts: Dict[int, str] = {}
+    first_pass = _first_pass_pages(page_numbers)
+    remaining = [n for n in page_numbers if n not in first_pass]
+
+    def on_page(number, page_text):
+        for siren in siren_candidates(page_text):
+            prefetch.start(siren)
+        progress.page_done(number)
+
+    async def ocr_remaining_pages():
+        nonlocal remaining
+        logger.info(f"Invoice {invoice_id}: OCR of {len(remaining)} remaining page(s)")
+        texts.update(await _ocr_pages(file_content, remaining, profile, on_page))
+        remaining = []
+        _page_metrics["full_fallbacks"] += 1
+        return prepare_invoice_text([texts[n] for n in sorted(texts)]).text
+
+    async def ocr_stage(results) -> str:
+        texts.update(await _ocr_pages(file_content, first_pass, profile, on_page))
+
+        # Nettoyer et réduire le texte avant de l'envoyer au LLM
+        text = prepare_invoice_text([texts[n] for n in sorted(texts)]).text
         logger.debug("Extracted text: %s", text)
 
         # Vérifier si c'est une facture
-        if not await is_invoice(text):
+        invoice_detected = await is_invoice(text)
+        if not invoice_detected and remaining:
+            text = await ocr_remaining_pages()
+            invoice_detected = await is_invoice(text)
+        if not invoice_detected:
             logger.error("Document is not an invoice")
-            await update_invoice(invoice_id, {
-                "status": "OCR_FAILED",
-                "error": "Document is not an invoice"
-            })
-            return
+            _record_pages(len(page_numbers), len(texts))
+            raise PipelineAbort("Document is not an invoice")
+        return text
 
-        # Extraire les informations avec le LLM
-        extracted_data = await extract_invoice_data(text)
+    async def extraction_stage(results):
+        # Le SIREN de l'émetteur n'est pas celui du client
+        own_sirens = [results["user"]] if results["user"] else []
+        extracted_data = await _extract_fields(results["ocr"], texts, own_sirens)
+        if not extracted_data and remaining:
+            # Champs requis manquants : on complète avec les pages du milieu
+            results["ocr"] = await ocr_remaining_pages()
+            extracted_data = await _extract_fields(results["ocr"], texts, own_sirens)
+        _record_pages(len(page_numbers), len(texts))
         if not extracted_data:
             logger.error("Failed to extract invoice data")
-            await update_invoice(invoice_id, {
-                "status": "OCR_FAILED",
-                "error": "Failed to extract invoice data"
-            })
-            return
+            raise PipelineAbort("Failed to extract invoice data")
+        return extracted_data
+
+    async def user_stage(results) -> Optional[str]:
+        # Le SIREN de l'utilisateur sert au scoring : sa recherche démarre tout de suite
+        if not user_id:
+            return None
+        user = await find_user_by_id(user_id)
+        siren = user.get('siren_number') if user else None
+        if siren:
+            prefetch.start(siren)
+        return siren
 
-        # Mettre à jour la facture dans la base de données
-        update_data = {
-            "status": "OCR_COMPLETED",
-            **extracted_data.dict()
+    async def client_siren_stage(results) -> Optional[str]:
+        extracted_data = results["extraction"]
+        # SIREN du client absent de la facture : on le cherche à partir de son nom
+        if not extracted_data.client_siren:
+            extracted_data.client_siren = await resolve_client_siren(extracted_data.client, user_id)
+        if extracted_data.client_siren:
+            prefetch.start(extracted_data.client_siren)
+        return extracted_data.client_siren
+
+    async def duplicate_stage(results):
+        if not user_id:
+            return None
+        signature_columns, duplicate = await find_duplicate(
+            user_id, invoice_id, results["ocr"], results["extraction"].model_dump()
+        )
+        uow.update(invoice_id, signature_columns)
+        if duplicate:
+            uow.update(invoice_id, duplicate_of=duplicate[0], duplicate_similarity=duplicate[1])
+        return duplicate
+
+    async def scoring_stage(results) -> dict:
+        # Même choix de SIREN qu'au scoring à la demande : celui de l'utilisateur, sinon celui du client
+        siren = results["user"] or results["client_siren"]
+        siren_data = {siren: await prefetch.get(siren)} if siren else {}
+        invoice = results["extraction"].model_dump()
+        model = get_model()
+        features = build_features([invoice], [siren], siren_data)
+        score = float(model.predict(features)[0])
+        return {
+            "score": score,
+            "possible_financing": float(invoice.get('amount') or 0) * (1 - score),
+            "score_fingerprint": fingerprint(model.version, features[0].tolist()),
+            "scored_at": datetime.now(timezone.utc).isoformat(),
         }
-        
-        logger.debug(f"Updating invoice {invoice_id} with data: {update_data}")
-        await update_invoice(invoice_id, update_data)
-        logger.info(f"Successfully processed invoice {invoice_id}")
 
+    async def write_stage(results):
+        extracted_data = results["extraction"]
+        # Extraction, doublon et score ensemble : une seule écriture
+        uow.update(invoice_id, extracted_data.dict(), status="OCR_COMPLETED")
+        if results["scoring"]:
+            uow.update(invoice_id, results["scoring"])
+        logger.debug(f"Updating invoice {invoice_id} with data: {uow.pending(invoice_id)}")
+
+    stages = [
+        Stage("ocr", ocr_stage),
+        Stage("user", user_stage, optional=True),
+        Stage("extraction", extraction_stage, after=("ocr", "user")),
+        Stage("client_siren", client_siren_stage, after=("extraction",), optional=True),
+        Stage("duplicates", duplicate_stage, after=("extraction",), optional=True),
+        # Sans score (SIREN indisponible, ...), la facture est quand même enregistrée ;
+        # le re-scoring en arrière-plan la complétera
+        Stage("scoring", scoring_stage, after=("user", "client_siren"), optional=True),
+        Stage("write", write_stage, after=("scoring", "duplicates")),
+    ]
+    try:
+        run = await run_pipeline("invoice_upload", stages)
+    finally:
+        prefetch.cancel()
+    logger.info(f"Successfully processed invoice {invoice_id} ({len(texts)}/{len(page_numbers)} pages OCRed) "
+                f"in {run.elapsed_ms} ms")
+    return run
+
+async def _extract_fields(text: str, page_texts: Dict[int, str], own_sirens: List[str]) -> Optional[OCRResult]:
+    """
+    Champs de la facture : règles d'abord (services.field_extraction) sur le
+    texte complet des pages OCRisées ; le LLM n'est appelé que si un champ requis
+    manque ou n'est pas sûr, avec les candidats trouvés comme indices
+    """
+    full_text = "\n".join(normalize_page(page_texts[n]) for n in sorted(page_texts))
+    candidates = extract_candidates(full_text, exclude_sirens=own_sirens)
+    if field_extraction.FIELD_RULES_ENABLED:
+        result = candidates.to_ocr_result()
+        if result:
+            logger.info(f"Invoice fields extracted by rules in {candidates.elapsed_ms} ms, LLM skipped")
+            field_extraction.record(candidates)
+            return result
+
+    started = time.perf_counter()
+    result = await extract_invoice_data(text, hints=candidates.hints() if field_extraction.FIELD_RULES_ENABLED else None)
+    field_extraction.record(candidates, llm_ms=(time.perf_counter() - started) * 1000)
+    if result and field_extraction.FIELD_RULES_ENABLED:
+        # Champs facultatifs oubliés par le LLM mais sûrs d'après les règles
+        for field, value in candidates.confident().items():
+            if field in OCRResult.model_fields and field not in REQUIRED_FIELDS and getattr(result, field) is None:
+                setattr(result, field, value)
+    return result
+
+async def _mark_failed(invoice_id: str, error: str, uow: Optional[InvoiceUnitOfWork] = None):
+    uow = uow or InvoiceUnitOfWork()
+    uow.update(invoice_id, status="OCR_FAILED", error=error)
+    await uow.flush()
+    publish_invoice_event(invoice_id, events.OCR_FAILED, {"status": "OCR_FAILED", "error": error})
+
+def build_pending_invoice(invoice_id: str, user_id: Optional[str], language: str = "fr_FR",
+                          blob_key: Optional[str] = None, batch_id: Optional[str] = None) -> dict:
+    """
+    Données de la facture provisoire créée avant l'OCR (remplacées à l'extraction)
+    """
+    invoice = {
+        "id": invoice_id,
+        "user_id": user_id,
+        "status": "OCR_PENDING",
+        "original_file_path": blob_key,
+        "created_date": datetime.now(),
+        "invoice_number": f"TEMP-{invoice_id[:8]}",
+        "client": "Pending OCR",
+        "amount": 0,
+        "due_date": datetime.now() + timedelta(days=30),  # Valeur temporaire
+        "description": "Processing invoice...",
+        "client_type": "company",
+        "client_country": "FR",
+        "currency": "EUR",
+        "language": language,
+        "payment_conditions": "upon_receipt"
+    }
+    if batch_id:
+        invoice["batch_id"] = batch_id
+    return invoice
+
+async def process_invoice_blob(invoice_id: str, blob_key: str, ocr_profile: Optional[str] = None,
+                               uow: Optional[InvoiceUnitOfWork] = None, user_id: Optional[str] = None):
+    """
+    Variante de process_invoice_async qui lit le PDF depuis le blob store
+    """
+    # Le fichier n'est lu qu'une fois un emplacement obtenu, pour ne pas garder
+    # en mémoire tous les PDF d'un lot en attente
+    async with _job_slots:
+        try:
+            file_content = await get_blob_store().get(blob_key)
+        except Exception as e:
+            logger.error(f"Error reading blob {blob_key}: {str(e)}")
+            await _mark_failed(invoice_id, f"Uploaded file not found: {blob_key}", uow)
+            return
+        await _process_invoice(invoice_id, file_content, ocr_profile, uow, user_id)
+
+async def process_staged_invoice(invoice_id: str, staging_key: str, ocr_profile: Optional[str] = None,
+                                 user_id: Optional[str] = None):
+    """
+    Traite une facture déposée directement dans le stockage via une URL pré-signée :
+    promotion vers sa clé adressée par le contenu, puis OCR
+    """
+    uow = InvoiceUnitOfWork()
+    try:
+        blob = await get_blob_store().promote(staging_key)
+        await set_blob_reference('invoice', invoice_id, blob.key)
+        # Écrit avec le résultat de l'OCR
+        uow.update(invoice_id, original_file_path=blob.key)
     except Exception as e:
-        logger.error(f"Error processing invoice: {str(e)}")
-        await update_invoice(invoice_id, {
-            "status": "OCR_FAILED",
-            "error": str(e)
-        })
+        logger.error(f"Error promoting staged upload {staging_key}: {str(e)}")
+        await _mark_failed(invoice_id, "Uploaded file could not be processed", uow)
+        return
+    await process_invoice_blob(invoice_id, blob.key, ocr_profile, uow, user_id)
+
+def _record_pages(page_count: int, pages_processed: int):
+    _page_metrics["documents"] += 1
+    _page_metrics["pages_total"] += page_count
+    _page_metrics["pages_skipped"] += page_count - pages_processed
+
+def get_page_metrics() -> dict:
+    """Compteurs de pages OCRisées et évitées par la stratégie progressive"""
+    documents = _page_metrics["documents"]
+    return {
+        **_page_metrics,
+        "progressive": OCR_PROGRESSIVE,
+        "avg_pages_skipped_per_document": round(_page_metrics["pages_skipped"] / documents, 2) if documents else None,
+    }
 
 async def is_invoice(text):
+    """
+    Le texte décrit-il une facture ? Décision locale par mots-clés
+    (services.invoice_classifier) ; le LLM ne juge que les documents ambigus
+    """
+    if invoice_classifier.INVOICE_CLASSIFIER_ENABLED:
+        classification = invoice_classifier.classify(text)
+        logger.debug(f"Invoice classifier: score {classification.score}, signals {classification.signals}")
+        if not classification.ambiguous:
+            return classification.is_invoice
+    return await _llm_is_invoice(text)
+
+async def _llm_is_invoice(text):
     # Utiliser le LLM pour déterminer si le texte décrit une facture
-    llm = ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0,
-        openai_api_key=openai_api_key
-    )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an AI assistant trained to determine if a given text describes an invoice. An invoice typically includes details such as invoice number, client name, amount due, and due date."),
-        ("human", f"Does the following text describe an invoice? Please respond with 'yes' or 'no'.\n\n{text}")
-    ])
+    messages = [
+        {"role": "system", "content": "You are an AI assistant trained to determine if a given text describes an invoice. An invoice typically includes details such as invoice number, client name, amount due, and due date."},
+        {"role": "user", "content": f"Does the following text describe an invoice? Please respond with 'yes' or 'no'.\n\n{text}"}
+    ]
     
     try:
-        response = llm.invoke(prompt.format_messages())
-        logger.debug("LLM response for invoice check: %s", response.content)
-        return response.content.strip().lower() == "yes"
-    except Exception as e:
+        content = await chat_completion(messages, max_tokens=3, purpose="is_invoice")
+        logger.debug("LLM response for invoice check: %s", content)
+        return content.strip().lower().rstrip('.') == "yes"
+    except LLMError as e:
         logger.error("Error checking if document is an invoice: %s", e)
         return False
 
-async def extract_invoice_data(text):
+async def extract_invoice_data(text, hints: Optional[dict] = None):
     try:
-        client = OpenAI(api_key=openai_api_key)
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        content = await chat_completion(
             response_format={ "type": "json_object" },
+            purpose="extract_invoice_data",
             messages=[
                 {"role": "system", "content": """You are an invoice data extraction assistant. 
                 Extract ALL these fields from the invoice:
@@ -129,15 +626,18 @@ async def extract_invoice_data(text):
                     "client_vat_number": "string or null",
                     "client_siren": "string or null"
                 }"""},
-                {"role": "user", "content": f"Extract ALL required fields from this invoice text and return as JSON: {text}"}
+                {"role": "user", "content": f"Extract ALL required fields from this invoice text and return as JSON: {text}"},
+                *([{"role": "user", "content": "Candidate values found by pattern matching, with their confidence. "
+                                               "Use them unless the text contradicts them: "
+                                               + json.dumps(hints, ensure_ascii=False)}] if hints else [])
             ]
         )
         
-        if not response.choices[0].message.content:
+        if not content:
             logger.error("No content in OpenAI response")
             return None
             
-        parsed_data = json.loads(response.choices[0].message.content)
+        parsed_data = json.loads(content)
         logger.debug(f"Parsed invoice data: {parsed_data}")
         
         # Vérification des champs requis
@@ -1,5 +1,6 @@
 import os
 import requests
+import httpx
 from fastapi import HTTPException
 import logging
 import os 
@@ -125,27 +126,45 @@ async def send_document_for_signature(file_url: str, recipient_email: str, recip
         )
 
 async def setup_pandadoc_webhook(app_url: str):
+    """
+    Enregistre le webhook PandaDoc de manière idempotente : on liste d'abord les
+    abonnements existants et on réutilise celui qui pointe déjà vers notre URL.
+    """
     try:
         webhook_url = f"{app_url}/webhook/pandadoc"
         logging.info(f"Setting up webhook with URL: {webhook_url}")
         
-        # Add required triggers
-        webhook_data = {
-            "name": "Freelpay Document Webhook",
-            "url": webhook_url,
-            "triggers": ["document_state_changed"]  # Add required triggers
-        }
-        
         headers = {
             'Authorization': f'API-Key {PANDADOC_API_KEY}',
             'Content-Type': 'application/json'
         }
         
-        response = requests.post(
-            f"{PANDADOC_API_URL}/webhook-subscriptions",
-            headers=headers,
-            json=webhook_data
-        )
+        async with httpx.AsyncClient(timeout=10) as client:
+            # 1. Réutiliser un abonnement existant s'il y en a un
+            list_response = await client.get(
+                f"{PANDADOC_API_URL}/webhook-subscriptions",
+                headers=headers
+            )
+            if list_response.status_code == 200:
+                for subscription in list_response.json().get('items', []):
+                    if subscription.get('url') == webhook_url and subscription.get('active', True):
+                        logging.info(f"Reusing PandaDoc webhook subscription {subscription.get('uuid')}")
+                        return True
+            else:
+                logging.warning(f"Could not list PandaDoc webhooks: {list_response.text}")
+
+            # 2. Sinon, en créer un nouveau
+            webhook_data = {
+                "name": "Freelpay Document Webhook",
+                "url": webhook_url,
+                "triggers": ["document_state_changed"]  # Add required triggers
+            }
+            
+            response = await client.post(
+                f"{PANDADOC_API_URL}/webhook-subscriptions",
+                headers=headers,
+                json=webhook_data
+            )
         
         if response.status_code not in (200, 201):
             logging.error(f"Failed to setup PandaDoc webhook: {response.text}")
@@ -156,4 +175,4 @@ async def setup_pandadoc_webhook(app_url: str):
     except Exception as e:
         logging.error(f"Failed to setup PandaDoc webhook: {str(e)}")
         # Don't raise exception to allow app to start
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,132 @@
+"""
+Exécution d'un petit graphe d'étapes asynchrones (DAG).
+
+Chaque étape déclare les étapes dont elle dépend et démarre dès qu'elles sont
+terminées : les étapes indépendantes tournent en parallèle. Une étape reçoit
+les résultats déjà produits, par nom d'étape.
+
+Une étape `optional` qui échoue donne None et n'interrompt pas le graphe ; une
+étape requise qui échoue annule les autres et l'exception est propagée.
+PipelineAbort arrête le graphe pour une raison attendue (document refusé, ...).
+
+La durée de chaque étape (hors attente de ses dépendances) est mesurée ;
+get_metrics() en donne les moyennes par pipeline et par étape.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+StageFunction = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class PipelineAbort(Exception):
+    """Arrêt volontaire du graphe ; le message est la raison à enregistrer"""
+
+
+@dataclass
+class Stage:
+    name: str
+    run: StageFunction
+    after: Sequence[str] = ()
+    optional: bool = False
+
+
+@dataclass
+class PipelineRun:
+    results: Dict[str, Any] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+
+
+_metrics: Dict[str, dict] = {}
+
+
+def _record(pipeline: str, run: PipelineRun, status: str):
+    metrics = _metrics.setdefault(pipeline, {"runs": 0, "completed": 0, "aborted": 0, "failed": 0,
+                                             "total_ms": 0.0, "stages": {}})
+    metrics["runs"] += 1
+    metrics[status] += 1
+    metrics["total_ms"] += run.elapsed_ms
+    for name, elapsed in run.timings.items():
+        stage = metrics["stages"].setdefault(name, {"runs": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stage["runs"] += 1
+        stage["total_ms"] += elapsed
+        stage["max_ms"] = max(stage["max_ms"], elapsed)
+    for name in run.errors:
+        metrics["stages"][name]["errors"] += 1
+
+
+async def run_pipeline(pipeline: str, stages: List[Stage]) -> PipelineRun:
+    """
+    Exécute les étapes ; chacune doit être déclarée après ses dépendances
+
+    Returns:
+        Les résultats et la durée (ms) de chaque étape
+    """
+    run = PipelineRun()
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def execute(stage: Stage):
+        if stage.after:
+            await asyncio.gather(*(tasks[name] for name in stage.after))
+        started = time.perf_counter()
+        try:
+            run.results[stage.name] = await stage.run(run.results)
+        except (PipelineAbort, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            if not stage.optional:
+                run.errors[stage.name] = str(e)
+                raise
+            logger.warning(f"Pipeline {pipeline}: optional stage {stage.name} failed: {str(e)}")
+            run.errors[stage.name] = str(e)
+            run.results[stage.name] = None
+        finally:
+            run.timings[stage.name] = round((time.perf_counter() - started) * 1000, 2)
+
+    for stage in stages:
+        missing = [name for name in stage.after if name not in tasks]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on undeclared stage(s) {missing}")
+        tasks[stage.name] = asyncio.create_task(execute(stage))
+
+    started = time.perf_counter()
+    status = "completed"
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException as e:
+        status = "aborted" if isinstance(e, PipelineAbort) else "failed"
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    finally:
+        run.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        _record(pipeline, run, status)
+        logger.info(f"Pipeline {pipeline} {status} in {run.elapsed_ms} ms: {run.timings}")
+    return run
+
+
+def get_metrics() -> dict:
+    """Exécutions et durée moyenne de chaque étape, par pipeline"""
+    return {
+        pipeline: {
+            **{key: value for key, value in metrics.items() if key not in ("total_ms", "stages")},
+            "avg_ms": round(metrics["total_ms"] / metrics["runs"], 2) if metrics["runs"] else None,
+            "stages": {
+                name: {
+                    "runs": stage["runs"],
+                    "errors": stage["errors"],
+                    "avg_ms": round(stage["total_ms"] / stage["runs"], 2),
+                    "max_ms": stage["max_ms"],
+                }
+                for name, stage in metrics["stages"].items()
+            },
+        }
+        for pipeline, metrics in _metrics.items()
+    }
@@ -0,0 +1,150 @@
+"""
+Re-scoring périodique des factures ouvertes.
+
+Le score est calculé à la création puis figé ; or ses entrées évoluent (données
+SIREN du client, échéance qui se rapproche, nouveau modèle). Cette tâche de fond
+parcourt les factures ouvertes par lots bornés, recalcule leurs caractéristiques
+et compare leur empreinte (caractéristiques arrondies + version du modèle) à
+celle enregistrée dans `score_fingerprint` : seules les factures dont l'empreinte
+a changé sont re-scorées, en une écriture groupée par lot.
+
+Entre deux lots, la tâche fait une pause proportionnelle au temps passé sur le
+lot précédent (lectures, SIREN, écriture ; RESCORE_DB_LOAD_FACTOR), pour ne pas
+concurrencer le trafic de l'API.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+from database.db import get_open_invoices_page, get_users_siren_numbers
+from database.unit_of_work import InvoiceUnitOfWork
+from services.risk_model import build_features, get_model
+from services.scoring_service import fingerprint, get_siren_data_many
+
+logger = logging.getLogger(__name__)
+
+RESCORE_ENABLED = os.getenv("RESCORE_ENABLED", "true").lower() == "true"
+RESCORE_INTERVAL_SECONDS = int(os.getenv("RESCORE_INTERVAL_SECONDS", "3600"))
+RESCORE_BATCH_SIZE = int(os.getenv("RESCORE_BATCH_SIZE", "200"))
+# Pause entre deux lots = durée du lot x facteur (au moins RESCORE_MIN_PAUSE_SECONDS)
+RESCORE_DB_LOAD_FACTOR = float(os.getenv("RESCORE_DB_LOAD_FACTOR", "4"))
+RESCORE_MIN_PAUSE_SECONDS = float(os.getenv("RESCORE_MIN_PAUSE_SECONDS", "0.5"))
+
+# Factures dont l'issue est connue ou sans données extraites (voir migration 006)
+RESCORE_EXCLUDED_STATUSES = ["Signed", "Paid", "Rejected", "Cancelled", "Demo", "OCR_PENDING", "OCR_FAILED"]
+COLUMNS = "id, user_id, amount, due_date, client_siren, status, score_fingerprint"
+
+_metrics = {
+    "runs": 0,
+    "running": False,
+    "last_run_started_at": None,
+    "last_run_finished_at": None,
+    "last_run_seconds": None,
+    "last_run": {"scanned": 0, "rescored": 0, "batches": 0},
+    "scanned": 0,
+    "rescored": 0,
+    "unchanged": 0,
+    "batches": 0,
+    "errors": 0,
+    "work_seconds": 0.0,
+    "throttle_seconds": 0.0,
+}
+
+
+def get_metrics() -> dict:
+    """Retourne un instantané des métriques du re-scoring"""
+    return {**_metrics, "last_run": dict(_metrics["last_run"])}
+
+
+async def rescore_batch(invoices: List[dict], uow: InvoiceUnitOfWork) -> int:
+    """
+    Recalcule les caractéristiques d'un lot et enregistre dans `uow` le nouveau
+    score des factures dont l'empreinte a changé
+
+    Returns:
+        Le nombre de factures re-scorées
+    """
+    model = get_model()
+    user_sirens = await get_users_siren_numbers(sorted({i['user_id'] for i in invoices if i.get('user_id')}))
+    # Même choix de SIREN qu'au scoring : celui de l'utilisateur, sinon celui du client
+    sirens = [user_sirens.get(i.get('user_id')) or i.get('client_siren') for i in invoices]
+    siren_data = await get_siren_data_many(sirens)
+
+    features = build_features(invoices, sirens, siren_data)
+    fingerprints = [fingerprint(model.version, row) for row in features.tolist()]
+    changed = [i for i, invoice in enumerate(invoices) if invoice.get('score_fingerprint') != fingerprints[i]]
+    if not changed:
+        return 0
+
+    scores = model.predict(features[changed])
+    scored_at = datetime.now(timezone.utc).isoformat()
+    for index, score in zip(changed, scores.tolist()):
+        invoice = invoices[index]
+        uow.update(
+            invoice['id'],
+            score=score,
+            possible_financing=float(invoice.get('amount') or 0) * (1 - score),
+            score_fingerprint=fingerprints[index],
+            scored_at=scored_at,
+        )
+    return len(changed)
+
+
+async def rescore_open_invoices(batch_size: int = RESCORE_BATCH_SIZE) -> dict:
+    """
+    Un passage complet sur les factures ouvertes, lot par lot
+
+    Returns:
+        Le nombre de factures parcourues, re-scorées et de lots
+    """
+    run = {"scanned": 0, "rescored": 0, "batches": 0}
+    _metrics["last_run"] = run
+    uow = InvoiceUnitOfWork(batch_size=batch_size)
+    after_id: Optional[str] = None
+    while True:
+        started = time.perf_counter()
+        invoices = await get_open_invoices_page(COLUMNS, RESCORE_EXCLUDED_STATUSES, after_id=after_id, limit=batch_size)
+        if not invoices:
+            break
+        after_id = invoices[-1]['id']
+        rescored = await rescore_batch(invoices, uow)
+        await uow.flush()
+        elapsed = time.perf_counter() - started
+
+        run["scanned"] += len(invoices)
+        run["rescored"] += rescored
+        run["batches"] += 1
+        _metrics["scanned"] += len(invoices)
+        _metrics["rescored"] += rescored
+        _metrics["unchanged"] += len(invoices) - rescored
+        _metrics["batches"] += 1
+        _metrics["work_seconds"] += elapsed
+
+        if len(invoices) < batch_size:
+            break
+        pause = max(RESCORE_MIN_PAUSE_SECONDS, elapsed * RESCORE_DB_LOAD_FACTOR)
+        _metrics["throttle_seconds"] += pause
+        await asyncio.sleep(pause)
+    return run
+
+
+async def run_rescoring_scheduler():
+    """Boucle de re-scoring lancée au démarrage de l'application"""
+    while True:
+        await asyncio.sleep(RESCORE_INTERVAL_SECONDS)
+        started = time.perf_counter()
+        _metrics["running"] = True
+        _metrics["last_run_started_at"] = datetime.now(timezone.utc).isoformat()
+        try:
+            run = await rescore_open_invoices()
+            logger.info(f"Re-scoring: {run['rescored']} of {run['scanned']} open invoices updated in {run['batches']} batches")
+        except Exception as e:
+            _metrics["errors"] += 1
+            logger.error(f"Re-scoring failed: {str(e)}")
+        finally:
+            _metrics["running"] = False
+            _metrics["runs"] += 1
+            _metrics["last_run_seconds"] = round(time.perf_counter() - started, 3)
+            _metrics["last_run_finished_at"] = datetime.now(timezone.utc).isoformat()
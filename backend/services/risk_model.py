@@ -0,0 +1,225 @@
+"""
+Modèle de risque appris (régression logistique), évalué en mémoire.
+
+Le modèle est un petit artefact JSON (poids, moyennes et échelles de
+standardisation) produit hors ligne par `python -m training.train_risk_model`
+à partir des factures historiques et de leur issue. Il est chargé une fois au
+démarrage ; un score coûte quelques microsecondes et chaque caractéristique
+a une contribution explicite au logit, renvoyée dans ScoreDetails.
+
+Tant qu'aucun artefact n'a été entraîné (RISK_MODEL_PATH absent), un modèle
+a priori aux poids fixés à la main est utilisé.
+"""
+import json
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+RISK_MODEL_PATH = os.getenv("RISK_MODEL_PATH", os.path.join("artifacts", "risk_model.json"))
+
+FEATURE_NAMES = [
+    "log_amount",
+    "due_horizon_days",
+    "has_siren",
+    "company_age_years",
+    "has_employees",
+]
+
+MAX_HORIZON_DAYS = 365
+MAX_COMPANY_AGE_YEARS = 30
+
+
+@dataclass
+class RiskModel:
+    version: str
+    weights: List[float]
+    bias: float
+    means: List[float]
+    scales: List[float]
+    feature_names: List[str] = field(default_factory=lambda: list(FEATURE_NAMES))
+    metrics: Dict[str, float] = field(default_factory=dict)
+    trained_at: Optional[str] = None
+
+    def __post_init__(self):
+        import numpy as np
+
+        if len(self.weights) != len(self.feature_names):
+            raise ValueError("Risk model weights do not match its features")
+        self._weights = np.asarray(self.weights, dtype=float)
+        self._means = np.asarray(self.means, dtype=float)
+        self._scales = np.asarray(self.scales, dtype=float)
+
+    def logit_contributions(self, X):
+        """Contribution de chaque caractéristique au logit, par facture (n x d)"""
+        return (X - self._means) / self._scales * self._weights
+
+    def predict(self, X):
+        """Probabilité de défaut (score de risque) de chaque ligne de X"""
+        import numpy as np
+
+        z = self.logit_contributions(X).sum(axis=1) + self.bias
+        return 1 / (1 + np.exp(-z))
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "feature_names": self.feature_names,
+            "weights": [float(w) for w in self.weights],
+            "bias": float(self.bias),
+            "means": [float(m) for m in self.means],
+            "scales": [float(s) for s in self.scales],
+            "metrics": self.metrics,
+            "trained_at": self.trained_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RiskModel":
+        return cls(
+            version=data["version"],
+            feature_names=data.get("feature_names", FEATURE_NAMES),
+            weights=data["weights"],
+            bias=data["bias"],
+            means=data["means"],
+            scales=data["scales"],
+            metrics=data.get("metrics", {}),
+            trained_at=data.get("trained_at"),
+        )
+
+
+# Poids a priori (caractéristiques brutes, sans standardisation) utilisés tant
+# qu'aucun modèle n'a été entraîné
+PRIOR_MODEL = {
+    "version": "prior-2",
+    "weights": [0.35, 0.004, -0.6, -0.05, -0.2],
+    "bias": -1.6,
+    "means": [0.0] * len(FEATURE_NAMES),
+    "scales": [1.0] * len(FEATURE_NAMES),
+}
+
+_model: Optional[RiskModel] = None
+
+
+def load_model(path: str = RISK_MODEL_PATH) -> RiskModel:
+    if os.path.exists(path):
+        with open(path) as f:
+            model = RiskModel.from_dict(json.load(f))
+        if model.feature_names == FEATURE_NAMES:
+            logger.info(f"Loaded risk model {model.version} from {path}")
+            return model
+        # Artefact d'une version précédente des caractéristiques : à réentraîner
+        logger.error(f"Risk model {path} was trained on other features ({model.feature_names}), using prior weights")
+        return RiskModel.from_dict(PRIOR_MODEL)
+    logger.warning(f"No risk model at {path}, using prior weights")
+    return RiskModel.from_dict(PRIOR_MODEL)
+
+
+def get_model() -> RiskModel:
+    global _model
+    if _model is None:
+        _model = load_model()
+    return _model
+
+
+def _company_age_years(siren_data: Optional[dict], now: datetime) -> float:
+    if not siren_data:
+        return 0.0
+    age = siren_data.get('age_entreprise')
+    if isinstance(age, (int, float)):
+        return float(age)
+    created = siren_data.get('date_creation')
+    if created:
+        try:
+            created_date = date.fromisoformat(str(created)[:10])
+        except ValueError:
+            return 0.0
+        return max((now.date() - created_date).days / 365.25, 0.0)
+    return 0.0
+
+
+def _has_employees(siren_data: Optional[dict]) -> float:
+    if not siren_data:
+        return 0.0
+    employees = siren_data.get('effectif') or siren_data.get('tranche_effectifs')
+    # Tranche INSEE "NN" / "00" : pas de salarié
+    return 0.0 if employees in (None, "", "NN", "00", 0, "0") else 1.0
+
+
+def build_features(invoices: List[dict], sirens: List[Optional[str]], siren_data: Dict[str, Optional[dict]],
+                   as_of: Optional[Sequence[datetime]] = None):
+    """
+    Matrice des caractéristiques (n x len(FEATURE_NAMES)) d'un lot de factures
+
+    Args:
+        as_of: date de référence de chaque facture (par défaut maintenant) ; à
+            l'entraînement, la date de création, comme au moment du scoring
+    """
+    import numpy as np
+    from timestamps import parse_datetime
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    for index, (invoice, siren) in enumerate(zip(invoices, sirens)):
+        reference = as_of[index] if as_of else now
+        due_date = parse_datetime(invoice.get('due_date')) if invoice.get('due_date') else reference
+        company = siren_data.get(siren) if siren else None
+        rows.append([
+            math.log10(max(float(invoice.get('amount') or 0), 0) + 1),
+            min(max((due_date - reference).total_seconds() / 86400, 0), MAX_HORIZON_DAYS),
+            1.0 if siren else 0.0,
+            min(_company_age_years(company, reference), MAX_COMPANY_AGE_YEARS),
+            _has_employees(company),
+        ])
+    return np.array(rows, dtype=float).reshape(len(rows), len(FEATURE_NAMES))
+
+
+def fit_logistic(X, y, l2: float = 1.0, max_iter: int = 50, tol: float = 1e-8) -> RiskModel:
+    """
+    Régression logistique L2 par Newton-Raphson (IRLS) sur caractéristiques standardisées
+    """
+    import numpy as np
+
+    means = X.mean(axis=0)
+    scales = X.std(axis=0)
+    scales[scales == 0] = 1.0
+    Z = np.hstack([np.ones((len(X), 1)), (X - means) / scales])
+    beta = np.zeros(Z.shape[1])
+    penalty = np.full(Z.shape[1], l2)
+    penalty[0] = 0.0  # pas de pénalité sur l'ordonnée à l'origine
+
+    for _ in range(max_iter):
+        p = 1 / (1 + np.exp(-(Z @ beta)))
+        gradient = Z.T @ (p - y) + penalty * beta
+        hessian = (Z * (p * (1 - p))[:, None]).T @ Z + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        beta -= step
+        if np.max(np.abs(step)) < tol:
+            break
+
+    return RiskModel(
+        version=datetime.now(timezone.utc).strftime("logit-%Y%m%d%H%M%S"),
+        weights=beta[1:].tolist(),
+        bias=float(beta[0]),
+        means=means.tolist(),
+        scales=scales.tolist(),
+        trained_at=datetime.now(timezone.utc).isoformat(),
+    )
+
+
+def evaluate(model: RiskModel, X, y) -> Dict[str, float]:
+    """Log loss, AUC et taux de défaut observé sur un jeu de validation"""
+    import numpy as np
+
+    p = np.clip(model.predict(X), 1e-7, 1 - 1e-7)
+    log_loss = float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+    positives, negatives = int(y.sum()), int(len(y) - y.sum())
+    auc = None
+    if positives and negatives:
+        # AUC = probabilité qu'une facture en défaut ait un score plus élevé qu'une facture payée
+        ranks = np.argsort(np.argsort(p)) + 1
+        auc = float((ranks[y == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+    return {"log_loss": log_loss, "auc": auc, "default_rate": float(y.mean()), "samples": int(len(y))}
@@ -1,16 +1,32 @@
 import os
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
+import json
+import asyncio
+import hashlib
+import logging
 import httpx
+from typing import Dict, List, Optional
 from fastapi import HTTPException
+from services.llm_gateway import chat_completion, LLMError
+from services.risk_model import FEATURE_NAMES, build_features, get_model
+from services import sirene_index
+
+logger = logging.getLogger(__name__)
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
 SIREN_API_BASE_URL = "https://data.siren-api.fr/v3"
 SIREN_API_KEY = os.getenv("SIREN_API_KEY")
-
-llm = ChatOpenAI(temperature=0.2, model_name="gpt-4o-mini", openai_api_key=openai_api_key)
+SIREN_LOOKUP_CONCURRENCY = int(os.getenv("SIREN_LOOKUP_CONCURRENCY", "8"))
+# Granularité de l'échéance dans l'empreinte : re-score au plus une fois par pas
+RESCORE_HORIZON_STEP_DAYS = int(os.getenv("RESCORE_HORIZON_STEP_DAYS", "7"))
 
 async def get_siren_data(siren: str):
+    """
+    Unité légale d'un SIREN, toujours au même format (champs à plat, comme
+    sirene_index.lookup) ; l'API distante l'enveloppe dans `unite_legale`
+    """
+    # Index SIRENE local d'abord, l'API distante seulement si le SIREN est absent ou l'index trop ancien
+    local = sirene_index.lookup(siren)
+    if local:
+        return local
     if not SIREN_API_KEY:
         raise HTTPException(status_code=500, detail="SIREN API key is not configured")
     
@@ -24,48 +40,127 @@ async def get_siren_data(siren: str):
             if response.status_code == 404:
                 return None
             response.raise_for_status()
-            return response.json()
+            payload = response.json()
+            return payload.get('unite_legale', payload) if isinstance(payload, dict) else None
             
     except httpx.HTTPError as e:
         return None
 
-async def calculate_score(invoice_data, user_siren=None):
-    # Get SIREN data if available
-    siren_data = None
-    if user_siren:
-        siren_data = await get_siren_data(user_siren)
-    
-    system_prompt = """You are a risk assessment AI for invoice financing. 
-    Provide a risk score between 0 and 1, where 0 is lowest risk and 1 is highest risk.
-    Consider both the invoice data and the company's SIREN information when available."""
-    
-    user_prompt = f"""
-    Given the following information, calculate a risk score:
-    
-    Invoice Data:
-    - Invoice Number: {invoice_data['invoice_number']}
-    - Amount: {invoice_data['amount']}
-    - Client: {invoice_data['client']}
-    - Due Date: {invoice_data['due_date']}
-    - Description: {invoice_data['description']}
+async def get_siren_data_many(sirens) -> Dict[str, Optional[dict]]:
     """
-    
-    if siren_data:
-        user_prompt += f"""
-        Company SIREN Data:
-        - Company Age: {siren_data.get('age_entreprise')}
-        - Legal Status: {siren_data.get('forme_juridique')}
-        - Activity Code: {siren_data.get('activite_principale')}
-        - Employee Count: {siren_data.get('effectif')}
-        """
-    
-    user_prompt += "\nRespond with only a number between 0 and 1, representing the risk score."
+    Données SIREN de plusieurs entreprises : chaque SIREN n'est demandé qu'une
+    fois, avec au plus SIREN_LOOKUP_CONCURRENCY requêtes simultanées
+    """
+    unique = sorted({siren for siren in sirens if siren})
+    semaphore = asyncio.Semaphore(SIREN_LOOKUP_CONCURRENCY)
 
-    messages = [
-        SystemMessage(content=system_prompt),
-        HumanMessage(content=user_prompt)
+    async def lookup(siren: str):
+        async with semaphore:
+            try:
+                return await get_siren_data(siren)
+            except HTTPException as e:
+                logger.warning(f"SIREN lookup failed for {siren}: {e.detail}")
+                return None
+
+    results = await asyncio.gather(*(lookup(siren) for siren in unique))
+    return dict(zip(unique, results))
+
+def fingerprint(model_version: str, features) -> str:
+    """
+    Empreinte d'une ligne de caractéristiques, arrondies pour ignorer les variations
+    sans effet (l'échéance par pas de RESCORE_HORIZON_STEP_DAYS jours)
+    """
+    log_amount, horizon, has_siren, company_age, employees = features
+    parts = [
+        model_version,
+        f"{log_amount:.4f}",
+        str(int(horizon // RESCORE_HORIZON_STEP_DAYS)),
+        str(int(has_siren)),
+        f"{company_age:.1f}",
+        str(int(employees)),
     ]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
 
-    llm_response = llm.invoke(messages)
-    score = float(llm_response.content.strip())
-    return score
\ No newline at end of file
+def score_invoices(invoices: List[dict], sirens: List[Optional[str]], siren_data: Dict[str, Optional[dict]]) -> List[dict]:
+    """
+    Score de risque d'un lot de factures avec le modèle en mémoire (sans I/O)
+
+    Returns:
+        Une entrée par facture : score, possible_financing, amount,
+        score_fingerprint (voir rescoring) et details (dont la contribution de
+        chaque caractéristique au logit)
+    """
+    model = get_model()
+    features = build_features(invoices, sirens, siren_data)
+    contributions = model.logit_contributions(features)
+    scores = model.predict(features)
+
+    results = []
+    for i, invoice in enumerate(invoices):
+        amount = float(invoice.get('amount') or 0)
+        score = float(scores[i])
+        results.append({
+            "score": score,
+            "possible_financing": amount * (1 - score),
+            "amount": amount,
+            "score_fingerprint": fingerprint(model.version, features[i].tolist()),
+            "details": {
+                "contributions": {
+                    name: round(float(value), 6) + 0.0  # pas de -0.0
+                    for name, value in zip(FEATURE_NAMES, contributions[i])
+                },
+                "intercept": round(model.bias, 6),
+                "model_version": model.version,
+            }
+        })
+    return results
+
+async def calculate_scores_batch(invoices: List[dict], sirens: List[Optional[str]]) -> List[dict]:
+    """
+    Score de risque d'un lot de factures : SIREN résolus en parallèle et sans
+    doublon, puis un seul passage du modèle pour tout le lot
+
+    Args:
+        sirens: SIREN à utiliser pour chaque facture (None si inconnu)
+    """
+    if not invoices:
+        return []
+    siren_data = await get_siren_data_many(sirens)
+    return score_invoices(invoices, sirens, siren_data)
+
+async def score_invoice(invoice_data: dict, siren: Optional[str] = None, explain: bool = False) -> dict:
+    """
+    Score d'une facture avec le détail du modèle ; si `explain`, le LLM rédige
+    une courte explication à partir des contributions (le score n'en dépend pas)
+    """
+    result = (await calculate_scores_batch([invoice_data], [siren]))[0]
+    if explain:
+        result["details"]["explanation"] = await explain_score(invoice_data, result)
+    return result
+
+async def calculate_score(invoice_data, user_siren=None) -> float:
+    result = await score_invoice(invoice_data, siren=user_siren)
+    return result["score"]
+
+async def explain_score(invoice_data: dict, result: dict) -> Optional[str]:
+    """Explication en langage naturel d'un score ; None si le LLM n'est pas disponible"""
+    details = result["details"]
+    messages = [
+        {"role": "system", "content": """You explain invoice financing risk scores to freelancers.
+    The score comes from a logistic regression: each contribution is added to the logit,
+    positive values increase the risk and negative values decrease it.
+    Answer in French, in two or three short sentences, without inventing any other factor."""},
+        {"role": "user", "content": json.dumps({
+            "amount": invoice_data.get('amount'),
+            "client": invoice_data.get('client'),
+            "due_date": invoice_data.get('due_date'),
+            "score": round(result["score"], 3),
+            "intercept": details["intercept"],
+            "contributions": details["contributions"],
+        }, ensure_ascii=False, default=str)}
+    ]
+    try:
+        return (await chat_completion(messages, temperature=0.2, max_tokens=200, purpose="explain_score")).strip()
+    except LLMError as e:
+        logger.warning(f"Score explanation unavailable: {str(e)}")
+        return None
@@ -0,0 +1,395 @@
+"""
+Index local du répertoire SIRENE (unités légales), dans une base SQLite.
+
+Le stock mensuel publié par l'INSEE en open data (StockUniteLegale_utf8.zip)
+est importé dans une table indexée par SIREN ; les mises à jour quotidiennes
+sont récupérées sur l'API Sirene (unités légales modifiées depuis la dernière
+mise à jour). Les recherches sont locales (quelques microsecondes) ; les API
+distantes ne servent plus que pour les SIREN absents de l'index ou quand
+l'index n'a pas été mis à jour depuis SIRENE_MAX_AGE_DAYS jours.
+
+    cd backend
+    python -m services.sirene_index stock path/to/StockUniteLegale_utf8.zip
+    python -m services.sirene_index delta [--since 2024-05-01]
+
+Le stock est construit dans un fichier temporaire puis remplace l'index d'un coup.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import os
+import sqlite3
+import zipfile
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
+import httpx
+from services.company_names import normalize_name
+
+logger = logging.getLogger(__name__)
+
+SIRENE_INDEX_PATH = os.getenv("SIRENE_INDEX_PATH", os.path.join("data", "sirene.db"))
+SIRENE_MAX_AGE_DAYS = int(os.getenv("SIRENE_MAX_AGE_DAYS", "3"))
+SIRENE_DELTA_INTERVAL_SECONDS = int(os.getenv("SIRENE_DELTA_INTERVAL_SECONDS", str(24 * 3600)))
+
+INSEE_API_BASE_URL = "https://api.insee.fr/entreprises/sirene/V3.11"
+INSEE_TOKEN = os.getenv("INSEE_TOKEN", "12d5485c-0e0f-3fa3-8c0a-090966ec8b61")  # Votre token par défaut
+
+IMPORT_CHUNK_SIZE = 50000
+DELTA_PAGE_SIZE = 1000
+
+# Colonnes de la table, dans l'ordre des tuples produits par _stock_row / _api_row
+COLUMNS = [
+    "siren",
+    "denomination",
+    "sigle",
+    "activite_principale",
+    "categorie_juridique",
+    "categorie_entreprise",
+    "date_creation",
+    "tranche_effectifs",
+    "annee_effectifs",
+    "etat_administratif",
+    "economie_sociale_solidaire",
+    "caractere_employeur",
+    "date_dernier_traitement",
+]
+
+SCHEMA = f"""
+create table if not exists unites_legales (
+    siren integer primary key,
+    {", ".join(f"{column} text" for column in COLUMNS[1:])}
+);
+create table if not exists meta (key text primary key, value text);
+-- Noms normalisés (dénomination et sigle), rowid = SIREN, pour la recherche par nom
+create virtual table if not exists noms using fts5(name, tokenize = 'trigram');
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+_connection_inode: Optional[int] = None
+_updated_at: Optional[datetime] = None
+
+_metrics = {"local_hits": 0, "local_misses": 0, "stale": 0, "unavailable": 0, "delta_updates": 0, "delta_rows": 0}
+
+
+async def get_insee_token():
+    """Récupère un nouveau token INSEE si nécessaire"""
+    # Pour l'instant on utilise le token statique,
+    # mais on pourrait implémenter le renouvellement automatique plus tard
+    return INSEE_TOKEN
+
+
+def get_metrics() -> dict:
+    """Retourne un instantané des métriques de l'index SIRENE"""
+    return {
+        **_metrics,
+        "path": SIRENE_INDEX_PATH,
+        "available": _connection is not None,
+        "updated_at": _updated_at.isoformat() if _updated_at else None,
+    }
+
+
+def _name(denomination: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> Optional[str]:
+    """Dénomination, ou prénom et nom pour les entrepreneurs individuels"""
+    if denomination:
+        return denomination
+    person = " ".join(part for part in (first_name, last_name) if part)
+    return person or None
+
+
+def _stock_row(row: dict) -> tuple:
+    """Ligne du fichier stock (ou d'un fichier de mise à jour au même format)"""
+    get = lambda key: row.get(key) or None  # noqa: E731
+    return (
+        int(row["siren"]),
+        _name(get("denominationUniteLegale"), get("prenom1UniteLegale"),
+              get("nomUsageUniteLegale") or get("nomUniteLegale")),
+        get("sigleUniteLegale"),
+        get("activitePrincipaleUniteLegale"),
+        get("categorieJuridiqueUniteLegale"),
+        get("categorieEntrepriseUniteLegale"),
+        get("dateCreationUniteLegale"),
+        get("trancheEffectifsUniteLegale"),
+        get("anneeEffectifsUniteLegale"),
+        get("etatAdministratifUniteLegale"),
+        get("economieSocialeSolidaireUniteLegale"),
+        get("caractereEmployeurUniteLegale"),
+        get("dateDernierTraitementUniteLegale"),
+    )
+
+
+def _api_row(unite_legale: dict) -> tuple:
+    """Unité légale renvoyée par l'API Sirene (période courante en premier)"""
+    periodes = unite_legale.get("periodesUniteLegale") or [{}]
+    courante = periodes[0]
+    return _stock_row({**unite_legale, **{k: v for k, v in courante.items() if v is not None}})
+
+
+def _record(row: sqlite3.Row) -> dict:
+    """Unité légale au format renvoyé par /siren/validate"""
+    record = {column: row[column] for column in COLUMNS}
+    record["siren"] = f"{row['siren']:09d}"
+    record["etablissement_siege"] = {"geo_adresse": ""}
+    return record
+
+
+def _connect_reader() -> Optional[sqlite3.Connection]:
+    global _connection, _connection_inode
+    try:
+        inode = os.stat(SIRENE_INDEX_PATH).st_ino
+    except FileNotFoundError:
+        return None
+    if _connection is None or inode != _connection_inode:
+        if _connection is not None:
+            _connection.close()
+        _connection = sqlite3.connect(f"file:{SIRENE_INDEX_PATH}?mode=ro", uri=True, check_same_thread=False)
+        _connection.row_factory = sqlite3.Row
+        _connection_inode = inode
+        _load_updated_at()
+    return _connection
+
+
+def _load_updated_at():
+    global _updated_at
+    row = _connection.execute("select value from meta where key = 'updated_at'").fetchone()
+    _updated_at = datetime.fromisoformat(row[0]) if row else None
+
+
+def reload():
+    """Rouvre l'index s'il a été reconstruit et relit sa date de mise à jour"""
+    if _connect_reader() is not None:
+        _load_updated_at()
+
+
+def is_fresh() -> bool:
+    return _updated_at is not None and datetime.now(timezone.utc) - _updated_at < timedelta(days=SIRENE_MAX_AGE_DAYS)
+
+
+def lookup(siren: str) -> Optional[dict]:
+    """
+    Unité légale de l'index local
+
+    Returns:
+        L'unité légale, ou None si le SIREN est absent, si l'index n'existe pas
+        ou s'il est trop ancien (les appelants interrogent alors l'API distante)
+    """
+    if not (len(siren) == 9 and siren.isdigit()):
+        return None
+    connection = _connection or _connect_reader()
+    if connection is None:
+        _metrics["unavailable"] += 1
+        return None
+    if not is_fresh():
+        _metrics["stale"] += 1
+        return None
+    row = connection.execute("select * from unites_legales where siren = ?", (int(siren),)).fetchone()
+    if row is None:
+        _metrics["local_misses"] += 1
+        return None
+    _metrics["local_hits"] += 1
+    return _record(row)
+
+
+def search_names(normalized: str, limit: int = 50) -> List[dict]:
+    """
+    Unités légales dont le nom normalisé contient les mots de `normalized`
+    (tous les mots, sinon au moins un), les plus pertinentes (bm25) d'abord :
+    avec un mot courant, `limit` est atteint bien avant d'avoir tout parcouru et
+    seules les meilleures doivent rester. L'appelant affine le classement.
+
+    Returns:
+        Les unités légales, avec leur nom normalisé dans `normalized_name`
+    """
+    words = [word for word in normalized.split() if len(word) >= 3]
+    connection = _connection or _connect_reader()
+    if not words or connection is None:
+        return []
+    statement = """
+        select u.*, n.name as normalized_name
+          from noms n join unites_legales u on u.siren = n.rowid
+         where noms match ?
+         order by n.rank
+         limit ?
+    """
+    phrases = [f'"{word}"' for word in words]
+    try:
+        rows = connection.execute(statement, (" AND ".join(phrases), limit)).fetchall()
+        if not rows and len(phrases) > 1:
+            rows = connection.execute(statement, (" OR ".join(phrases), limit)).fetchall()
+    except sqlite3.OperationalError as e:
+        # Index construit avant l'ajout de la table des noms
+        logger.warning(f"SIRENE name search unavailable: {str(e)}")
+        return []
+    return [{**_record(row), "normalized_name": row["normalized_name"]} for row in rows]
+
+
+def _name_rows(rows: list) -> list:
+    return [
+        (row[0], " ".join(filter(None, (normalize_name(row[1]), normalize_name(row[2])))))
+        for row in rows
+    ]
+
+
+def _write_rows(connection: sqlite3.Connection, rows: Iterable[tuple], replace_names: bool = False) -> int:
+    placeholders = ", ".join("?" for _ in COLUMNS)
+    statement = f"insert or replace into unites_legales ({', '.join(COLUMNS)}) values ({placeholders})"
+    count = 0
+    chunk = []
+
+    def write():
+        connection.executemany(statement, chunk)
+        if replace_names:
+            connection.executemany("delete from noms where rowid = ?", [(row[0],) for row in chunk])
+        connection.executemany("insert into noms (rowid, name) values (?, ?)", _name_rows(chunk))
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            write()
+            count += len(chunk)
+            chunk.clear()
+    if chunk:
+        write()
+        count += len(chunk)
+    return count
+
+
+def _set_updated_at(connection: sqlite3.Connection, value: datetime):
+    connection.execute("insert or replace into meta (key, value) values ('updated_at', ?)", (value.isoformat(),))
+
+
+def _iter_stock(path: str, active_only: bool) -> Iterator[tuple]:
+    """Lit le stock (ZIP publié par l'INSEE ou CSV) ligne à ligne"""
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        name = next(n for n in archive.namelist() if n.lower().endswith(".csv"))
+        raw = archive.open(name)
+    else:
+        archive, raw = None, open(path, "rb")
+    try:
+        for row in csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8", newline="")):
+            if active_only and row.get("etatAdministratifUniteLegale") == "C":
+                continue
+            yield _stock_row(row)
+    finally:
+        raw.close()
+        if archive:
+            archive.close()
+
+
+def import_stock(path: str, active_only: bool = False) -> int:
+    """
+    Construit l'index à partir du stock mensuel, dans un fichier temporaire qui
+    remplace ensuite l'index existant
+
+    Returns:
+        Le nombre d'unités légales importées
+    """
+    os.makedirs(os.path.dirname(SIRENE_INDEX_PATH) or ".", exist_ok=True)
+    building = f"{SIRENE_INDEX_PATH}.building"
+    if os.path.exists(building):
+        os.remove(building)
+    connection = sqlite3.connect(building)
+    try:
+        connection.executescript("pragma journal_mode = off; pragma synchronous = off;" + SCHEMA)
+        count = _write_rows(connection, _iter_stock(path, active_only))
+        # Les mises à jour reprendront à partir du dernier traitement présent dans le stock
+        latest = connection.execute("select max(date_dernier_traitement) from unites_legales").fetchone()[0]
+        updated_at = datetime.fromisoformat(latest).replace(tzinfo=timezone.utc) if latest \
+            else datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        _set_updated_at(connection, updated_at)
+        connection.commit()
+        connection.execute("pragma journal_mode = wal")
+    finally:
+        connection.close()
+    os.replace(building, SIRENE_INDEX_PATH)
+    logger.info(f"SIRENE index built with {count} legal units from {path}")
+    return count
+
+
+async def _fetch_updates(since: datetime) -> AsyncIterator[list]:
+    """Pages d'unités légales modifiées depuis `since` (API Sirene, pagination par curseur)"""
+    token = await get_insee_token()
+    cursor = "*"
+    query = f"dateDernierTraitementUniteLegale:[{since.strftime('%Y-%m-%dT%H:%M:%S')} TO *]"
+    async with httpx.AsyncClient(timeout=60) as client:
+        while True:
+            response = await client.get(
+                f"{INSEE_API_BASE_URL}/siren",
+                params={"q": query, "nombre": DELTA_PAGE_SIZE, "curseur": cursor},
+                headers={"Authorization": f"Bearer {token}", "Accept": "application/json"}
+            )
+            if response.status_code == 404:
+                # Aucune unité légale modifiée
+                return
+            response.raise_for_status()
+            data = response.json()
+            yield data.get("unitesLegales", [])
+            next_cursor = data.get("header", {}).get("curseurSuivant")
+            if not next_cursor or next_cursor == cursor:
+                return
+            cursor = next_cursor
+
+
+async def apply_delta(since: Optional[datetime] = None) -> int:
+    """
+    Applique les modifications publiées depuis la dernière mise à jour de l'index
+
+    Returns:
+        Le nombre d'unités légales ajoutées ou modifiées
+    """
+    if not os.path.exists(SIRENE_INDEX_PATH):
+        raise FileNotFoundError(f"No SIRENE index at {SIRENE_INDEX_PATH}, import a stock file first")
+    connection = sqlite3.connect(SIRENE_INDEX_PATH, check_same_thread=False)
+    try:
+        if since is None:
+            row = connection.execute("select value from meta where key = 'updated_at'").fetchone()
+            since = datetime.fromisoformat(row[0]) if row else datetime.now(timezone.utc) - timedelta(days=1)
+        started = datetime.now(timezone.utc)
+        count = 0
+        async for page in _fetch_updates(since):
+            count += await asyncio.to_thread(_write_rows, connection, [_api_row(u) for u in page], True)
+        _set_updated_at(connection, started)
+        await asyncio.to_thread(connection.commit)
+    finally:
+        connection.close()
+    _metrics["delta_updates"] += 1
+    _metrics["delta_rows"] += count
+    reload()
+    logger.info(f"SIRENE index: {count} legal units updated since {since.isoformat()}")
+    return count
+
+
+async def run_delta_updates():
+    """Mise à jour quotidienne de l'index, lancée au démarrage de l'application"""
+    while True:
+        if os.path.exists(SIRENE_INDEX_PATH):
+            reload()
+            if _updated_at is None or datetime.now(timezone.utc) - _updated_at >= timedelta(seconds=SIRENE_DELTA_INTERVAL_SECONDS):
+                try:
+                    await apply_delta()
+                except Exception as e:
+                    logger.error(f"SIRENE index update failed: {str(e)}")
+        await asyncio.sleep(SIRENE_DELTA_INTERVAL_SECONDS)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or update the local SIRENE index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stock = commands.add_parser("stock", help="Import a monthly StockUniteLegale file (ZIP or CSV)")
+    stock.add_argument("path")
+    stock.add_argument("--active-only", action="store_true", help="Skip ceased legal units")
+    delta = commands.add_parser("delta", help="Apply the changes published since the last update")
+    delta.add_argument("--since", type=lambda value: datetime.fromisoformat(value).replace(tzinfo=timezone.utc))
+    args = parser.parse_args()
+
+    if args.command == "stock":
+        import_stock(args.path, active_only=args.active_only)
+    else:
+        asyncio.run(apply_delta(args.since))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Préparation du texte OCR avant envoi au LLM.
+
+Le texte brut de Tesseract contient du bruit (caractères parasites, en-têtes et
+pieds de page répétés, conditions générales...) qui augmente la latence et le coût
+des appels LLM. Cette étape :
+1. normalise les espaces et nettoie le bruit OCR ;
+2. supprime les en-têtes/pieds de page répétés d'une page à l'autre ;
+3. découpe le texte en morceaux et les classe selon leur probabilité de contenir
+   les totaux, les parties et les dates ;
+4. garde les meilleurs morceaux dans la limite d'un budget de tokens.
+"""
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional
+
+from services.llm_gateway import count_tokens
+
+logger = logging.getLogger(__name__)
+
+OCR_TEXT_TOKEN_BUDGET = int(os.getenv("OCR_TEXT_TOKEN_BUDGET", "1200"))
+CHUNK_SIZE = 400
+HEADER_FOOTER_LINES = 4
+
+# Motifs qui signalent un morceau utile à l'extraction, avec leur poids
+_SIGNALS = [
+    (re.compile(r"\b(total|montant|net [àa] payer|ttc|ht|tva|amount due|balance)\b", re.I), 3.0),
+    (re.compile(r"\b(facture|invoice|avoir|n[°o]\s*de\s*facture|r[ée]f[ée]rence)\b", re.I), 2.5),
+    (re.compile(r"\b([ée]ch[ée]ance|due date|date limite|payable|date de facture|date d'[ée]mission)\b", re.I), 2.5),
+    (re.compile(r"\b(client|destinataire|factur[ée] [àa]|bill to|adress[ée] [àa])\b", re.I), 2.0),
+    (re.compile(r"\b(siren|siret|rcs|tva intracom\w*|n[°o] tva)\b", re.I), 2.0),
+    (re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"), 1.0),
+    (re.compile(r"\d[\d  .]*[,.]\d{2}\s*(€|eur)", re.I), 1.5),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"), 1.0),
+]
+# Motifs typiques des conditions générales, peu utiles à l'extraction
+_NOISE_SIGNALS = [
+    (re.compile(r"\b(conditions g[ée]n[ée]rales|p[ée]nalit[ée]s? de retard|indemnit[ée] forfaitaire|article \d+|clause)\b", re.I), 2.0),
+]
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_REPEATED_PUNCT = re.compile(r"([^\w\s])\1{2,}")
+_SPACES = re.compile(r"[ \t ]+")
+_DIGITS = re.compile(r"\d+")
+
+_metrics = {
+    "documents": 0,
+    "tokens_before": 0,
+    "tokens_after": 0,
+}
+
+
+@dataclass
+class PreparedText:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    chunks_total: int
+    chunks_kept: int
+
+
+def normalize_page(text: str) -> str:
+    """Nettoie le texte d'une page OCR : unicode, espaces et lignes parasites"""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _CONTROL_CHARS.sub("", text)
+    lines = []
+    for line in text.splitlines():
+        line = _REPEATED_PUNCT.sub(r"\1", line)
+        line = _SPACES.sub(" ", line).strip()
+        if not line:
+            if lines and lines[-1]:
+                lines.append("")
+            continue
+        # Lignes composées presque uniquement de symboles : bruit de scan
+        alnum = sum(c.isalnum() for c in line)
+        if alnum < 2 or alnum / len(line) < 0.4:
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def strip_repeated_lines(pages: List[str]) -> List[str]:
+    """
+    Supprime les en-têtes et pieds de page présents sur plusieurs pages
+    (la première occurrence est conservée)
+    """
+    if len(pages) < 2:
+        return pages
+
+    def key(line):
+        # "Page 1/3" et "Page 2/3" doivent être considérées identiques
+        return _DIGITS.sub("#", line.lower())
+
+    split_pages = [page.splitlines() for page in pages]
+    counts = Counter()
+    for lines in split_pages:
+        edges = lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]
+        counts.update({key(line) for line in edges if line})
+
+    threshold = max(2, math.ceil(len(pages) / 2))
+    repeated = {k for k, n in counts.items() if n >= threshold}
+    if not repeated:
+        return pages
+
+    seen = set()
+    result = []
+    for lines in split_pages:
+        kept = []
+        for index, line in enumerate(lines):
+            k = key(line)
+            is_edge = index < HEADER_FOOTER_LINES or index >= len(lines) - HEADER_FOOTER_LINES
+            if is_edge and k in repeated:
+                if k in seen:
+                    continue
+                seen.add(k)
+            kept.append(line)
+        result.append("\n".join(kept))
+    return result
+
+
+def _split_chunks(text: str) -> List[str]:
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        return [chunk for chunk in text.split("\n\n") if chunk.strip()]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=0)
+    return splitter.split_text(text)
+
+
+def _score_chunk(chunk: str, index: int, total: int) -> float:
+    score = sum(weight * len(pattern.findall(chunk)) for pattern, weight in _SIGNALS)
+    score -= sum(weight * len(pattern.findall(chunk)) for pattern, weight in _NOISE_SIGNALS)
+    # Les parties sont en haut du document, les totaux souvent en bas
+    if index == 0:
+        score += 5
+    elif index == total - 1:
+        score += 2
+    return score
+
+
+def prepare_invoice_text(pages: List[str], token_budget: Optional[int] = None) -> PreparedText:
+    """
+    Prépare le texte OCR d'un document pour l'envoyer au LLM
+
+    Args:
+        pages: Texte OCR brut de chaque page, dans l'ordre
+        token_budget: Nombre maximum de tokens (OCR_TEXT_TOKEN_BUDGET par défaut)
+
+    Returns:
+        Le texte sélectionné et les compteurs de tokens avant/après
+    """
+    budget = token_budget or OCR_TEXT_TOKEN_BUDGET
+    raw_text = "\n".join(pages)
+    tokens_before = count_tokens(raw_text)
+
+    cleaned = strip_repeated_lines([normalize_page(page) for page in pages])
+    text = "\n\n".join(page for page in cleaned if page)
+    chunks = _split_chunks(text)
+
+    # Sélection des morceaux les plus utiles dans la limite du budget,
+    # puis remise dans l'ordre du document
+    ranked = sorted(
+        range(len(chunks)),
+        key=lambda i: _score_chunk(chunks[i], i, len(chunks)),
+        reverse=True
+    )
+    selected = []
+    used = 0
+    for i in ranked:
+        tokens = count_tokens(chunks[i])
+        if used + tokens > budget:
+            continue
+        selected.append(i)
+        used += tokens
+
+    prepared = "\n".join(chunks[i] for i in sorted(selected))
+    tokens_after = count_tokens(prepared)
+
+    _metrics["documents"] += 1
+    _metrics["tokens_before"] += tokens_before
+    _metrics["tokens_after"] += tokens_after
+    logger.info(
+        f"Prepared OCR text: {tokens_before} -> {tokens_after} tokens "
+        f"({len(selected)}/{len(chunks)} chunks kept, budget {budget})"
+    )
+
+    return PreparedText(
+        text=prepared,
+        tokens_before=tokens_before,
+        tokens_after=tokens_after,
+        chunks_total=len(chunks),
+        chunks_kept=len(selected),
+    )
+
+
+def get_metrics() -> dict:
+    """Compteurs cumulés de tokens avant/après préparation"""
+    before = _metrics["tokens_before"]
+    return {
+        **_metrics,
+        "reduction_ratio": round(1 - _metrics["tokens_after"] / before, 3) if before else None,
+    }
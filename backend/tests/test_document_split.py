@@ -0,0 +1,55 @@
+"""Découpage des PDF de plusieurs factures (services/document_split.py)"""
+from services.document_split import page_marker, should_examine, split_pages
+
+
+def test_page_marker():
+    assert page_marker("Page 2/3") == (2, 3)
+    assert page_marker("page 1 sur 4") == (1, 4)
+    assert page_marker("Page 3 of 3") == (3, 3)
+    assert page_marker("Page 4/3") is None
+    assert page_marker("Merci de votre confiance") is None
+
+
+def test_pagination_starts_new_invoices():
+    edges = ["Facture\nPage 1/2", "Page 2/2", "Facture\nPage 1/1", "Facture\nPage 1/2", "Page 2/2"]
+    assert split_pages(edges) == [[1, 2], [3], [4, 5]]
+
+
+def test_new_invoice_number_starts_new_invoice():
+    edges = ["FACTURE N° F-2024-001", "Conditions générales", "FACTURE N° F-2024-002"]
+    assert split_pages(edges) == [[1, 2], [3]]
+
+
+def test_same_invoice_number_continues_invoice():
+    edges = ["FACTURE N° F-2024-001", "FACTURE N° F-2024-001", "FACTURE N° F-2024-001"]
+    assert split_pages(edges) == [[1, 2, 3]]
+
+
+def test_continuation_page_wins_over_invoice_number():
+    # "Page 2/2" prolonge toujours la facture en cours, même avec un autre numéro lu
+    edges = ["FACTURE N° F-2024-001\nPage 1/2", "Réf. commande N° 2024-118\nPage 2/2"]
+    assert split_pages(edges) == [[1, 2]]
+
+
+def test_number_without_current_number_continues_invoice():
+    edges = ["Relevé de prestations", "FACTURE N° F-2024-001"]
+    assert split_pages(edges) == [[1, 2]]
+
+
+def test_should_examine_on_short_pagination():
+    assert should_examine("Facture\nPage 1/2", "Page 2/2", 6)
+    assert not should_examine("Facture\nPage 1/6", "Page 6/6", 6)
+
+
+def test_should_examine_on_last_page_marker():
+    assert should_examine("Facture", "Page 2/2", 6)
+    assert not should_examine("Facture", "Page 6/6", 6)
+
+
+def test_should_examine_on_invoice_numbers():
+    assert should_examine("FACTURE N° F-2024-001", "FACTURE N° F-2024-009", 4)
+    assert not should_examine("FACTURE N° F-2024-001", "FACTURE N° F-2024-001", 4)
+
+
+def test_single_invoice_is_not_examined():
+    assert not should_examine("FACTURE N° F-2024-001", "Annexe : détail des prestations", 4)
@@ -0,0 +1,79 @@
+"""Extraction des champs par règles (services/field_extraction.py)"""
+from datetime import datetime
+
+import pytest
+
+from services.field_extraction import extract_candidates, parse_amount
+
+
+def amount(text: str):
+    return extract_candidates(text).fields.get("amount")
+
+
+@pytest.mark.parametrize("text", [
+    # TVA mentionnée après le total, sur la même ligne
+    "Total TTC 1 250,00 € dont TVA 208,33 €",
+    "Montant TTC : 1 250,00 EUR (dont T.V.A. 208,33)",
+    "Net à payer 1 250,00 € TVA 20 % incluse : 208,33 €",
+    # Récapitulatif HT / TVA / TTC sur trois lignes
+    "Total HT 1 041,67 €\nTVA 20 % 208,33 €\nTotal TTC 1 250,00 €",
+    # Étiquette et montant sur deux lignes (tableau)
+    "Total TTC\n1 250,00 €",
+    "Total TVA 208,33 €\nNet à payer : 1.250,00 €",
+])
+def test_amount_is_the_total_not_the_vat(text):
+    candidate = amount(text)
+    assert candidate is not None
+    assert candidate.value == 1250.0
+
+
+def test_generic_total_does_not_reinforce_the_same_line():
+    candidate = amount("Total TTC 1 250,00 € dont TVA 208,33 €")
+    assert candidate.rule == "amount_label"
+    assert candidate.confidence == 0.92
+
+
+def test_generic_total_ignores_vat_and_ht_totals():
+    candidate = amount("Total HT 1 041,67 €\nTotal TVA 208,33 €\nTotal 1 250,00 €")
+    assert candidate.value == 1250.0
+    assert candidate.confidence == 0.5
+
+
+def test_amount_after_a_rate_only_is_not_read():
+    # Le seul montant suit le taux de TVA : rien de sûr, le LLM tranchera
+    assert amount("Total TTC (TVA 20 %) voir annexe 208,33") is None
+
+
+def test_different_totals_lower_the_confidence():
+    candidate = amount("Total TTC 1 000,00 €\nTotal TTC 1 250,00 €")
+    assert candidate.value == 1250.0
+    assert candidate.confidence < 0.85
+
+
+@pytest.mark.parametrize("integer, decimals, expected", [
+    ("1 250", "00", 1250.0),
+    ("1.250", "5", 1250.5),
+    ("980", None, 980.0),
+])
+def test_parse_amount(integer, decimals, expected):
+    assert parse_amount(integer, decimals) == expected
+
+
+def test_full_invoice_skips_the_llm():
+    text = "\n".join([
+        "Facture n° F-2024-0042",
+        "Date de facture : 02/09/2024",
+        "Client : Acme Industries SAS",
+        "12 rue de la Paix",
+        "75002 Paris",
+        "Total HT 1 041,67 €",
+        "TVA 20 % 208,33 €",
+        "Total TTC 1 250,00 € dont TVA 208,33 €",
+        "Date d'échéance : 02/10/2024",
+    ])
+    result = extract_candidates(text).to_ocr_result()
+    assert result is not None
+    assert result.invoice_number == "F-2024-0042"
+    assert result.client == "Acme Industries SAS"
+    assert result.amount == 1250.0
+    assert result.due_date == datetime(2024, 10, 2)
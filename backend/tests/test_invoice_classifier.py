@@ -0,0 +1,49 @@
+"""Reconnaissance locale des factures (services/invoice_classifier.py)"""
+from services.invoice_classifier import classify
+
+INVOICE = """DUPONT CONSEIL SARL - SIRET 732 829 320 00074
+FACTURE N° F-2024-0042
+Date de facture : 15/03/2024
+Client : Acme Industries SAS
+Total HT 1 041,67 €
+TVA 20 % 208,33 €
+Total TTC 1 250,00 €
+Date d'échéance : 14/04/2024
+IBAN FR76 3000 6000 0112 3456 7890 189
+Pénalités de retard : trois fois le taux d'intérêt légal"""
+
+
+def test_complete_invoice_is_accepted():
+    result = classify(INVOICE)
+    assert result.is_invoice is True
+
+
+def test_quote_is_never_accepted_locally():
+    result = classify(INVOICE.replace("FACTURE", "DEVIS"))
+    assert result.ambiguous
+
+
+def test_invoice_referring_to_a_quote_is_not_rejected():
+    # Score sous le seuil de rejet à cause de "devis", mais des signaux de facture : le LLM tranche
+    text = ("Facture suite à votre devis du 3 mars pour la mission de conseil réalisée en avril "
+            "auprès de vos équipes, merci de votre confiance et à bientôt")
+    result = classify(text)
+    assert result.score <= 1.5
+    assert "quote" in result.signals and "facture" in result.signals
+    assert result.ambiguous
+
+
+def test_lookalike_without_invoice_signal_is_rejected():
+    text = ("Devis pour la refonte du site internet : maquettes, développement et mise en ligne, "
+            "valable trente jours à compter de ce jour, bon pour accord")
+    assert classify(text).is_invoice is False
+
+
+def test_document_without_any_signal_is_rejected():
+    text = ("Madame, Monsieur, nous vous remercions pour votre visite de la semaine dernière et restons "
+            "à votre disposition pour toute question concernant notre offre")
+    assert classify(text).is_invoice is False
+
+
+def test_short_text_is_left_to_the_llm():
+    assert classify("Facture 42").ambiguous
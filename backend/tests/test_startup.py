@@ -0,0 +1,26 @@
+"""Budget de démarrage à froid de l'API (benchmarks/startup.py)"""
+import pytest
+
+# L'import de `main` a besoin des dépendances de l'application
+pytest.importorskip("fastapi")
+pytest.importorskip("supabase")
+
+from benchmarks.startup import FIRST_REQUEST_BUDGET_MS, IMPORT_BUDGET_MS, run_probe
+
+
+@pytest.fixture(scope="module")
+def probe():
+    return run_probe()
+
+
+def test_first_request_succeeds(probe):
+    assert probe["status"] == 200
+
+
+def test_startup_within_budget(probe):
+    assert probe["import_ms"] <= IMPORT_BUDGET_MS
+    assert probe["first_request_ms"] <= FIRST_REQUEST_BUDGET_MS
+
+
+def test_heavy_modules_are_loaded_lazily(probe):
+    assert probe["heavy_modules"] == []
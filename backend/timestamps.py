@@ -0,0 +1,43 @@
+"""
+Parsing et formatage des dates ISO-8601, partagés par les modèles et la couche base.
+
+Supabase renvoie les timestamps sous plusieurs formes ('2024-02-13T00:00:00+00:00',
+'2024-02-13 00:00:00+00', avec ou sans fraction de seconde) : `datetime.fromisoformat`
+(implémenté en C) les accepte toutes depuis Python 3.11, sans essayer plusieurs
+formats `strptime` à la suite.
+"""
+from datetime import date, datetime, timezone
+from typing import Optional, Union
+
+DateLike = Union[datetime, date, str, None]
+
+def parse_datetime(value: DateLike) -> Optional[datetime]:
+    """
+    Convertit une valeur venant de la base ou d'une requête en datetime avec fuseau.
+    Les dates sans fuseau sont considérées en UTC.
+
+    Raises:
+        ValueError: si la chaîne n'est pas au format ISO-8601
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, date):
+        dt = datetime(value.year, value.month, value.day)
+    elif isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid datetime format: {value}")
+    else:
+        raise ValueError(f"Invalid datetime format: {value!r}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def format_datetime(value: DateLike) -> Optional[str]:
+    """Chaîne ISO-8601 à écrire en base ; les chaînes sont renvoyées telles quelles"""
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat()
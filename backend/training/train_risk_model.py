@@ -0,0 +1,123 @@
+"""
+Entraînement hors ligne du modèle de risque (services/risk_model.py).
+
+Parcourt les factures historiques, garde celles dont l'issue est connue et
+écrit l'artefact JSON chargé par l'API au démarrage. Les seuls statuts qui
+existent sont Draft, Sent (envoyée pour signature) et Signed, plus les statuts
+techniques (OCR_*, Demo) ; aucun statut de paiement ou de refus n'est
+enregistré. On n'apprend donc que sur les factures réellement envoyées :
+
+- issue favorable (label 0) : facture signée (Signed)
+- défaut (label 1) : facture envoyée (Sent) et toujours pas signée
+  RISK_OUTCOME_GRACE_DAYS jours après son échéance
+- les autres (brouillons, envoyées encore dans le délai, démos, OCR) sont ignorées
+
+Les caractéristiques sont celles du scoring en ligne, calculées à la date de
+création de chaque facture, avec les données SIREN actuelles des entreprises.
+
+    cd backend && python -m training.train_risk_model [--output artifacts/risk_model.json]
+
+Le modèle est évalué sur un échantillon de validation (RISK_VALIDATION_SHARE)
+avant d'être réentraîné sur toutes les factures ; les métriques sont écrites
+dans l'artefact. Redémarrer l'API pour charger le nouveau modèle.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database.db import get_invoices_page, get_users_siren_numbers  # noqa: E402
+from services.risk_model import RISK_MODEL_PATH, build_features, evaluate, fit_logistic  # noqa: E402
+from services.scoring_service import get_siren_data_many  # noqa: E402
+from timestamps import parse_datetime  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+GRACE_DAYS = int(os.getenv("RISK_OUTCOME_GRACE_DAYS", "30"))
+VALIDATION_SHARE = float(os.getenv("RISK_VALIDATION_SHARE", "0.2"))
+L2 = float(os.getenv("RISK_L2", "1.0"))
+MIN_SAMPLES = 50
+PAGE_SIZE = 1000
+
+GOOD_STATUS = "Signed"
+# Seule une facture envoyée a pu être signée : un brouillon n'a pas d'issue
+SENT_STATUS = "Sent"
+COLUMNS = "id, user_id, amount, due_date, created_date, status, client_siren"
+
+
+def outcome(invoice: dict, now: datetime):
+    """1 si la facture a fait défaut, 0 si elle a abouti, None si l'issue n'est pas connue"""
+    status = invoice.get('status')
+    if status == GOOD_STATUS:
+        return 0
+    if status != SENT_STATUS or not invoice.get('due_date'):
+        return None
+    if parse_datetime(invoice['due_date']) + timedelta(days=GRACE_DAYS) < now:
+        return 1
+    return None
+
+
+async def load_history():
+    now = datetime.now(timezone.utc)
+    invoices, labels = [], []
+    after_id = None
+    while True:
+        page = await get_invoices_page(COLUMNS, after_id=after_id, limit=PAGE_SIZE)
+        if not page:
+            break
+        after_id = page[-1]['id']
+        for invoice in page:
+            label = outcome(invoice, now)
+            if label is not None and invoice.get('created_date'):
+                invoices.append(invoice)
+                labels.append(label)
+    return invoices, labels
+
+
+async def train(output: str):
+    import numpy as np
+
+    invoices, labels = await load_history()
+    if len(invoices) < MIN_SAMPLES:
+        raise SystemExit(f"Only {len(invoices)} invoices with a known outcome, need at least {MIN_SAMPLES}")
+
+    # Même choix de SIREN qu'au scoring : celui de l'utilisateur, sinon celui du client
+    user_sirens = await get_users_siren_numbers(sorted({i['user_id'] for i in invoices if i.get('user_id')}))
+    sirens = [user_sirens.get(i.get('user_id')) or i.get('client_siren') for i in invoices]
+    siren_data = await get_siren_data_many(sirens)
+
+    X = build_features(
+        invoices, sirens, siren_data,
+        as_of=[parse_datetime(i['created_date']) for i in invoices],
+    )
+    y = np.array(labels, dtype=float)
+
+    rng = np.random.default_rng(0)
+    validation = rng.random(len(y)) < VALIDATION_SHARE
+    metrics = evaluate(fit_logistic(X[~validation], y[~validation], l2=L2), X[validation], y[validation])
+    logger.info(f"Validation metrics: {metrics}")
+
+    model = fit_logistic(X, y, l2=L2)
+    model.metrics = {**metrics, "training_samples": int(len(y))}
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(model.to_dict(), f, indent=2)
+    logger.info(f"Risk model {model.version} written to {output}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Train the invoice risk model")
+    parser.add_argument("--output", default=RISK_MODEL_PATH)
+    args = parser.parse_args()
+    asyncio.run(train(args.output))
+
+
+if __name__ == "__main__":
+    main()